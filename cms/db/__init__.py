@@ -62,7 +62,7 @@ __all__ = [
     "Task", "Statement", "Attachment", "Dataset", "Manager", "Testcase",
     # submission
     "Submission", "File", "Token", "SubmissionResult", "Executable",
-    "Evaluation",
+    "Evaluation", "ParticipationTaskScore",
     # usertest
     "UserTest", "UserTestFile", "UserTestManager", "UserTestResult",
     "UserTestExecutable",
@@ -81,7 +81,7 @@ __all__ = [
 
 # Instantiate or import these objects.
 
-version = 44
+version = 46
 
 engine = create_engine(config.database, echo=config.database_debug,
                        pool_timeout=60, pool_recycle=120)
@@ -100,7 +100,7 @@ from .contest import Contest, Announcement
 from .user import User, Team, Participation, Message, Question
 from .task import Task, Statement, Attachment, Dataset, Manager, Testcase
 from .submission import Submission, File, Token, SubmissionResult, \
-    Executable, Evaluation
+    Executable, Evaluation, ParticipationTaskScore
 from .usertest import UserTest, UserTestFile, UserTestManager, \
     UserTestResult, UserTestExecutable
 from .printjob import PrintJob
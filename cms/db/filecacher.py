@@ -27,9 +27,12 @@
 """
 
 import atexit
+import base64
+import errno
 import io
 import logging
 import os
+import re
 import tempfile
 import fcntl
 from abc import ABCMeta, abstractmethod
@@ -45,6 +48,11 @@ from cmscommon.digest import Digester
 logger = logging.getLogger(__name__)
 
 
+# The ioctl request that makes a file share the extents of another one
+# (a "reflink", or copy-on-write clone). See linux/fs.h.
+FICLONE = 0x40049409
+
+
 def copyfileobj(source_fobj, destination_fobj,
                 buffer_size=io.DEFAULT_BUFFER_SIZE):
     """Read all content from one file object and write it to another.
@@ -468,6 +476,139 @@ class NullBackend(FileCacherBackend):
         return list()
 
 
+class PeerBackend(FileCacherBackend):
+    """This backend wraps another one, trying first to fetch the files
+    from the local caches of other services (the peers).
+
+    When many Workers need the same files (e.g., the testcases of a
+    new task) only the first ones get them from the wrapped backend,
+    and the others can get them from the caches of the first ones.
+    Peers are only asked for the files they already have in their
+    caches, and the content received is verified against the digest.
+    All the other operations are delegated to the wrapped backend.
+
+    A peer must provide the RPC methods has_cached_file and
+    get_cached_file_chunk, that wrap the methods of FileCacher with
+    the same names.
+
+    """
+
+    # Maximum size of the content of each RPC response; it must be
+    # such that its base64 encoding fits in an RPC message.
+    CHUNK_SIZE = 512 * 1024  # 512 KiB
+
+    # Seconds to wait for a response of a peer.
+    TIMEOUT = 10.0
+
+    def __init__(self, backend, peers):
+        """Initialize the backend.
+
+        backend (FileCacherBackend): the backend to wrap.
+        peers ([RemoteServiceClient]): the services to ask files to.
+
+        """
+        self.backend = backend
+        self.peers = peers
+
+    def get_file(self, digest):
+        fobj = self._get_file_from_peers(digest)
+        if fobj is not None:
+            return fobj
+        return self.backend.get_file(digest)
+
+    def _get_file_from_peers(self, digest):
+        """Fetch a file from the first peer that has it in its cache.
+
+        digest (str): the digest of the file to fetch.
+
+        return (fileobj|None): a readable binary file-like object with
+            the content of the file, or None if no peer provided it.
+
+        """
+        # Ask all the peers at once whether they have the file, which
+        # is cheap, and download it from the first to answer yes (and
+        # from the others, one at a time, if that fails).
+        pending = dict()
+        for peer in self.peers:
+            if peer.connected:
+                result = peer.has_cached_file(digest=digest)
+                pending[result] = peer
+        while len(pending) > 0:
+            ready = gevent.wait(list(pending.keys()), timeout=self.TIMEOUT,
+                                count=1)
+            if len(ready) == 0:
+                break
+            for result in ready:
+                peer = pending.pop(result)
+                if not result.successful() or not result.value:
+                    continue
+                fobj = self._download(peer, digest)
+                if fobj is not None:
+                    return fobj
+        return None
+
+    def _download(self, peer, digest):
+        """Download a file from a peer, verifying its digest.
+
+        peer (RemoteServiceClient): the peer.
+        digest (str): the digest of the file.
+
+        return (fileobj|None): a readable binary file-like object with
+            the content of the file, or None if the download failed.
+
+        """
+        fobj = tempfile.TemporaryFile(dir=config.temp_dir)
+        digester = Digester()
+        try:
+            while True:
+                result = peer.get_cached_file_chunk(digest=digest,
+                                                    offset=fobj.tell())
+                chunk = result.get(timeout=self.TIMEOUT)
+                if chunk is None:
+                    # The peer evicted the file in the meantime.
+                    raise KeyError("File evicted by the peer.")
+                data = base64.b64decode(chunk["data"])
+                digester.update(data)
+                fobj.write(data)
+                if chunk["eof"]:
+                    break
+        except (Exception, gevent.Timeout) as error:
+            logger.warning("Cannot download file %s from %s: %r.",
+                           digest, peer.remote_service_coord, error)
+            fobj.close()
+            return None
+
+        if digester.digest() != digest:
+            logger.error("File %s downloaded from %s has wrong digest %s.",
+                         digest, peer.remote_service_coord,
+                         digester.digest())
+            fobj.close()
+            return None
+
+        logger.debug("File %s downloaded from %s.",
+                     digest, peer.remote_service_coord)
+        fobj.seek(0)
+        return fobj
+
+    def create_file(self, digest):
+        return self.backend.create_file(digest)
+
+    def commit_file(self, fobj, digest, desc=""):
+        return self.backend.commit_file(fobj, digest, desc)
+
+    def describe(self, digest):
+        return self.backend.describe(digest)
+
+    def get_size(self, digest):
+        return self.backend.get_size(digest)
+
+    def delete(self, digest):
+        self.backend.delete(digest)
+
+    def list(self):
+        return self.backend.list()
+
+
 class FileCacher:
     """This class implement a local cache for files stored as FSObject
     in the database.
@@ -488,7 +629,14 @@ class FileCacher:
     # CHUNK_SIZE should be a multiple of these values.
     CHUNK_SIZE = 16 * 1024  # 16 KiB
 
-    def __init__(self, service=None, path=None, null=False):
+    # When the local cache exceeds its maximum size, files are evicted
+    # until its size is below this fraction of the maximum, so that
+    # the eviction (which scans the whole cache) is not triggered again
+    # at the next file.
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, service=None, path=None, null=False,
+                 max_cache_size=None):
         """Initialize.
 
         By default the database-powered backend will be used, but this
@@ -506,10 +654,28 @@ class FileCacher:
         null (bool): if True, back the FileCacher with a NullBackend,
             that just discards every file it receives. This setting
             takes priority over path.
+        max_cache_size (int|None): the maximum size, in bytes, of the
+            local cache; when it is exceeded, the least recently used
+            files are removed from it. If None, use the value in the
+            configuration for shared caches, and no limit otherwise.
 
         """
         self.service = service
 
+        if max_cache_size is None and self.is_shared():
+            max_cache_size = config.file_cache_max_size * 1024 * 1024
+        # A limit of 0 means no limit.
+        self.max_cache_size = max_cache_size or None
+        # The estimated size of the local cache, in bytes, or None if
+        # it has not been computed yet. Other processes may add files
+        # to a shared cache, hence this is refreshed at each eviction.
+        self._cache_size = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
         if null:
             self.backend = NullBackend()
         elif path is None:
@@ -594,13 +760,20 @@ class FileCacher:
 
         if cache_only:
             if os.path.exists(cache_file_path):
+                self.hits += 1
+                self._touch(cache_file_path)
                 return
         else:
             try:
-                return open(cache_file_path, 'rb')
+                fd = open(cache_file_path, 'rb')
             except FileNotFoundError:
                 pass
+            else:
+                self.hits += 1
+                self._touch(cache_file_path)
+                return fd
 
+        self.misses += 1
         logger.debug("File %s not in cache, downloading "
                      "from database.", digest)
 
@@ -620,13 +793,167 @@ class FileCacher:
 
         # Then move it to its real location (this operation is atomic
         # by POSIX requirement)
+        size = os.stat(temp_file_path).st_size
         os.rename(temp_file_path, cache_file_path)
 
         logger.debug("File %s downloaded.", digest)
+        self._account_new_file(digest, size)
 
         if not cache_only:
             return fd
 
+    def _touch(self, cache_file_path):
+        """Mark a file in the local cache as recently used.
+
+        The eviction uses the modification time of the files, since
+        the access time is not updated on most file systems.
+
+        cache_file_path (str): the path of the file in the cache.
+
+        """
+        if self.max_cache_size is None:
+            return
+        try:
+            os.utime(cache_file_path)
+        except OSError:
+            # The file might have been evicted in the meantime.
+            pass
+
+    def _account_new_file(self, digest, size):
+        """Take into account a file just added to the local cache,
+        evicting other files if the cache became too big.
+
+        digest (str): the digest of the new file, that is not evicted.
+        size (int): the size of the new file, in bytes.
+
+        """
+        if self.max_cache_size is None:
+            return
+        if self._cache_size is not None:
+            self._cache_size += size
+            if self._cache_size <= self.max_cache_size:
+                return
+        self._evict(digest)
+
+    def _evict(self, keep=None):
+        """Remove the least recently used files from the local cache,
+        until its size is below the target.
+
+        Files are removed with unlink, hence readers that already
+        opened them (see _load) and hard links to them are unaffected.
+
+        keep (str|None): the digest of a file that must not be removed.
+
+        """
+        files = []
+        total_size = 0
+        with os.scandir(self.file_dir) as entries:
+            for entry in entries:
+                if entry.name == "cache_lock":
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                total_size += stat.st_size
+                if entry.name != keep:
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        if total_size > self.max_cache_size:
+            target_size = self.max_cache_size * self.EVICTION_TARGET
+            files.sort()
+            evicted = 0
+            for _, name, size in files:
+                if total_size <= target_size:
+                    break
+                try:
+                    os.unlink(os.path.join(self.file_dir, name))
+                except FileNotFoundError:
+                    # Evicted by another process.
+                    pass
+                except OSError:
+                    logger.warning("Cannot evict file %s from the cache.",
+                                   name, exc_info=True)
+                    continue
+                else:
+                    evicted += 1
+                    self.evictions += 1
+                    self.evicted_bytes += size
+                total_size -= size
+            logger.info("Evicted %d files from the cache, now %d bytes.",
+                        evicted, total_size)
+
+        self._cache_size = total_size
+
+    def get_stats(self):
+        """Return statistics on the usage of the local cache.
+
+        return ({str: int|None}): the number of accesses to files that
+            were in the local cache (hits) or had to be fetched from
+            the backend (misses), the number and total size of the
+            files evicted, the estimated size of the cache (None if
+            unknown) and its maximum size (None if unbounded).
+
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "size": self._cache_size,
+            "max_size": self.max_cache_size,
+        }
+
+    def has_cached_file(self, digest):
+        """Return whether a file is in the local cache.
+
+        digest (str): the digest of the file.
+
+        return (bool): whether get_cached_file_chunk can serve the
+            file (unless it is evicted in the meantime).
+
+        """
+        # The digest comes from another service, make sure it does
+        # not point outside the cache.
+        if re.fullmatch("[0-9a-f]+", digest) is None:
+            return False
+        return os.path.isfile(os.path.join(self.file_dir, digest))
+
+    def get_cached_file_chunk(self, digest, offset):
+        """Return part of a file, only if it is in the local cache.
+
+        This is meant to serve the files to the PeerBackend of other
+        services, hence it never asks the backend for the file.
+
+        digest (str): the digest of the file.
+        offset (int): the position of the first byte to return.
+
+        return ({str: str|bool}|None): the base64 encoding of (at most)
+            PeerBackend.CHUNK_SIZE bytes of the file starting at
+            offset (data) and whether they reach the end of the file
+            (eof), or None if the file is not in the local cache.
+
+        raise (ValueError): if offset is not a non-negative integer.
+
+        """
+        if not isinstance(offset, int) or isinstance(offset, bool) \
+                or offset < 0:
+            raise ValueError("Invalid offset %r." % (offset,))
+        # The digest comes from another service, make sure it does
+        # not point outside the cache.
+        if re.fullmatch("[0-9a-f]+", digest) is None:
+            return None
+        try:
+            with open(os.path.join(self.file_dir, digest), "rb") as f:
+                f.seek(offset)
+                data = f.read(PeerBackend.CHUNK_SIZE)
+        except FileNotFoundError:
+            return None
+        return {"data": base64.b64encode(data).decode("ascii"),
+                "eof": len(data) < PeerBackend.CHUNK_SIZE}
+
     def cache_file(self, digest):
         """Load a file into the cache.
 
@@ -731,6 +1058,60 @@ class FileCacher:
             with open(dst_path, 'wb') as dst:
                 copyfileobj(src, dst, self.CHUNK_SIZE)
 
+    def link_file_to_path(self, digest, dst_path):
+        """Make a file available at a path without copying its content.
+
+        See `get_file'. This method will try to create dst_path as a
+        hard link to the copy of the file in the local cache and, if
+        that fails, as a reflink (a copy-on-write clone) of it. Both
+        require dst_path to be on the same file system as the cache.
+
+        Since a hard link shares the inode with the cache, the file
+        is made readable and executable, but not writable, by anyone:
+        the caller must never write to dst_path nor give write
+        permissions on it, but should rather replace it with a copy.
+
+        digest (unicode): the digest of the file to get.
+        dst_path (string): a location on the file-system, that must not
+            exist yet, where to make the file available.
+
+        return (bool): True if dst_path was created, False if neither
+            hard links nor reflinks were possible, in which case the
+            caller should fall back to copying the file.
+
+        raise (KeyError): if the file cannot be found.
+        raise (TombstoneError): if the digest is the tombstone
+
+        """
+        if digest == Digest.TOMBSTONE:
+            raise TombstoneError()
+        with self.get_file(digest) as src:
+            # The cached copy might have been deleted after we opened
+            # it, in which case we can still clone it through the file
+            # descriptor.
+            try:
+                os.link(os.path.join(self.file_dir, digest), dst_path)
+            except OSError as error:
+                logger.debug("Cannot hard link file %s: %s.", digest, error)
+            else:
+                os.chmod(dst_path, 0o555)
+                return True
+
+            dst_fd = os.open(dst_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                             0o555)
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src.fileno())
+            except OSError as error:
+                os.unlink(dst_path)
+                if error.errno not in (errno.EOPNOTSUPP, errno.EXDEV,
+                                       errno.EINVAL, errno.ENOTTY):
+                    raise
+                logger.debug("Cannot reflink file %s: %s.", digest, error)
+                return False
+            finally:
+                os.close(dst_fd)
+            return True
+
     def put_file_from_fobj(self, src, desc=""):
         """Store a file in the storage.
 
@@ -792,8 +1173,10 @@ class FileCacher:
                     copyfileobj(src, fobj, self.CHUNK_SIZE)
                     self.backend.commit_file(fobj, digest, desc)
 
+            size = os.stat(dst.name).st_size
             os.rename(dst.name, cache_file_path)
 
+        self._account_new_file(digest, size)
         return digest
 
     def put_file_content(self, content, desc=""):
@@ -892,6 +1275,7 @@ class FileCacher:
 
         """
         self.destroy_cache()
+        self._cache_size = None
         if not mkdir(config.cache_dir) or not mkdir(self.file_dir):
             logger.error("Cannot create necessary directories.")
             raise RuntimeError("Cannot create necessary directories.")
@@ -750,3 +750,73 @@ class Evaluation(Base):
     def codename(self):
         """Return the codename of the testcase."""
         return self.testcase.codename
+
+
+class ParticipationTaskScore(Base):
+    """Class to store the scores of a participation on a task.
+
+    It caches what task_score computes from all the submissions of the
+    participation on the task, so that it does not have to be computed
+    again at every request. It is kept up to date by who changes the
+    submissions (see cms.grading.scoring.update_task_scores); the
+    scores are valid only if they were computed on the active dataset
+    and with the score mode of the task.
+
+    It is not reachable from the other objects, so that it is not
+    exported in the dumps.
+
+    """
+    __tablename__ = 'participation_task_scores'
+
+    # Primary key is (participation_id, task_id).
+    participation_id = Column(
+        Integer,
+        ForeignKey(Participation.id,
+                   onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True)
+    participation = relationship(
+        Participation)
+
+    task_id = Column(
+        Integer,
+        ForeignKey(Task.id,
+                   onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+        index=True)
+    task = relationship(
+        Task)
+
+    # Dataset (id and object) the scores were computed on; None if
+    # they are not valid anymore.
+    dataset_id = Column(
+        Integer,
+        ForeignKey(Dataset.id,
+                   onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=True)
+    dataset = relationship(
+        Dataset)
+
+    # Score mode the scores were computed with.
+    score_mode = Column(
+        Unicode,
+        nullable=True)
+
+    # The scores (not rounded): the full one, the one discoverable
+    # from the public testcases and the one limited to the tokened
+    # submissions; and whether some submissions were not scored yet.
+    score = Column(
+        Float,
+        nullable=False,
+        default=0.0)
+    public_score = Column(
+        Float,
+        nullable=False,
+        default=0.0)
+    tokened_score = Column(
+        Float,
+        nullable=False,
+        default=0.0)
+    partial = Column(
+        Boolean,
+        nullable=False,
+        default=False)
@@ -214,6 +214,15 @@ class Task(Base):
         nullable=False,
         default=SCORE_MODE_MAX_TOKENED_LAST)
 
+    # Whether evaluations of a submission on a dataset can be copied
+    # from the ones on another dataset having a testcase with the same
+    # input and output, the same evaluation parameters and managers,
+    # instead of being executed again.
+    reuse_evaluations = Column(
+        Boolean,
+        nullable=False,
+        default=True)
+
     # Active Dataset (id and object) currently being used for scoring.
     # The ForeignKeyConstraint for this column is set at table-level.
     active_dataset_id = Column(
@@ -558,15 +558,27 @@ class EvaluationJob(Job):
         # only if it is True.
 
         sr.evaluations += [Evaluation(
-            text=self.text,
-            outcome=self.outcome,
-            execution_time=self.plus.get('execution_time'),
-            execution_wall_clock_time=self.plus.get(
+            testcase=sr.dataset.testcases[self.operation.testcase_codename],
+            **self.get_evaluation_values())]
+
+    def get_evaluation_values(self):
+        """Return the values of the Evaluation storing the job result.
+
+        return ({str: object}): the values of the columns of the
+            Evaluation, except for the ones identifying it (the
+            submission, dataset and testcase).
+
+        """
+        return {
+            "text": self.text,
+            "outcome": self.outcome,
+            "execution_time": self.plus.get('execution_time'),
+            "execution_wall_clock_time": self.plus.get(
                 'execution_wall_clock_time'),
-            execution_memory=self.plus.get('execution_memory'),
-            evaluation_shard=self.shard,
-            evaluation_sandbox=":".join(self.sandboxes),
-            testcase=sr.dataset.testcases[self.operation.testcase_codename])]
+            "execution_memory": self.plus.get('execution_memory'),
+            "evaluation_shard": self.shard,
+            "evaluation_sandbox": ":".join(self.sandboxes),
+        }
 
     @staticmethod
     def from_user_test(operation, user_test, dataset):
@@ -653,21 +665,73 @@ class EvaluationJob(Job):
 
 
 class JobGroup:
-    """A simple collection of jobs."""
+    """A simple collection of jobs.
+
+    When exported, consecutive evaluation jobs that differ only in the
+    testcase (that is, the evaluations of the same executable on many
+    testcases) are encoded as a single multi-testcase job, holding the
+    common data only once and a list with the data of each testcase.
+
+    """
+
+    # Keys of an exported evaluation job that must be equal for it to
+    # be part of a multi-testcase job.
+    MULTI_TESTCASE_SHARED_KEYS = [
+        "task_type", "task_type_parameters", "language",
+        "multithreaded_sandbox", "keep_sandbox", "files", "managers",
+        "executables", "time_limit", "memory_limit", "only_execution",
+        "get_output"]
 
     def __init__(self, jobs=None):
         self.jobs = jobs if jobs is not None else []
 
     def export_to_dict(self):
+        exported_jobs = []
+        for job in self.jobs:
+            data = job.export_to_dict()
+            last = exported_jobs[-1] if len(exported_jobs) > 0 else None
+            if data["type"] != "evaluation":
+                exported_jobs.append(data)
+            elif last is not None and last["type"] == "multi_evaluation" \
+                    and JobGroup._same_executable(last["shared"], data):
+                last["testcases"].append(JobGroup._testcase_data(data))
+            elif last is not None and last["type"] == "evaluation" \
+                    and JobGroup._same_executable(last, data):
+                exported_jobs[-1] = {
+                    "type": "multi_evaluation",
+                    "shared": dict(
+                        (key, last[key])
+                        for key in JobGroup.MULTI_TESTCASE_SHARED_KEYS),
+                    "testcases": [JobGroup._testcase_data(last),
+                                  JobGroup._testcase_data(data)],
+                }
+            else:
+                exported_jobs.append(data)
         return {
-            "jobs": [job.export_to_dict() for job in self.jobs],
+            "jobs": exported_jobs,
         }
 
+    @staticmethod
+    def _same_executable(data, other_data):
+        return all(data[key] == other_data[key]
+                   for key in JobGroup.MULTI_TESTCASE_SHARED_KEYS)
+
+    @staticmethod
+    def _testcase_data(data):
+        return dict((key, value) for key, value in data.items()
+                    if key not in JobGroup.MULTI_TESTCASE_SHARED_KEYS)
+
     @classmethod
     def import_from_dict(cls, data):
         jobs = []
         for job in data["jobs"]:
-            jobs.append(Job.import_from_dict_with_type(job))
+            if job["type"] == "multi_evaluation":
+                for testcase_data in job["testcases"]:
+                    job_data = dict(job["shared"])
+                    job_data.update(testcase_data)
+                    jobs.append(Job.import_from_dict_with_type(job_data))
+            else:
+                jobs.append(Job.import_from_dict_with_type(job))
         return cls(jobs)
 
     @staticmethod
@@ -24,6 +24,7 @@ import logging
 import os
 import resource
 import select
+import shutil
 import stat
 import tempfile
 import time
@@ -31,6 +32,7 @@ from abc import ABCMeta, abstractmethod
 from functools import wraps, partial
 
 import gevent
+import gevent.local
 from gevent import subprocess
 
 from cms import config, rmtree
@@ -213,6 +215,7 @@ class SandboxBase(metaclass=ABCMeta):
         self.inherit_env = []
         self.set_env = {}
         self.verbosity = 0
+        self.link_files = False
 
         self.max_processes = 1
 
@@ -360,11 +363,22 @@ class SandboxBase(metaclass=ABCMeta):
     def create_file_from_storage(self, path, digest, executable=False):
         """Write a file taken from FS in the sandbox.
 
+        If the sandbox is configured to link files, the file is linked
+        from the cache of the file cacher instead of being copied, and
+        it will be readable and executable but not writable (see
+        FileCacher.link_file_to_path); otherwise, or if linking is not
+        possible, it is copied.
+
         path (string): relative path of the file inside the sandbox.
         digest (string): digest of the file in FS.
         executable (bool): to set permissions.
 
         """
+        if self.link_files:
+            logger.debug("Linking file %s in sandbox.", path)
+            if self.file_cacher.link_file_to_path(
+                    digest, self.relative_path(path)):
+                return
         with self.create_file(path, executable) as dest_fobj:
             self.file_cacher.get_file_to_fobj(digest, dest_fobj)
 
@@ -827,6 +841,90 @@ class StupidSandbox(SandboxBase):
             rmtree(self._path)
 
 
+class IsolateBoxPool:
+    """A pool of isolate boxes, initialized ahead of time.
+
+    Initializing a box, and cleaning it up afterwards, requires running
+    isolate twice, which is a sizeable overhead for short jobs. An
+    IsolateSandbox created while the pool is enabled takes a box from
+    it, if one is free; when the sandbox is cleaned up, the pool does so
+    in the background, then initializes the box again and makes it
+    available to the next sandbox.
+
+    """
+
+    def __init__(self, box_ids):
+        """Initialization.
+
+        box_ids ([int]): the ids of the boxes the pool owns.
+
+        """
+        self.box_ids = set(box_ids)
+        self.size = len(box_ids)
+        # Boxes never used yet, that still need to be initialized.
+        self._unused = sorted(box_ids)
+        # Boxes initialized and ready to be used.
+        self._ready = []
+
+    def owns(self, box_id):
+        """Return whether the box belongs to the pool.
+
+        box_id (int): the id of the box.
+
+        return (bool): whether the box belongs to the pool.
+
+        """
+        return box_id in self.box_ids
+
+    def acquire(self):
+        """Take a free box from the pool.
+
+        return ((int|None, bool)): the id of the box (None if all boxes
+            are in use) and whether it is already initialized.
+
+        """
+        if len(self._ready) > 0:
+            return self._ready.pop(), True
+        if len(self._unused) > 0:
+            return self._unused.pop(0), False
+        return None, False
+
+    def give_back_uninitialized(self, box_id):
+        """Give back a box that could not be initialized.
+
+        box_id (int): the id of the box.
+
+        """
+        self._unused.append(box_id)
+
+    def release(self, sandbox, delete):
+        """Give back a box to the pool.
+
+        The sandbox is cleaned up and its box is initialized again in
+        the background; after that, the box is free again. If anything
+        fails, the box is left out of the pool until it is needed
+        again, when a new sandbox will try to initialize it from
+        scratch.
+
+        sandbox (IsolateSandbox): the sandbox that was using the box.
+        delete (bool): whether to delete the sandbox directory.
+
+        """
+        gevent.spawn(self._recycle, sandbox, delete)
+
+    def _recycle(self, sandbox, delete):
+        """Prepare the box of the sandbox for a new use, see release()."""
+        try:
+            sandbox._cleanup(delete=delete)
+            sandbox.initialize_isolate()
+        except Exception:
+            logger.error("Failed to recycle box %d.", sandbox.box_id,
+                         exc_info=True)
+            self.give_back_uninitialized(sandbox.box_id)
+        else:
+            self._ready.append(sandbox.box_id)
+
+
 class IsolateSandbox(SandboxBase):
     """This class creates, deletes and manages the interaction with a
     sandbox. The sandbox doesn't support concurrent operation, not
@@ -850,6 +948,16 @@ class IsolateSandbox(SandboxBase):
     # on the current directory.
     SECURE_COMMANDS = ["/bin/cp", "/bin/mv", "/usr/bin/zip", "/usr/bin/unzip"]
 
+    # The pools of initialized boxes, indexed by the first id of the range
+    # they belong to (see enable_box_pool).
+    box_pools = {}
+
+    # Greenlet-local storage for the job slot (see set_job_slot).
+    _job_slot = gevent.local.local()
+
+    # Number of job slots of each Worker (see set_job_slots).
+    job_slots = 1
+
     def __init__(self, file_cacher, name=None, temp_dir=None):
         """Initialization.
 
@@ -861,16 +969,31 @@ class IsolateSandbox(SandboxBase):
         # Isolate only accepts ids between 0 and 999 (by default). We assign
         # the range [(shard+1)*10, (shard+2)*10) to each Worker and keep the
         # range [0, 10) for other uses (command-line scripts like cmsMake or
-        # direct console users of isolate). Inside each range ids are assigned
-        # sequentially, with a wrap-around.
+        # direct console users of isolate). If a pool of boxes is enabled, it
+        # owns the first ids of the range, and we take one of them if we can.
+        # Otherwise, inside each range ids are assigned sequentially (among
+        # those not owned by the pool), with a wrap-around.
         # FIXME This is the only use of FileCacher.service, and it's an
         # improper use! Avoid it!
+        # A Worker running several jobs in parallel gives each of them a
+        # slot, and each slot has its own range (see set_job_slot).
         if file_cacher is not None and file_cacher.service is not None:
-            box_id = ((file_cacher.service.shard + 1) * 10
-                      + (IsolateSandbox.next_id % 10)) % 1000
+            slot = getattr(IsolateSandbox._job_slot, "slot", 0)
+            first_id = IsolateSandbox._first_box_id(
+                file_cacher.service.shard, slot)
         else:
-            box_id = IsolateSandbox.next_id % 10
-        IsolateSandbox.next_id += 1
+            first_id = 0
+        pool = IsolateSandbox.box_pools.get(first_id)
+        box_id, box_initialized = None, False
+        if pool is not None:
+            box_id, box_initialized = pool.acquire()
+        if box_id is None:
+            pool_size = pool.size if pool is not None else 0
+            box_id = first_id + pool_size \
+                + IsolateSandbox.next_id % (10 - pool_size)
+            IsolateSandbox.next_id += 1
+        # The pool to give back the box to, if it belongs to one.
+        self._pool = None
 
         # We create a directory "home" inside the outer temporary directory,
         # that will be bind-mounted to "/tmp" inside the sandbox (some
@@ -916,6 +1039,10 @@ class IsolateSandbox(SandboxBase):
         self.wallclock_timeout = None  # -w
         self.extra_timeout = None      # -x
 
+        # The sandboxed processes run as a different user, so they cannot
+        # write to files linked from the cache, which are owned by us.
+        self.link_files = config.link_sandbox_files
+
         self.add_mapped_directory(
             self._home, dest=self._home_dest, options="rw")
 
@@ -933,12 +1060,84 @@ class IsolateSandbox(SandboxBase):
         # particular, the System.Native assembly.
         self.maybe_add_mapped_directory("/etc/mono", options="noexec")
 
-        # Tell isolate to get the sandbox ready. We do our best to cleanup
-        # after ourselves, but we might have missed something if a previous
-        # worker was interrupted in the middle of an execution, so we issue an
-        # idempotent cleanup.
-        self.cleanup()
-        self.initialize_isolate()
+        # Tell isolate to get the sandbox ready, unless the pool already did.
+        # We do our best to cleanup after ourselves, but we might have missed
+        # something if a previous worker was interrupted in the middle of an
+        # execution, so we issue an idempotent cleanup.
+        if not box_initialized:
+            try:
+                self.cleanup()
+                self.initialize_isolate()
+            except Exception:
+                if pool is not None and pool.owns(box_id):
+                    pool.give_back_uninitialized(box_id)
+                raise
+        if pool is not None and pool.owns(box_id):
+            self._pool = pool
+
+    @classmethod
+    def _first_box_id(cls, shard, slot):
+        """Return the first id of the range of a job slot of a Worker.
+
+        Each Worker has job_slots consecutive ranges of 10 ids, one for
+        each slot, so that the ranges of different Workers (with the
+        same configuration) never overlap.
+
+        shard (int): the shard of the Worker.
+        slot (int): the job slot.
+
+        return (int): the first id of the range.
+
+        """
+        return ((shard * cls.job_slots + slot + 1) * 10) % 1000
+
+    @classmethod
+    def enable_box_pool(cls, shard, size, slot=0):
+        """Keep a pool of initialized boxes for the sandboxes to use.
+
+        shard (int): the shard of the Worker.
+        size (int): the number of boxes in the pool; at most 9, as there
+            are 10 ids for each range and at least one must be left for
+            the sandboxes that do not find a free box in the pool.
+        slot (int): the job slot whose range of ids the pool uses.
+
+        """
+        if size > 9:
+            logger.warning("Cannot have more than 9 boxes in the pool.")
+            size = 9
+        first_id = cls._first_box_id(shard, slot)
+        cls.box_pools[first_id] = IsolateBoxPool(
+            [first_id + i for i in range(size)])
+
+    @classmethod
+    def set_job_slots(cls, slots):
+        """Set the number of job slots of the Workers.
+
+        All the Workers must have the same number of slots, so that
+        their ranges of ids do not overlap.
+
+        slots (int): the number of jobs each Worker executes at the
+            same time.
+
+        """
+        cls.job_slots = slots
+
+    @classmethod
+    def set_job_slot(cls, slot):
+        """Set the job slot of the sandboxes created by this greenlet.
+
+        A Worker executing up to N jobs at the same time runs each of
+        them in its own greenlet, with a slot between 0 and N-1 that no
+        other running job has. The sandboxes of the job in slot k use
+        the k-th of the N ranges of ids of the Worker, so that they
+        never share a box with those of other jobs or other Workers;
+        also, isolate's configuration can pin each box to some CPUs,
+        giving each slot its own CPUs.
+
+        slot (int): the slot of the job the greenlet is running.
+
+        """
+        cls._job_slot.slot = slot
 
     def add_mapped_directory(self, src, dest=None, options=None,
                              ignore_if_not_existing=False):
@@ -963,13 +1162,45 @@ class IsolateSandbox(SandboxBase):
         return self.add_mapped_directory(src, dest, options,
                                          ignore_if_not_existing=True)
 
+    @staticmethod
+    def _is_linked_from_cache(path):
+        """Return whether a file shares its inode with the cache.
+
+        path (str): the path of the file on the host system.
+
+        return (bool): whether the file was linked by
+            create_file_from_storage (or has other hard links).
+
+        """
+        return os.path.isfile(path) and os.stat(path).st_nlink > 1
+
+    @staticmethod
+    def _unlink_from_cache(path):
+        """Replace a file linked from the cache with a private copy.
+
+        Files linked by create_file_from_storage share their inode with
+        the cache of the file cacher, hence we must never give write
+        permissions on them.
+
+        path (str): the path of the file on the host system.
+
+        """
+        if IsolateSandbox._is_linked_from_cache(path):
+            logger.debug("Copying linked file %s before allowing writing.",
+                         path)
+            temp_path = path + ".unlinked"
+            shutil.copyfile(path, temp_path)
+            os.rename(temp_path, path)
+
     def allow_writing_all(self):
         """Set permissions in such a way that any operation is allowed.
 
         """
         os.chmod(self._home, 0o777)
         for filename in os.listdir(self._home):
-            os.chmod(os.path.join(self._home, filename), 0o777)
+            path = os.path.join(self._home, filename)
+            self._unlink_from_cache(path)
+            os.chmod(path, 0o777)
 
     def allow_writing_none(self):
         """Set permissions in such a way that the user cannot write anything.
@@ -977,7 +1208,12 @@ class IsolateSandbox(SandboxBase):
         """
         os.chmod(self._home, 0o755)
         for filename in os.listdir(self._home):
-            os.chmod(os.path.join(self._home, filename), 0o755)
+            path = os.path.join(self._home, filename)
+            # The files linked from the cache are already read-only,
+            # and their mode is shared with the cache.
+            if self._is_linked_from_cache(path):
+                continue
+            os.chmod(path, 0o755)
 
     def allow_writing_only(self, inner_paths):
         """Set permissions in so that the user can write only some paths.
@@ -1016,6 +1252,7 @@ class IsolateSandbox(SandboxBase):
         # Close everything, then open only the specified.
         self.allow_writing_none()
         for path in outer_paths:
+            self._unlink_from_cache(path)
             os.chmod(path, 0o722)
 
     def get_root_path(self):
@@ -1419,7 +1656,21 @@ class IsolateSandbox(SandboxBase):
                 "Failed to initialize sandbox") from e
 
     def cleanup(self, delete=False):
-        """See Sandbox.cleanup()."""
+        """See Sandbox.cleanup().
+
+        If the box was taken from the pool, this returns immediately and
+        the box is given back to the pool, which will cleanup the sandbox
+        in the background.
+
+        """
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            pool.release(self, delete)
+        else:
+            self._cleanup(delete)
+
+    def _cleanup(self, delete=False):
+        """Actually cleanup the sandbox, see cleanup()."""
         # The user isolate assigns within the sandbox might have created
         # subdirectories and files therein, making the user outside the sandbox
         # unable to delete the whole tree. If the caller asked us to delete the
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A content-addressed cache of the results of compilations.
+
+Compiling the same sources, with the same managers, task type and
+compiler, gives the same result; this happens for example when a
+submission is compiled for several datasets, or when it is
+recompiled after an invalidation. The cache maps a key computed from
+all these inputs to the result of the compilation (the digests of the
+executables, the text and the stats), so that the Worker can skip
+compilations it has already done.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from cms import config
+from cms.db import Executable
+from cms.grading.Sandbox import Sandbox
+from cms.grading.languagemanager import get_language
+from cms.grading.tasktypes import get_task_type
+from cms.grading.tasktypes.util import is_manager_for_compilation
+
+
+logger = logging.getLogger(__name__)
+
+
+def _compiler_fingerprint(commands):
+    """Return a fingerprint of the programs used by some commands.
+
+    The fingerprint changes when any of the programs is replaced (for
+    example, when the compiler is upgraded), as it includes their
+    sizes and modification times.
+
+    commands ([[str]]): the commands.
+
+    return ([[str|int|None]]): for each command, the path of the
+        program it runs, its size and its modification time, or None
+        for the latter two if the program cannot be found.
+
+    """
+    res = []
+    for command in commands:
+        path = shutil.which(command[0])
+        size = mtime = None
+        if path is not None:
+            path = os.path.realpath(path)
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        res.append([command[0], path, size, mtime])
+    return res
+
+
+class CompilationCache:
+    """A cache of the results of compilation jobs, stored on disk.
+
+    Each entry is a JSON file in the cache directory, named after the
+    hash of the key of the compilation, so that the directory can be
+    shared among the Workers running on the same machine.
+
+    Only the results that depend just on the inputs are stored: the
+    successful compilations, and the ones that failed because the
+    compiler exited with an error. Timeouts, signals and failures of
+    the sandbox, that might be caused by the load of the machine, are
+    never cached. As a compiler can also fail because of the limits of
+    the sandbox, these are part of the inputs.
+
+    When there are too many entries, the least recently used ones are
+    removed.
+
+    """
+
+    # Fraction of the maximum number of entries to keep when evicting.
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, path, max_entries=None):
+        """Initialize the cache.
+
+        path (str): the directory where to store the entries; it is
+            created if it does not exist.
+        max_entries (int|None): the maximum number of entries, or None
+            for no limit.
+
+        """
+        self.path = path
+        self.max_entries = max_entries
+        # The estimated number of entries, or None if it has not been
+        # computed yet. Other Workers may add entries to the directory,
+        # hence this is refreshed at each eviction.
+        self._entries = None
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def _key(job):
+        """Return the key identifying the compilation of a job.
+
+        job (CompilationJob): the job.
+
+        return (str|None): the hash of all the inputs of the
+            compilation, or None if the job cannot be cached.
+
+        """
+        if job.language is None or job.keep_sandbox:
+            return None
+        language = get_language(job.language)
+        task_type = get_task_type(job.task_type, job.task_type_parameters)
+        commands = task_type.get_compilation_commands(
+            sorted(job.files.keys()))
+        if commands is None:
+            return None
+        commands = commands.get(language.name)
+        if commands is None:
+            return None
+
+        data = {
+            "task_type": job.task_type,
+            "task_type_parameters": job.task_type_parameters,
+            "language": language.name,
+            "files": sorted((codename, file_.digest)
+                            for codename, file_ in job.files.items()),
+            "managers": sorted(
+                (filename, manager.digest)
+                for filename, manager in job.managers.items()
+                if is_manager_for_compilation(filename, language)),
+            "commands": commands,
+            "compilers": _compiler_fingerprint(commands),
+            "limits": [config.compilation_sandbox_max_processes,
+                       config.compilation_sandbox_max_time_s,
+                       config.compilation_sandbox_max_memory_kib],
+        }
+        return hashlib.sha1(json.dumps(data, sort_keys=True)
+                            .encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def fill_job(self, job, file_cacher):
+        """Fill a compilation job with the cached result, if present.
+
+        job (CompilationJob): the job to fill.
+        file_cacher (FileCacher): the file cacher, used to check that
+            the cached executables are still available.
+
+        return (bool): whether the job was filled from the cache.
+
+        """
+        key = self._key(job)
+        if key is None:
+            return False
+
+        try:
+            with open(self._entry_path(key), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            logger.warning("Cannot read compilation cache entry %s.", key,
+                           exc_info=True)
+            return False
+
+        # The executables might have been deleted after they were
+        # stored in the cache.
+        for digest in entry["executables"].values():
+            try:
+                file_cacher.get_size(digest)
+            except KeyError:
+                return False
+
+        if self.max_entries is not None:
+            # Mark the entry as recently used.
+            try:
+                os.utime(self._entry_path(key))
+            except OSError:
+                pass
+
+        job.success = True
+        job.compilation_success = entry["compilation_success"]
+        job.text = entry["text"]
+        job.plus = entry["plus"]
+        for filename, digest in entry["executables"].items():
+            job.executables[filename] = Executable(filename, digest)
+        logger.info("Compilation result found in cache.",
+                    extra={"operation": job.info})
+        return True
+
+    def store_job(self, job):
+        """Store the result of an executed compilation job, if it can
+        be cached.
+
+        job (CompilationJob): the executed job.
+
+        """
+        if not job.success:
+            return
+        if not job.compilation_success and (
+                job.plus is None
+                or job.plus.get("exit_status")
+                != Sandbox.EXIT_NONZERO_RETURN):
+            return
+        key = self._key(job)
+        if key is None:
+            return
+
+        entry = {
+            "compilation_success": job.compilation_success,
+            "text": job.text,
+            "plus": job.plus,
+            "executables": dict((filename, executable.digest)
+                                for filename, executable
+                                in job.executables.items()),
+        }
+        # Write to a temporary file and rename it, so that concurrent
+        # readers never see partial entries.
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".")
+        try:
+            with open(fd, "wt", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.rename(temp_path, self._entry_path(key))
+        except OSError:
+            logger.warning("Cannot write compilation cache entry %s.", key,
+                           exc_info=True)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        if self.max_entries is None:
+            return
+        if self._entries is not None:
+            self._entries += 1
+            if self._entries <= self.max_entries:
+                return
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries, until their number
+        is below the target.
+
+        """
+        entries = []
+        with os.scandir(self.path) as dir_entries:
+            for dir_entry in dir_entries:
+                # Skip the temporary files of the entries being written.
+                if dir_entry.name.startswith("."):
+                    continue
+                try:
+                    mtime = dir_entry.stat(follow_symlinks=False).st_mtime
+                except FileNotFoundError:
+                    continue
+                entries.append((mtime, dir_entry.name))
+
+        if len(entries) > self.max_entries:
+            target = int(self.max_entries * self.EVICTION_TARGET)
+            entries.sort()
+            for _, name in entries[:len(entries) - target]:
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    # Evicted by another Worker.
+                    pass
+                except OSError:
+                    logger.warning("Cannot remove compilation cache entry "
+                                   "%s.", name, exc_info=True)
+            logger.info("Evicted %d entries from the compilation cache.",
+                        len(entries) - target)
+            entries = entries[len(entries) - target:]
+
+        self._entries = len(entries)
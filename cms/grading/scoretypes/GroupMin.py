@@ -34,6 +34,8 @@ class GroupMin(ScoreTypeGroup):
 
     """
 
+    USES_COLUMNS = True
+
     def get_public_outcome(self, outcome, unused_parameter):
         """See ScoreTypeGroup."""
         if outcome <= 0.0:
@@ -46,3 +48,8 @@ class GroupMin(ScoreTypeGroup):
     def reduce(self, outcomes, unused_parameter):
         """See ScoreTypeGroup."""
         return min(outcomes)
+
+    def reduce_is_determined(self, outcomes, unused_parameter):
+        """See ScoreTypeGroup."""
+        # Outcomes are between 0.0 and 1.0.
+        return any(outcome <= 0.0 for outcome in outcomes)
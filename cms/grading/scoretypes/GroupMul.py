@@ -18,7 +18,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from functools import reduce
+import math
 
 from . import ScoreTypeGroup
 
@@ -36,6 +36,8 @@ class GroupMul(ScoreTypeGroup):
 
     """
 
+    USES_COLUMNS = True
+
     def get_public_outcome(self, outcome, unused_parameter):
         """See ScoreTypeGroup."""
         if outcome <= 0.0:
@@ -47,4 +49,8 @@ class GroupMul(ScoreTypeGroup):
 
     def reduce(self, outcomes, unused_parameter):
         """See ScoreTypeGroup."""
-        return reduce(lambda x, y: x * y, outcomes)
+        return math.prod(outcomes)
+
+    def reduce_is_determined(self, outcomes, unused_parameter):
+        """See ScoreTypeGroup."""
+        return any(outcome == 0.0 for outcome in outcomes)
@@ -38,6 +38,8 @@ class GroupThreshold(ScoreTypeGroup):
 
     """
 
+    USES_COLUMNS = True
+
     def get_public_outcome(self, outcome, parameter):
         """See ScoreTypeGroup."""
         threshold = parameter[2]
@@ -49,7 +51,13 @@ class GroupThreshold(ScoreTypeGroup):
     def reduce(self, outcomes, parameter):
         """See ScoreTypeGroup."""
         threshold = parameter[2]
-        if all(0 < outcome <= threshold for outcome in outcomes):
+        if len(outcomes) == 0 \
+                or (min(outcomes) > 0 and max(outcomes) <= threshold):
             return 1.0
         else:
             return 0.0
+
+    def reduce_is_determined(self, outcomes, parameter):
+        """See ScoreTypeGroup."""
+        threshold = parameter[2]
+        return any(not 0 < outcome <= threshold for outcome in outcomes)
@@ -18,7 +18,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from . import ScoreTypeAlone
+from . import ScoreTypeAlone, SubmissionResultColumns
 
 
 # Dummy function to mark translatable string.
@@ -101,6 +101,8 @@ class Sum(ScoreTypeAlone):
     </tbody>
 </table>"""
 
+    USES_COLUMNS = True
+
     def max_scores(self):
         """See ScoreType.max_score."""
         public_score = 0.0
@@ -119,23 +121,25 @@ class Sum(ScoreTypeAlone):
 
         # XXX Lexicographical order by codename
         indices = sorted(self.public_testcases.keys())
-        evaluations = dict((ev.codename, ev)
-                           for ev in submission_result.evaluations)
+        columns = SubmissionResultColumns.from_submission_result(
+            submission_result)
+        index = columns.index()
         testcases = []
         public_testcases = []
         score = 0.0
         public_score = 0.0
 
         for idx in indices:
-            this_score = float(evaluations[idx].outcome) * self.parameters
+            i = index[idx]
+            this_score = float(columns.outcomes[i]) * self.parameters
             tc_outcome = self.get_public_outcome(this_score)
             score += this_score
             testcases.append({
                 "idx": idx,
                 "outcome": tc_outcome,
-                "text": evaluations[idx].text,
-                "time": evaluations[idx].execution_time,
-                "memory": evaluations[idx].execution_memory,
+                "text": columns.texts[i],
+                "time": columns.execution_times[i],
+                "memory": columns.execution_memories[i],
                 })
             if self.public_testcases[idx]:
                 public_score += this_score
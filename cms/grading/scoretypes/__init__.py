@@ -23,7 +23,8 @@
 import logging
 
 from cms import plugin_list
-from .abc import ScoreType, ScoreTypeAlone, ScoreTypeGroup
+from .abc import ScoreType, ScoreTypeAlone, ScoreTypeGroup, \
+    SubmissionResultColumns
 
 
 logger = logging.getLogger(__name__)
@@ -33,6 +34,7 @@ __all__ = [
     "SCORE_TYPES", "get_score_type", "get_score_type_class",
     # abc
     "ScoreType", "ScoreTypeAlone", "ScoreTypeGroup",
+    "SubmissionResultColumns",
 ]
 
 
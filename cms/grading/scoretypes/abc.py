@@ -33,6 +33,7 @@ task.
 import logging
 import re
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
 
 from cms import FEEDBACK_LEVEL_RESTRICTED
 from cms.locale import DEFAULT_TRANSLATION
@@ -47,6 +48,114 @@ def N_(message):
     return message
 
 
+# The values of an evaluation that the score types use.
+EvaluationRow = namedtuple("EvaluationRow", [
+    "codename", "outcome", "text", "execution_time", "execution_memory"])
+
+
+class SubmissionResultColumns:
+    """A compact view of a submission result, with what the score
+    types use to compute its score.
+
+    The values of the evaluations are stored by column: the i-th
+    element of each list refers to the testcase codenames[i]. Score
+    types can then compute scores from a few lists, fetched with a
+    single query, instead of from an ORM object per evaluation. It can
+    be given to compute_score in place of a SubmissionResult.
+
+    """
+
+    __slots__ = ["submission_id", "dataset_id", "_evaluated", "codenames",
+                 "outcomes", "texts", "execution_times", "execution_memories"]
+
+    def __init__(self, submission_id, dataset_id, evaluated,
+                 codenames=None, outcomes=None, texts=None,
+                 execution_times=None, execution_memories=None):
+        """Initializer.
+
+        submission_id (int): the id of the submission.
+        dataset_id (int): the id of the dataset.
+        evaluated (bool): whether the submission result has been
+            evaluated.
+        codenames ([str]): the codenames of the testcases.
+        outcomes ([str]): the outcomes of the evaluations.
+        texts ([[str]]): the texts of the evaluations.
+        execution_times ([float|None]): the execution times.
+        execution_memories ([int|None]): the memory used.
+
+        """
+        self.submission_id = submission_id
+        self.dataset_id = dataset_id
+        self._evaluated = evaluated
+        self.codenames = codenames if codenames is not None else []
+        self.outcomes = outcomes if outcomes is not None else []
+        self.texts = texts if texts is not None else []
+        self.execution_times = \
+            execution_times if execution_times is not None else []
+        self.execution_memories = \
+            execution_memories if execution_memories is not None else []
+
+    @staticmethod
+    def from_submission_result(submission_result):
+        """Return the view of a submission result.
+
+        submission_result (SubmissionResult|SubmissionResultColumns):
+            the submission result, or already its view.
+
+        return (SubmissionResultColumns): the view.
+
+        """
+        if isinstance(submission_result, SubmissionResultColumns):
+            return submission_result
+        columns = SubmissionResultColumns(submission_result.submission_id,
+                                          submission_result.dataset_id,
+                                          submission_result.evaluated())
+        for evaluation in submission_result.evaluations:
+            columns.append(evaluation.codename, evaluation.outcome,
+                           evaluation.text, evaluation.execution_time,
+                           evaluation.execution_memory)
+        return columns
+
+    def append(self, codename, outcome, text, execution_time,
+               execution_memory):
+        """Add the values of an evaluation.
+
+        codename (str): the codename of the testcase.
+        outcome (str): the outcome of the evaluation.
+        text ([str]): the text of the evaluation.
+        execution_time (float|None): the execution time.
+        execution_memory (int|None): the memory used.
+
+        """
+        self.codenames.append(codename)
+        self.outcomes.append(outcome)
+        self.texts.append(text)
+        self.execution_times.append(execution_time)
+        self.execution_memories.append(execution_memory)
+
+    def evaluated(self):
+        """See SubmissionResult.evaluated."""
+        return self._evaluated
+
+    @property
+    def evaluations(self):
+        """The evaluations, as rows, for the score types that want
+        to iterate over them as SubmissionResult.evaluations.
+
+        """
+        return [EvaluationRow(*row) for row in zip(
+            self.codenames, self.outcomes, self.texts,
+            self.execution_times, self.execution_memories)]
+
+    def index(self):
+        """Return the position of each testcase in the columns.
+
+        return ({str: int}): the index of each codename.
+
+        """
+        return dict((codename, i) for i, codename in enumerate(self.codenames))
+
+
 class ScoreType(metaclass=ABCMeta):
     """Base class for all score types, that must implement all methods
     defined here.
@@ -55,6 +164,12 @@ class ScoreType(metaclass=ABCMeta):
 
     TEMPLATE = ""
 
+    # Whether compute_score accepts a SubmissionResultColumns in place
+    # of the SubmissionResult. It is set only on the concrete classes,
+    # not on the abstract ones, as their subclasses may override methods
+    # expecting the full SubmissionResult: each of them has to opt in.
+    USES_COLUMNS = False
+
     def __init__(self, parameters, public_testcases):
         """Initializer.
 
@@ -155,8 +270,9 @@ class ScoreType(metaclass=ABCMeta):
     def compute_score(self, unused_submission_result):
         """Computes a score of a single submission.
 
-        unused_submission_result (SubmissionResult): the submission
-            result of which we want the score
+        unused_submission_result (SubmissionResult|
+            SubmissionResultColumns): the submission result of which
+            we want the score (or its view, if USES_COLUMNS is set).
 
         return (float, object, float, object, [str]): respectively: the
             score, an opaque JSON-like data structure with additional
@@ -168,6 +284,25 @@ class ScoreType(metaclass=ABCMeta):
         """
         pass
 
+    def irrelevant_testcases(self, unused_outcomes):
+        """Return the testcases whose outcome cannot change the score.
+
+        Used to postpone the evaluation of these testcases, if
+        configured so: they are still needed for the full feedback,
+        but the submission can be scored without them, hence
+        compute_score must accept results missing them. The default
+        implementation returns no testcase.
+
+        unused_outcomes ({str: float}): the outcomes of the testcases
+            evaluated so far, indexed by codename.
+
+        return ({str}): the codenames of the testcases, not yet
+            evaluated, that cannot change the score of the submission
+            whatever their outcome.
+
+        """
+        return set()
+
 
 class ScoreTypeAlone(ScoreType):
     """Intermediate class to manage tasks where the score of a
@@ -308,6 +443,11 @@ class ScoreTypeGroup(ScoreTypeAlone):
 </div>
 {% endfor %}"""
 
+    def __init__(self, parameters, public_testcases):
+        """See ScoreType.__init__."""
+        self._target_testcases = None
+        super().__init__(parameters, public_testcases)
+
     def retrieve_target_testcases(self):
         """Return the list of the target testcases for each subtask.
 
@@ -319,7 +459,14 @@ class ScoreTypeGroup(ScoreTypeAlone):
         return ([[unicode]]): the list of the target testcases for each task.
 
         """
-
+        # The parameters never change, so the targets are computed
+        # only once.
+        if self._target_testcases is None:
+            self._target_testcases = self._compute_target_testcases()
+        return self._target_testcases
+
+    def _compute_target_testcases(self):
+        """See retrieve_target_testcases."""
         t_params = [p[1] for p in self.parameters]
 
         if all(isinstance(t, int) for t in t_params):
@@ -385,24 +532,44 @@ class ScoreTypeGroup(ScoreTypeAlone):
         ranking_details = []
 
         targets = self.retrieve_target_testcases()
-        evaluations = {ev.codename: ev for ev in submission_result.evaluations}
+        columns = SubmissionResultColumns.from_submission_result(
+            submission_result)
+        index = columns.index()
+        outcomes = [float(outcome) for outcome in columns.outcomes]
 
         for st_idx, parameter in enumerate(self.parameters):
             target = targets[st_idx]
+            positions = [index.get(tc_idx) for tc_idx in target]
+            st_outcomes = [outcomes[i] for i in positions if i is not None]
+            # The testcases that cannot change the score might not be
+            # evaluated yet (see irrelevant_testcases).
+            if len(st_outcomes) < len(target) \
+                    and not self.reduce_is_determined(st_outcomes, parameter):
+                raise ValueError("Missing the evaluations of subtask %d."
+                                 % (st_idx + 1))
 
             testcases = []
             public_testcases = []
+            # There are usually few distinct outcomes in a subtask.
+            public_outcomes = dict()
             previous_tc_all_correct = True
-            for tc_idx in target:
-                tc_outcome = self.get_public_outcome(
-                    float(evaluations[tc_idx].outcome), parameter)
+            for tc_idx, i in zip(target, positions):
+                if i is None:
+                    testcases.append({"idx": tc_idx})
+                    public_testcases.append({"idx": tc_idx})
+                    continue
+                outcome = outcomes[i]
+                if outcome not in public_outcomes:
+                    public_outcomes[outcome] = \
+                        self.get_public_outcome(outcome, parameter)
+                tc_outcome = public_outcomes[outcome]
 
                 testcases.append({
                     "idx": tc_idx,
                     "outcome": tc_outcome,
-                    "text": evaluations[tc_idx].text,
-                    "time": evaluations[tc_idx].execution_time,
-                    "memory": evaluations[tc_idx].execution_memory,
+                    "text": columns.texts[i],
+                    "time": columns.execution_times[i],
+                    "memory": columns.execution_memories[i],
                     "show_in_restricted_feedback": previous_tc_all_correct})
                 if self.public_testcases[tc_idx]:
                     public_testcases.append(testcases[-1])
@@ -414,9 +581,7 @@ class ScoreTypeGroup(ScoreTypeAlone):
                 else:
                     public_testcases.append({"idx": tc_idx})
 
-            st_score_fraction = self.reduce(
-                [float(evaluations[tc_idx].outcome) for tc_idx in target],
-                parameter)
+            st_score_fraction = self.reduce(st_outcomes, parameter)
             st_score = st_score_fraction * parameter[0]
 
             score += st_score
@@ -438,6 +603,35 @@ class ScoreTypeGroup(ScoreTypeAlone):
 
         return score, subtasks, public_score, public_subtasks, ranking_details
 
+    def irrelevant_testcases(self, outcomes):
+        """See ScoreType.irrelevant_testcases."""
+        relevant = set()
+        for parameter, target in zip(self.parameters,
+                                     self.retrieve_target_testcases()):
+            if not self.reduce_is_determined(
+                    [outcomes[tc_idx] for tc_idx in target
+                     if tc_idx in outcomes],
+                    parameter):
+                relevant.update(target)
+        return set(self.public_testcases.keys()) - relevant \
+            - set(outcomes.keys())
+
+    def reduce_is_determined(self, unused_outcomes, unused_parameter):
+        """Return whether the score of a subtask is already determined
+        by some of its outcomes, whatever the others are.
+
+        The default implementation always returns False.
+
+        unused_outcomes ([float]): some of the outcomes of the
+            submission in the testcases of the group.
+        unused_parameter (list): the parameters of the group.
+
+        return (bool): True if reduce returns the same value for all
+            the possible outcomes of the other testcases.
+
+        """
+        return False
+
     @abstractmethod
     def get_public_outcome(self, unused_outcome, unused_parameter):
         """Return a public outcome from an outcome.
@@ -25,15 +25,21 @@
 
 from collections import namedtuple
 
+from sqlalchemy import case, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import joinedload
 
-from cms.db import Submission
+from cms.db import Submission, SubmissionResult, Task, \
+    ParticipationTaskScore
 from cmscommon.constants import \
     SCORE_MODE_MAX, SCORE_MODE_MAX_SUBTASK, SCORE_MODE_MAX_TOKENED_LAST
 
 
 __all__ = [
     "compute_changes_for_dataset", "task_score",
+    "TaskScores", "get_task_scores", "get_all_task_scores",
+    "update_task_scores", "update_all_task_scores",
+    "invalidate_task_scores",
 ]
 
 
@@ -44,6 +50,22 @@ SubmissionScoreDelta = namedtuple(
      'old_ranking_score_details', 'new_ranking_score_details'])
 
 
+# The scores of a participation on a task (see task_score): the full
+# one, the public one and the one limited to the tokened submissions,
+# and whether some submissions were not scored yet.
+TaskScores = namedtuple(
+    'TaskScores',
+    ['score', 'public_score', 'tokened_score', 'partial'])
+
+
+# What the score modes need to know of a submission and of its result
+# on the active dataset (the scores are None if not scored).
+SubmissionScore = namedtuple(
+    'SubmissionScore',
+    ['timestamp', 'tokened', 'scored', 'score', 'score_details',
+     'public_score', 'public_score_details'])
+
+
 def compute_changes_for_dataset(old_dataset, new_dataset):
     """This function will compute the differences expected when changing from
     one dataset to another.
@@ -121,7 +143,7 @@ def task_score(participation, task,
 
     """
     # As this function is primarily used when generating a rankings table
-    # (AWS's RankingHandler), we optimize for the case where we are generating
+    # (e.g., SpoolExporter), we optimize for the case where we are generating
     # results for all users and all tasks. As such, for the following code to
     # be more efficient, the query that generated task and user should have
     # come from a joinedload with the submissions, tokens and
@@ -134,32 +156,58 @@ def task_score(participation, task,
             "This is a programming error: users have access to all public "
             "scores regardless of token status.")
 
-    submissions = [s for s in participation.submissions
-                   if s.task is task and s.official]
-    if len(submissions) == 0:
-        return 0.0, False
+    submission_scores = []
+    for s in participation.submissions:
+        if s.task is task and s.official:
+            sr = s.get_result(task.active_dataset)
+            if sr is None or not sr.scored():
+                submission_scores.append(SubmissionScore(
+                    s.timestamp, s.tokened(), False, None, None, None, None))
+            else:
+                submission_scores.append(SubmissionScore(
+                    s.timestamp, s.tokened(), True, sr.score,
+                    sr.score_details, sr.public_score,
+                    sr.public_score_details))
+    score, partial = _task_score(task, submission_scores, public,
+                                 only_tokened)
+    if rounded:
+        score = round(score, task.score_precision)
+    return score, partial
+
+
+def _task_score(task, submission_scores, public, only_tokened):
+    """Compute the score of a contest's user on a task.
+
+    task (Task): the task.
+    submission_scores ([SubmissionScore]): the official submissions of
+        the user on the task.
+    public (bool): see task_score.
+    only_tokened (bool): see task_score.
 
-    submissions_and_results = [
-        (s, s.get_result(task.active_dataset))
-        for s in sorted(submissions, key=lambda s: s.timestamp)]
+    return ((float, bool)): the score, not rounded, and True if not all
+        submissions have been scored.
+
+    """
+    if len(submission_scores) == 0:
+        return 0.0, False
 
     score_details_tokened = []
     partial = False
-    for s, sr in submissions_and_results:
-        if sr is None or not sr.scored():
+    for s in sorted(submission_scores, key=lambda s: s.timestamp):
+        if not s.scored:
             partial = True
             score, score_details = None, None
         elif public:
-            score, score_details = sr.public_score, sr.public_score_details
-        elif only_tokened and not s.tokened():
+            score, score_details = s.public_score, s.public_score_details
+        elif only_tokened and not s.tokened:
             # If the caller wants the only_tokened score and this submission is
             # not tokened, the score mode should ignore its score. To do so, we
             # send to the score mode what we would send if it wasn't already
             # scored.
             score, score_details = None, None
         else:
-            score, score_details = sr.score, sr.score_details
-        score_details_tokened.append((score, score_details, s.tokened()))
+            score, score_details = s.score, s.score_details
+        score_details_tokened.append((score, score_details, s.tokened))
 
     if task.score_mode == SCORE_MODE_MAX:
         score = _task_score_max(score_details_tokened)
@@ -169,8 +217,6 @@ def task_score(participation, task,
         score = _task_score_max_tokened_last(score_details_tokened)
     else:
         raise ValueError("Unknown score mode '%s'" % task.score_mode)
-    if rounded:
-        score = round(score, task.score_precision)
     return score, partial
 
 
@@ -275,3 +321,260 @@ def _task_score_max(score_details_tokened):
             max_score = max(max_score, score)
 
     return max_score
+
+
+# Caching the scores (see ParticipationTaskScore).
+
+def _compute_task_scores(task, submission_scores):
+    """Compute all the scores of a contest's user on a task.
+
+    task (Task): the task.
+    submission_scores ([SubmissionScore]): see _task_score.
+
+    return (TaskScores): the scores, not rounded.
+
+    """
+    score, partial = _task_score(task, submission_scores, False, False)
+    public_score, _ = _task_score(task, submission_scores, True, False)
+    tokened_score, _ = _task_score(task, submission_scores, False, True)
+    return TaskScores(score, public_score, tokened_score, partial)
+
+
+def _load_submission_scores(session, tasks, participation_task_ids):
+    """Load what the score modes need of the official submissions of
+    some participations on some tasks.
+
+    Only the needed columns are loaded, with a single query, instead of
+    the submissions, their tokens and all their results.
+
+    session (Session): the database session.
+    tasks ({int: Task}): the tasks, by id; their active datasets are
+        the ones whose results are loaded.
+    participation_task_ids ([(int, int)]): the ids of the
+        participations and of the tasks.
+
+    return ({(int, int): [SubmissionScore]}): the submissions, by the
+        ids of their participation and task.
+
+    """
+    res = dict((key, []) for key in participation_task_ids)
+    if len(res) == 0:
+        return res
+
+    active_dataset_id = case(
+        dict((task_id, task.active_dataset_id)
+             for task_id, task in tasks.items()),
+        value=Submission.task_id)
+    query = session.query(Submission.participation_id,
+                          Submission.task_id,
+                          Submission.timestamp,
+                          Submission.token.has(),
+                          SubmissionResult.filter_scored(),
+                          SubmissionResult.score,
+                          SubmissionResult.score_details,
+                          SubmissionResult.public_score,
+                          SubmissionResult.public_score_details)\
+        .outerjoin(SubmissionResult,
+                   (SubmissionResult.submission_id == Submission.id)
+                   & (SubmissionResult.dataset_id == active_dataset_id))\
+        .filter(Submission.official.is_(True))\
+        .filter(Submission.participation_id.in_(
+            set(participation_id for participation_id, _ in res)))\
+        .filter(Submission.task_id.in_(set(task_id for _, task_id in res)))
+    for participation_id, task_id, timestamp, tokened, scored, *scores \
+            in query:
+        # The query might return more pairs than the requested ones.
+        key = (participation_id, task_id)
+        if key in res:
+            # The results that do not exist are not scored.
+            res[key].append(SubmissionScore(
+                timestamp, tokened, scored is True, *scores))
+    return res
+
+
+def get_all_task_scores(session, participations, tasks, rounded=False):
+    """Return the scores of some contest's users on some tasks.
+
+    The scores are read from the cache when valid, and computed from
+    the submissions otherwise (without storing them: that is done by
+    who changes the submissions, see update_task_scores).
+
+    session (Session): the database session.
+    participations ([Participation]): the users and contest.
+    tasks ([Task]): the tasks.
+    rounded (bool): if True, round the scores to the tasks'
+        score_precision.
+
+    return ({(int, int): TaskScores}): the scores, by the ids of the
+        participation and of the task.
+
+    """
+    tasks = dict((task.id, task) for task in tasks)
+    participation_ids = [participation.id for participation in participations]
+    if len(participation_ids) == 0 or len(tasks) == 0:
+        return dict()
+
+    res = dict()
+    rows = session.query(ParticipationTaskScore)\
+        .filter(ParticipationTaskScore.participation_id
+                .in_(participation_ids))\
+        .filter(ParticipationTaskScore.task_id.in_(list(tasks.keys())))
+    for row in rows:
+        task = tasks[row.task_id]
+        if row.dataset_id is not None \
+                and row.dataset_id == task.active_dataset_id \
+                and row.score_mode == task.score_mode:
+            res[(row.participation_id, row.task_id)] = TaskScores(
+                row.score, row.public_score, row.tokened_score, row.partial)
+
+    missing = [(participation_id, task_id)
+               for participation_id in participation_ids
+               for task_id in tasks
+               if (participation_id, task_id) not in res]
+    if len(missing) > 0:
+        submission_scores = _load_submission_scores(session, tasks, missing)
+        for key in missing:
+            res[key] = _compute_task_scores(tasks[key[1]],
+                                            submission_scores[key])
+
+    if rounded:
+        for key, scores in res.items():
+            precision = tasks[key[1]].score_precision
+            res[key] = TaskScores(round(scores.score, precision),
+                                  round(scores.public_score, precision),
+                                  round(scores.tokened_score, precision),
+                                  scores.partial)
+    return res
+
+
+def get_task_scores(session, participation, task, rounded=False):
+    """Return the scores of a contest's user on a task.
+
+    session (Session): the database session.
+    participation (Participation): the user and contest.
+    task (Task): the task.
+    rounded (bool): if True, round the scores to the task's
+        score_precision.
+
+    return (TaskScores): the scores.
+
+    """
+    return get_all_task_scores(
+        session, [participation], [task],
+        rounded=rounded)[(participation.id, task.id)]
+
+
+def update_task_scores(session, participation_task_ids):
+    """Compute again and store the scores of some contest's users on
+    some tasks.
+
+    To be called, in the same transaction, by who adds submissions or
+    tokens, and by who scores the submissions on the active dataset
+    (possibly in a later transaction). The rows are locked before
+    reading the submissions: thus, if two transactions change the
+    submissions of the same participation on the same task, the second
+    one to update the scores waits for the first one to commit, and
+    then sees its changes.
+
+    session (Session): the database session.
+    participation_task_ids ([(int, int)]): the ids of the
+        participations and of the tasks.
+
+    """
+    # Sorted, so that concurrent updates lock the rows in the same
+    # order.
+    keys = sorted(set(participation_task_ids))
+    if len(keys) == 0:
+        return
+
+    # The objects are loaded again (as they might have changed since
+    # they were loaded in the session), and the queries doing so are
+    # not preceded by an autoflush.
+    session.flush()
+    session.execute(
+        insert(ParticipationTaskScore.__table__)
+        .values([{"participation_id": participation_id,
+                  "task_id": task_id,
+                  "score": 0.0,
+                  "public_score": 0.0,
+                  "tokened_score": 0.0,
+                  "partial": False}
+                 for participation_id, task_id in keys])
+        .on_conflict_do_update(
+            index_elements=["participation_id", "task_id"],
+            set_={"dataset_id": None}))
+
+    tasks = dict((task.id, task) for task in session.query(Task)
+                 .filter(Task.id.in_(set(task_id for _, task_id in keys)))
+                 .populate_existing())
+    submission_scores = _load_submission_scores(session, tasks, keys)
+    rows = session.query(ParticipationTaskScore)\
+        .filter(tuple_(ParticipationTaskScore.participation_id,
+                       ParticipationTaskScore.task_id).in_(keys))\
+        .populate_existing()
+    for row in rows:
+        task = tasks[row.task_id]
+        if task.active_dataset_id is None:
+            continue
+        row.score, row.public_score, row.tokened_score, row.partial = \
+            _compute_task_scores(
+                task, submission_scores[(row.participation_id, row.task_id)])
+        row.dataset_id = task.active_dataset_id
+        row.score_mode = task.score_mode
+
+
+def update_all_task_scores(session, task):
+    """Compute again and store the scores of all contest's users on a
+    task.
+
+    To be called, in the same transaction, by who changes the active
+    dataset or the score mode of the task, which make all the stored
+    scores on it not valid.
+
+    session (Session): the database session.
+    task (Task): the task.
+
+    """
+    # The participations with submissions, and the ones whose scores
+    # were stored before (that might have none now).
+    participation_ids = set(
+        participation_id for participation_id, in session
+        .query(Submission.participation_id)
+        .filter(Submission.task_id == task.id)
+        .distinct())
+    participation_ids.update(
+        participation_id for participation_id, in session
+        .query(ParticipationTaskScore.participation_id)
+        .filter(ParticipationTaskScore.task_id == task.id))
+    update_task_scores(session, [(participation_id, task.id)
+                                 for participation_id in participation_ids])
+
+
+def invalidate_task_scores(session, participation_task_ids):
+    """Mark as not valid the stored scores of some contest's users on
+    some tasks.
+
+    To be called by who invalidates the scores of submissions on the
+    active dataset; the scores are then computed again when the
+    submissions are scored again.
+
+    session (Session): the database session.
+    participation_task_ids ([(int, int)]): the ids of the
+        participations and of the tasks.
+
+    """
+    keys = sorted(set(participation_task_ids))
+    if len(keys) == 0:
+        return
+
+    # See update_task_scores.
+    session.flush()
+    rows = session.query(ParticipationTaskScore)\
+        .filter(tuple_(ParticipationTaskScore.participation_id,
+                       ParticipationTaskScore.task_id).in_(keys))\
+        .order_by(ParticipationTaskScore.participation_id,
+                  ParticipationTaskScore.task_id)\
+        .with_for_update()\
+        .populate_existing()
+    for row in rows:
+        row.dataset_id = None
@@ -39,34 +39,91 @@ logger = logging.getLogger(__name__)
 _WHITES = [b' ', b'\t', b'\n', b'\x0b', b'\x0c', b'\r']
 
 
-def _white_diff_canonicalize(string):
-    """Convert the input string to a canonical form for the white diff
-    algorithm; that is, the strings a and b are mapped to the same
-    string by _white_diff_canonicalize() if and only if they have to be
-    considered equivalent for the purposes of the white-diff
-    algorithm.
+# Size of the blocks in which files are read and compared.
+_BLOCK_SIZE = 1024 * 1024
 
-    More specifically, this function strips all the leading and
-    trailing whitespaces from s and collapse all the runs of
-    consecutive whitespaces into just one copy of one specific
-    whitespace.
+_WHITES_BYTES = b"".join(_WHITES)
+# Translation table mapping all whitespaces except the newline to " ".
+_TO_SPACE = bytes.maketrans(b"".join(_WHITES[1:2] + _WHITES[3:]),
+                            _WHITES[0] * (len(_WHITES) - 2))
 
-    string (str): the string to canonicalize.
-    return (str): the canonicalized string.
+
+def _white_diff_canonicalize(block):
+    """Convert a block of a file to a canonical form for the white
+    diff algorithm.
+
+    More specifically, this function collapses all the runs of
+    consecutive whitespaces that do not contain newlines into a single
+    space, and those that do contain newlines into just the newlines.
+    Hence the block, seen as a sequence of lines, has the same tokens
+    in each line, separated by single spaces and without leading and
+    trailing whitespaces.
+
+    block (bytes): the block to canonicalize, which must not start or
+        end with a whitespace.
+    return (bytes): the canonicalized block.
 
     """
-    # Replace all the whitespaces with copies of " ", making the rest
-    # of the algorithm simpler
-    for char in _WHITES[1:]:
-        string = string.replace(char, _WHITES[0])
+    # Each pass halves the length of the runs of spaces, and in the
+    # common case of an already canonical output no pass is needed.
+    block = block.translate(_TO_SPACE)
+    while _WHITES[0] * 2 in block:
+        block = block.replace(_WHITES[0] * 2, _WHITES[0])
+    return block.replace(b" \n", b"\n").replace(b"\n ", b"\n")
+
+
+def _white_diff_canonical_chunks(fobj):
+    """Read a file and yield its canonical form for the white diff.
+
+    The canonical form is the sequence of the lines of the file, each
+    one without leading and trailing whitespaces and with the runs of
+    whitespaces collapsed into a single space, without trailing empty
+    lines. Two files are equal for the white diff algorithm if and
+    only if their canonical forms are equal.
+
+    The file is read in blocks of fixed size; a run of whitespaces at
+    the end of a block is carried over to the next one, remembering
+    only the number of newlines it contains. Hence the memory usage
+    does not depend on the length of the lines.
 
-    # Split the string according to " ", filter out empty tokens and
-    # join again the string using just one copy of the first
-    # whitespace; this way, runs of more than one whitespaces are
-    # collapsed into just one copy.
-    string = _WHITES[0].join([x for x in string.split(_WHITES[0])
-                              if len(x) > 0])
-    return string
+    fobj (file): the file to read, opened in binary mode.
+
+    yield (bytes): the non-empty chunks of the canonical form.
+
+    """
+    # Number of newlines in the pending run of whitespaces, and
+    # whether there is such a pending run.
+    newlines = 0
+    pending = False
+    at_start = True
+    while True:
+        block = fobj.read(_BLOCK_SIZE)
+        if len(block) == 0:
+            # Trailing whitespaces (and so empty lines) are ignored.
+            return
+        content = block.rstrip(_WHITES_BYTES)
+        if len(content) > 0:
+            stripped = content.lstrip(_WHITES_BYTES)
+            head = len(content) - len(stripped)
+            if head > 0:
+                newlines += content.count(_WHITES[2], 0, head)
+                pending = True
+            # A run of whitespaces is a separator between lines if it
+            # contains newlines and between tokens otherwise; leading
+            # whitespaces matter only for the empty lines they form.
+            if newlines > 0:
+                while newlines > 0:
+                    yield _WHITES[2] * min(newlines, _BLOCK_SIZE)
+                    newlines -= _BLOCK_SIZE
+            elif pending and not at_start:
+                yield _WHITES[0]
+            yield _white_diff_canonicalize(stripped)
+            at_start = False
+            newlines = 0
+            pending = False
+        if len(content) < len(block):
+            newlines += block.count(_WHITES[2], len(content))
+            pending = True
 
 
 def _white_diff(output, res):
@@ -80,34 +137,36 @@ def _white_diff(output, res):
     'sequence of characters ending with \n or EOF and beginning right
     after BOF or \n'. In particular, every line has *at most* one \n.
 
+    The files are compared a block at a time, so that the memory usage
+    is bounded even for very long lines, and the canonicalization of
+    each block is done by built-in bytes functions.
+
     output (file): the first file to compare.
     res (file): the second file to compare.
     return (bool): True if the two file are equal as explained above.
 
     """
-
+    output_chunks = _white_diff_canonical_chunks(output)
+    res_chunks = _white_diff_canonical_chunks(res)
+    output_buf = b""
+    res_buf = b""
     while True:
-        lout = output.readline()
-        lres = res.readline()
-
-        # Both files finished: comparison succeded
-        if len(lres) == 0 and len(lout) == 0:
-            return True
-
-        # Only one file finished: ok if the other contains only blanks
-        elif len(lres) == 0 or len(lout) == 0:
-            lout = lout.strip(b''.join(_WHITES))
-            lres = lres.strip(b''.join(_WHITES))
-            if len(lout) > 0 or len(lres) > 0:
-                return False
-
-        # Both file still have lines to go: ok if they agree except
-        # for the number of whitespaces
-        else:
-            lout = _white_diff_canonicalize(lout)
-            lres = _white_diff_canonicalize(lres)
-            if lout != lres:
-                return False
+        if len(output_buf) == 0:
+            output_buf = next(output_chunks, b"")
+        if len(res_buf) == 0:
+            res_buf = next(res_chunks, b"")
+
+        # Both files finished: comparison succeeded. Only one file
+        # finished: the other has more content, as chunks are not
+        # empty.
+        if len(output_buf) == 0 or len(res_buf) == 0:
+            return len(output_buf) == len(res_buf)
+
+        length = min(len(output_buf), len(res_buf))
+        if output_buf[:length] != res_buf[:length]:
+            return False
+        output_buf = output_buf[length:]
+        res_buf = res_buf[length:]
 
 
 def white_diff_fobj_step(output_fobj, correct_output_fobj):
@@ -31,10 +31,12 @@ The priority is given by two fields: priority, which is an integer
 among the PRIORITY_classes defined in PriorityQueue, and timestamp,
 which is supposed to be the timestamp in which the operation was
 requested for the first time. Timestamp is only used to discern
-between entries with the same priority.
+between entries with the same priority. Users of the queue can order
+the entries with the same priority differently, by giving them a rank
+to use instead of the timestamp.
 
 The queue stores entries in the QueueEntry format, a class that stores
-together the three data point: item, priority, and timestamp.
+together the data points: item, priority, timestamp and rank.
 
 """
 
@@ -65,13 +67,16 @@ class QueueEntry:
 
     """
 
-    def __init__(self, item, priority, timestamp, index):
+    def __init__(self, item, priority, timestamp, index, rank=None):
         """Create a QueueEntry object.
 
         item (QueueItem): the payload.
         priority (int): the priority.
         timestamp (datetime): the timestamp of first request.
         index (int): used to enforce strict ordering.
+        rank (object|None): used to order entries with the same
+            priority, or None to use the timestamp. The ranks of all
+            the entries in a queue must be comparable.
 
         """
         # TODO: item is not actually necessary, as we store the whole
@@ -80,16 +85,17 @@ class QueueEntry:
         self.priority = priority
         self.timestamp = timestamp
         self.index = index
+        self.rank = rank if rank is not None else timestamp
 
     def __eq__(self, other):
         """Return whether self and other have the same priority."""
-        return (self.priority, self.timestamp, self.index) \
-               == (other.priority, other.timestamp, other.index)
+        return (self.priority, self.rank, self.index) \
+               == (other.priority, other.rank, other.index)
 
     def __lt__(self, other):
         """Return whether self has higher priority than other."""
-        return (self.priority, self.timestamp, self.index) \
-               < (other.priority, other.timestamp, other.index)
+        return (self.priority, self.rank, self.index) \
+               < (other.priority, other.rank, other.index)
 
 
 class PriorityQueue:
@@ -224,7 +230,7 @@ class PriorityQueue:
         idx = self._up_heap(idx)
         return self._down_heap(idx)
 
-    def push(self, item, priority=None, timestamp=None):
+    def push(self, item, priority=None, timestamp=None, rank=None):
         """Push an item in the queue. If timestamp is not specified,
         uses the current time.
 
@@ -233,6 +239,8 @@ class PriorityQueue:
             medium priority.
         timestamp (datetime|None): the time of the submission, or None
             to use now.
+        rank (object|None): the rank of the item among the ones with
+            the same priority, or None to use the timestamp.
 
         return (bool): false if the element was already in the queue
             and was not pushed again, true otherwise..
@@ -249,7 +257,8 @@ class PriorityQueue:
         index = self._next_index
         self._next_index += 1
 
-        self._queue.append(QueueEntry(item, priority, timestamp, index))
+        self._queue.append(
+            QueueEntry(item, priority, timestamp, index, rank))
         last = len(self._queue) - 1
         self._reverse[item] = last
         self._up_heap(last)
@@ -339,12 +348,16 @@ class PriorityQueue:
         item (QueueItem): the item whose priority needs to change.
         priority (int): the new priority.
 
+        return (int): the previous priority of the item.
+
         raise (LookupError): if item not present.
 
         """
         pos = self._reverse[item]
+        old_priority = self._queue[pos].priority
         self._queue[pos].priority = priority
         self._updown_heap(pos)
+        return old_priority
 
     def length(self):
         """Return the number of elements in the queue.
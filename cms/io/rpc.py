@@ -20,25 +20,74 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import functools
 import json
 import logging
 import socket
+import struct
 import traceback
 import uuid
+import zlib
 from weakref import WeakSet
 
 import gevent
 import gevent.event
+import gevent.local
 import gevent.lock
 import gevent.socket
 
-from cms import Address, get_service_address
+from cms import Address, config, get_service_address
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 logger = logging.getLogger(__name__)
 
 
+def _json_dumps(message):
+    return json.dumps(message).encode('utf-8')
+
+
+def _json_loads(data):
+    return json.loads(data.decode('utf-8'))
+
+
+def _msgpack_dumps(message):
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# The functions to encode and decode the messages with each
+# serializer. Encoding raises TypeError or ValueError for objects that
+# cannot be serialized; decoding raises ValueError for bad data.
+SERIALIZERS = {
+    "json": (_json_dumps, _json_loads),
+}
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = (_msgpack_dumps, _msgpack_loads)
+
+
+def get_available_serializers():
+    """Return the serializers that this service can use in RPCs.
+
+    return ([str]): the serializers enabled in the configuration and
+        available, in order of preference; JSON is always available.
+
+    """
+    res = [serializer for serializer in config.rpc_serializers
+           if serializer in SERIALIZERS]
+    if "json" not in res:
+        res.append("json")
+    return res
+
+
 class RPCError(Exception):
     """Generic error during RPC communication."""
     pass
@@ -73,11 +122,30 @@ class RemoteServiceBase:
     When the state changes the on_connect or on_disconnect handlers
     will be fired.
 
+    Each connection starts with messages encoded in JSON and
+    terminated by "\\r\\n". The client can ask to upgrade the protocol
+    with its first request (see NEGOTIATE_METHOD): afterwards, each
+    message is a frame made of its length, a byte of flags and the
+    message encoded with the serializer agreed upon, compressed if it
+    is large. The server can then also receive many requests in a
+    single message (see RemoteServiceClient.batch).
+
     """
     # Incoming messages larger than 1 MiB are dropped to avoid DOS
     # attacks. XXX Check that this size is sensible.
     MAX_MESSAGE_SIZE = 1024 * 1024
 
+    # The method of the request upgrading the protocol.
+    NEGOTIATE_METHOD = "__negotiate_protocol"
+
+    # The header of a frame: the length of the payload and the flags.
+    FRAME_HEADER = struct.Struct("!IB")
+    FLAG_COMPRESSED = 1
+
+    # Messages larger than this, in bytes, are compressed, if the
+    # other end agreed to.
+    COMPRESSION_THRESHOLD = 16 * 1024
+
     def __init__(self, remote_address):
         """Prepare to handle a connection with the given remote address.
 
@@ -99,6 +167,55 @@ class RemoteServiceBase:
         self._read_lock = gevent.lock.RLock()
         self._write_lock = gevent.lock.RLock()
 
+        self._reset_protocol()
+
+    def _reset_protocol(self):
+        """Go back to the JSON lines of a new connection."""
+        self._framed = False
+        self._dumps, self._loads = SERIALIZERS["json"]
+        self._compression = None
+
+    def _set_protocol(self, serializer, compression):
+        """Switch to the framed messages, after the negotiation.
+
+        serializer (str): the serializer to use, in SERIALIZERS.
+        compression (str|None): the compression to use ("zlib"), or
+            None to never compress.
+
+        """
+        self._framed = True
+        self._dumps, self._loads = SERIALIZERS[serializer]
+        self._compression = compression
+        logger.debug("Using %s messages with %s compression with %s.",
+                     serializer, compression, self._repr_remote())
+
+    def _encode(self, message):
+        """Encode a message with the current serializer.
+
+        message (object): the message.
+
+        return (bytes): the encoded message.
+
+        raise (TypeError|ValueError): if the message cannot be encoded.
+
+        """
+        try:
+            return self._dumps(message)
+        except OverflowError as error:
+            raise ValueError(error)
+
+    def _decode(self, data):
+        """Decode a message with the current serializer.
+
+        data (bytes): the encoded message.
+
+        return (object): the message.
+
+        raise (ValueError): if the data is not a valid message.
+
+        """
+        return self._loads(data)
+
     @property
     def connected(self):
         """Return whether we're connected to the other endpoint.
@@ -150,8 +267,15 @@ class RemoteServiceBase:
             raise RuntimeError("Already connected.")
 
         self._socket = sock
+        # Each message is sent with a single write, so there is no
+        # reason to delay them waiting for more data.
+        try:
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
         self._reader = self._socket.makefile('rb')
         self._writer = self._socket.makefile('wb')
+        self._reset_protocol()
         self._connection_event.set()
         # IPv4 addresses have two elements (host and port), IPv6 ones
         # have 4 elements (host, port, flowinfo and scopeid). We will
@@ -213,10 +337,12 @@ class RemoteServiceBase:
     def _read(self):
         """Receive a message from the socket.
 
-        Read from the socket until a "\\r\\n" is found. That is what we
-        consider a "message" in the communication protocol.
+        Read from the socket until a "\\r\\n" is found, or read a whole
+        frame if the protocol was upgraded. That is what we consider a
+        "message" in the communication protocol.
 
-        return (bytes): the retrieved message.
+        return (bytes): the retrieved message (decompressed, if it was
+            compressed).
 
         raise (OSError): if reading fails.
 
@@ -228,17 +354,15 @@ class RemoteServiceBase:
             with self._read_lock:
                 if not self.connected:
                     raise OSError("Not connected.")
-                data = self._reader.readline(self.MAX_MESSAGE_SIZE)
-                # If there weren't a "\r\n" between the last message
-                # and the EOF we would have a false positive here.
-                # Luckily there is one.
-                if len(data) > 0 and not data.endswith(b"\r\n"):
-                    logger.error(
-                        "The client sent a message larger than %d bytes (that "
-                        "is MAX_MESSAGE_SIZE). Consider raising that value if "
-                        "the message seemed legit.", self.MAX_MESSAGE_SIZE)
-                    self.finalize("Client misbehaving.")
-                    raise OSError("Message too long.")
+                if self._framed:
+                    data = self._read_frame()
+                else:
+                    data = self._reader.readline(self.MAX_MESSAGE_SIZE)
+                    # If there weren't a "\r\n" between the last message
+                    # and the EOF we would have a false positive here.
+                    # Luckily there is one.
+                    if len(data) > 0 and not data.endswith(b"\r\n"):
+                        self._message_too_long()
         except OSError as error:
             if self.connected:
                 logger.warning("Failed reading from socket: %s.", error)
@@ -251,10 +375,59 @@ class RemoteServiceBase:
 
         return data
 
+    def _message_too_long(self):
+        """Drop the connection after receiving a message too long.
+
+        raise (OSError): always.
+
+        """
+        logger.error(
+            "The client sent a message larger than %d bytes (that "
+            "is MAX_MESSAGE_SIZE). Consider raising that value if "
+            "the message seemed legit.", self.MAX_MESSAGE_SIZE)
+        self.finalize("Client misbehaving.")
+        raise OSError("Message too long.")
+
+    def _read_frame(self):
+        """Read a frame from the socket.
+
+        return (bytes): the payload of the frame, decompressed, or an
+            empty string on EOF.
+
+        raise (OSError): if reading fails or the frame is invalid.
+
+        """
+        header = self._reader.read(self.FRAME_HEADER.size)
+        if len(header) == 0:
+            return b""
+        if len(header) < self.FRAME_HEADER.size:
+            raise OSError("Connection closed in the middle of a frame.")
+        length, flags = self.FRAME_HEADER.unpack(header)
+        if length > self.MAX_MESSAGE_SIZE:
+            self._message_too_long()
+        data = self._reader.read(length)
+        if len(data) < length:
+            raise OSError("Connection closed in the middle of a frame.")
+        if flags & self.FLAG_COMPRESSED:
+            decompressor = zlib.decompressobj()
+            try:
+                data = decompressor.decompress(data,
+                                               self.MAX_MESSAGE_SIZE + 1)
+            except zlib.error as error:
+                raise OSError("Invalid compressed frame: %s." % error)
+            if len(data) > self.MAX_MESSAGE_SIZE \
+                    or not decompressor.eof:
+                self._message_too_long()
+        # An empty payload would look like EOF to the callers.
+        if len(data) == 0:
+            raise OSError("Empty frame.")
+        return data
+
     def _write(self, data):
         """Send a message to the socket.
 
-        Automatically append "\\r\\n" to make it a correct message.
+        Automatically append "\\r\\n" to make it a correct message, or
+        make a frame out of it if the protocol was upgraded.
 
         data (bytes): the message to transmit.
 
@@ -264,26 +437,41 @@ class RemoteServiceBase:
         if not self.connected:
             raise OSError("Not connected.")
 
-        if len(data + b'\r\n') > self.MAX_MESSAGE_SIZE:
-            logger.error(
-                "A message wasn't sent to %r because it was larger than %d "
-                "bytes (that is MAX_MESSAGE_SIZE). Consider raising that "
-                "value if the message seemed legit.", self._repr_remote(),
-                self.MAX_MESSAGE_SIZE)
-            # No need to call finalize.
-            raise OSError("Message too long.")
+        # The protocol might change during the negotiation, so we
+        # decide how to send the message while holding the lock.
+        with self._write_lock:
+            size = len(data) if self._framed else len(data) + 2
+            if size > self.MAX_MESSAGE_SIZE:
+                logger.error(
+                    "A message wasn't sent to %r because it was larger than "
+                    "%d bytes (that is MAX_MESSAGE_SIZE). Consider raising "
+                    "that value if the message seemed legit.",
+                    self._repr_remote(), self.MAX_MESSAGE_SIZE)
+                # No need to call finalize.
+                raise OSError("Message too long.")
+
+            if not self._framed:
+                data += b'\r\n'
+            else:
+                flags = 0
+                if self._compression is not None \
+                        and len(data) > self.COMPRESSION_THRESHOLD:
+                    compressed = zlib.compress(data, 1)
+                    if len(compressed) < len(data):
+                        data = compressed
+                        flags |= self.FLAG_COMPRESSED
+                data = self.FRAME_HEADER.pack(len(data), flags) + data
 
-        try:
-            with self._write_lock:
+            try:
                 if not self.connected:
                     raise OSError("Not connected.")
                 # Does the same as self._socket.sendall.
-                self._writer.write(data + b'\r\n')
+                self._writer.write(data)
                 self._writer.flush()
-        except OSError as error:
-            self.finalize("Write failed.")
-            logger.warning("Failed writing to socket: %s.", error)
-            raise error
+            except OSError as error:
+                self.finalize("Write failed.")
+                logger.warning("Failed writing to socket: %s.", error)
+                raise error
 
 
 class RemoteServiceServer(RemoteServiceBase):
@@ -332,6 +520,7 @@ class RemoteServiceServer(RemoteServiceBase):
         it's therefore advisable to spawn a greenlet to call it.
 
         """
+        first = True
         while True:
             try:
                 data = self._read()
@@ -342,12 +531,66 @@ class RemoteServiceServer(RemoteServiceBase):
                 self.finalize("Connection closed.")
                 break
 
+            # The negotiation must be done before reading the next
+            # message, that might use the new protocol.
+            if first:
+                first = False
+                if self._negotiate(data):
+                    continue
+
             gevent.spawn(self.process_data, data)
 
+    def _negotiate(self, data):
+        """Upgrade the protocol, if the first message asks to.
+
+        We choose the first serializer proposed by the client that we
+        can use too (falling back to JSON), and compress the messages
+        if the client can decompress them.
+
+        data (bytes): the first message read from the socket.
+
+        return (bool): whether the message was a request to upgrade
+            the protocol, and was handled.
+
+        """
+        try:
+            request = _json_loads(data)
+        except ValueError:
+            return False
+        if not isinstance(request, dict) \
+                or request.get("__method") != self.NEGOTIATE_METHOD \
+                or "__id" not in request \
+                or not isinstance(request.get("__data"), dict):
+            return False
+
+        proposed = request["__data"].get("serializers")
+        if not isinstance(proposed, list):
+            proposed = []
+        available = get_available_serializers()
+        serializer = next((serializer for serializer in proposed
+                           if serializer in available), "json")
+        compressions = request["__data"].get("compressions")
+        compression = "zlib" \
+            if isinstance(compressions, list) and "zlib" in compressions \
+            else None
+
+        response = {"__id": request["__id"],
+                    "__data": {"serializer": serializer,
+                               "compression": compression,
+                               "batch": True},
+                    "__error": None}
+        try:
+            self._write(_json_dumps(response))
+        except OSError:
+            # Log messages have already been produced.
+            return True
+        self._set_protocol(serializer, compression)
+        return True
+
     def process_data(self, data):
         """Handle the message.
 
-        JSON-decode it and forward it to process_incoming_request
+        Decode it and forward it to process_incoming_request
         (unconditionally!).
 
         data (bytes): the message read from the socket.
@@ -355,13 +598,21 @@ class RemoteServiceServer(RemoteServiceBase):
         """
         # Decode the incoming data.
         try:
-            message = json.loads(data.decode('utf-8'))
+            message = self._decode(data)
         except ValueError:
             self.disconnect("Bad request received")
             logger.warning("Cannot parse incoming message, discarding.")
             return
 
-        self.process_incoming_request(message)
+        if not isinstance(message, dict):
+            self.disconnect("Bad request received")
+            logger.warning("Incoming message is not a request, discarding.")
+            return
+
+        if "__batch" in message:
+            self.process_incoming_batch(message["__batch"])
+        else:
+            self.process_incoming_request(message)
 
     def process_incoming_request(self, request):
         """Handle the request.
@@ -371,12 +622,65 @@ class RemoteServiceServer(RemoteServiceBase):
 
         request (dict): the JSON-decoded request.
 
+        """
+        response = self._execute_request(request)
+        if response is not None:
+            self._send_response(response)
+
+    def process_incoming_batch(self, requests):
+        """Handle many requests received in a single message.
+
+        Execute the requests one after the other, in the order in
+        which they were issued, and send all the responses in a single
+        message.
+
+        requests ([dict]): the decoded requests.
+
+        """
+        if not isinstance(requests, list):
+            self.disconnect("Bad request received")
+            logger.warning("Batch is not a list of requests, ignoring.")
+            return
+
+        responses = []
+        for request in requests:
+            response = self._execute_request(request)
+            if response is None:
+                return
+            responses.append(response)
+
+        try:
+            data = self._encode({"__batch": responses})
+        except (TypeError, ValueError):
+            data = None
+        if data is None or len(data) + 2 > self.MAX_MESSAGE_SIZE:
+            # Some responses cannot be sent together with the others.
+            for response in responses:
+                self._send_response(response)
+            return
+
+        try:
+            self._write(data)
+        except OSError:
+            # Log messages have already been produced.
+            return
+
+    def _execute_request(self, request):
+        """Execute the method a request asks for.
+
+        request (dict): the decoded request.
+
+        return (dict|None): the response, or None if the request was
+            malformed (and the connection was closed).
+
         """
         # Validate the request.
-        if not {"__id", "__method", "__data"}.issubset(request.keys()):
+        if not isinstance(request, dict) \
+                or not {"__id", "__method", "__data"}.issubset(
+                    request.keys()):
             self.disconnect("Bad request received")
             logger.warning("Request is missing some fields, ignoring.")
-            return
+            return None
 
         # Determine the ID.
         id_ = request["__id"]
@@ -406,11 +710,19 @@ class RemoteServiceServer(RemoteServiceBase):
                         (error.__class__.__name__, error,
                          traceback.format_exc())
 
+        return response
+
+    def _send_response(self, response):
+        """Encode and send a response.
+
+        response (dict): the response.
+
+        """
         # Encode it.
         try:
-            data = json.dumps(response).encode('utf-8')
+            data = self._encode(response)
         except (TypeError, ValueError):
-            logger.warning("JSON encoding failed.", exc_info=True)
+            logger.warning("Encoding failed.", exc_info=True)
             return
 
         # Send it.
@@ -459,6 +771,12 @@ class RemoteServiceClient(RemoteServiceBase):
 
         self._loop = None
 
+        # Whether the server accepts many requests in a message, and
+        # the requests waiting for the end of the batch open by each
+        # greenlet (if any).
+        self._batch_supported = False
+        self._batch = gevent.local.local()
+
     def _repr_remote(self):
         """See RemoteServiceBase._repr_remote."""
         return "%s:%d (%r)" % (self.remote_address +
@@ -467,6 +785,7 @@ class RemoteServiceClient(RemoteServiceBase):
     def finalize(self, reason=""):
         """See RemoteServiceBase.finalize."""
         super().finalize(reason)
+        self._batch_supported = False
 
         for result in self.pending_outgoing_requests_results.values():
             result.set_exception(RPCError(reason))
@@ -512,10 +831,54 @@ class RemoteServiceClient(RemoteServiceBase):
                 gevent.sleep(self.auto_retry)
                 self._connect()
             if self.connected:
+                self._negotiate()
                 self.run()
             if self.auto_retry is None:
                 break
 
+    def _negotiate(self):
+        """Ask the server to upgrade the protocol of the connection.
+
+        Servers that do not know how to upgrade it answer with an
+        error (as the method does not exist), in which case we keep
+        using JSON lines. We hold the write lock until the answer
+        arrives, so that no other request is sent in the meantime.
+
+        """
+        request = {"__id": uuid.uuid4().hex,
+                   "__method": self.NEGOTIATE_METHOD,
+                   "__data": {"serializers": get_available_serializers(),
+                              "compressions": ["zlib"],
+                              "batch": True}}
+        with self._write_lock:
+            try:
+                self._write(_json_dumps(request))
+                data = self._read()
+            except OSError:
+                # Log messages have already been produced.
+                return
+            if len(data) == 0:
+                return
+
+            try:
+                response = _json_loads(data)
+                if response["__error"] is not None:
+                    logger.debug("%s cannot upgrade the protocol.",
+                                 self._repr_remote())
+                    return
+                serializer = response["__data"]["serializer"]
+                compression = response["__data"]["compression"]
+                if serializer not in SERIALIZERS \
+                        or compression not in (None, "zlib"):
+                    raise ValueError("Unknown protocol.")
+            except (ValueError, TypeError, KeyError):
+                self.disconnect("Bad response received")
+                logger.warning("Cannot parse the answer to the protocol "
+                               "negotiation, disconnecting.")
+                return
+            self._set_protocol(serializer, compression)
+            self._batch_supported = response["__data"].get("batch") is True
+
     def connect(self):
         """Connect and start the main loop.
 
@@ -554,7 +917,7 @@ class RemoteServiceClient(RemoteServiceBase):
     def process_data(self, data):
         """Handle the message.
 
-        JSON-decode it and forward it to process_incoming_response
+        Decode it and forward it to process_incoming_response
         (unconditionally!).
 
         data (bytes): the message read from the socket.
@@ -562,13 +925,29 @@ class RemoteServiceClient(RemoteServiceBase):
         """
         # Decode the incoming data.
         try:
-            message = json.loads(data.decode('utf-8'))
+            message = self._decode(data)
         except ValueError:
             self.disconnect("Bad response received")
             logger.warning("Cannot parse incoming message, discarding.")
             return
 
-        self.process_incoming_response(message)
+        if not isinstance(message, dict):
+            self.disconnect("Bad response received")
+            logger.warning("Incoming message is not a response, discarding.")
+            return
+
+        if "__batch" in message:
+            if not isinstance(message["__batch"], list) or not all(
+                    isinstance(response, dict)
+                    for response in message["__batch"]):
+                self.disconnect("Bad response received")
+                logger.warning("Batch is not a list of responses, "
+                               "discarding.")
+                return
+            for response in message["__batch"]:
+                self.process_incoming_response(response)
+        else:
+            self.process_incoming_response(message)
 
     def process_incoming_response(self, response):
         """Handle the response.
@@ -607,6 +986,9 @@ class RemoteServiceClient(RemoteServiceBase):
     def execute_rpc(self, method, data):
         """Send an RPC request to the remote service.
 
+        If the current greenlet opened a batch (see batch), the request
+        is only sent when the batch is closed.
+
         method (string): the name of the method to call.
         data (dict): keyword arguments to pass to the methods.
 
@@ -625,27 +1007,112 @@ class RemoteServiceClient(RemoteServiceBase):
 
         result = gevent.event.AsyncResult()
 
-        # Encode it.
-        try:
-            data = json.dumps(request).encode('utf-8')
-        except (TypeError, ValueError):
-            logger.error("JSON encoding failed.", exc_info=True)
-            result.set_exception(RPCError("JSON encoding failed."))
-            return result
-
-        # Send it.
-        try:
-            self._write(data)
-        except OSError:
-            result.set_exception(RPCError("Write failed."))
-            return result
-
         # Store it.
         self.pending_outgoing_requests[id_] = request
         self.pending_outgoing_requests_results[id_] = result
 
+        batched_requests = getattr(self._batch, "requests", None)
+        if batched_requests is not None:
+            batched_requests.append(request)
+        else:
+            self._send_request(request)
+
         return result
 
+    def _fail_request(self, request, reason):
+        """Make a request fail, if it is still pending.
+
+        request (dict): the request.
+        reason (str): the error message.
+
+        """
+        id_ = request["__id"]
+        if id_ in self.pending_outgoing_requests:
+            del self.pending_outgoing_requests[id_]
+            self.pending_outgoing_requests_results.pop(id_)\
+                .set_exception(RPCError(reason))
+
+    def _send_request(self, request):
+        """Encode and send a single request.
+
+        request (dict): the request, already pending.
+
+        """
+        # Encode and send it, with the same protocol.
+        with self._write_lock:
+            try:
+                data = self._encode(request)
+            except (TypeError, ValueError):
+                logger.error("Encoding failed.", exc_info=True)
+                self._fail_request(request, "Encoding failed.")
+                return
+
+            try:
+                self._write(data)
+            except OSError:
+                self._fail_request(request, "Write failed.")
+
+    def _send_requests(self, requests):
+        """Send many requests, in as few messages as possible.
+
+        requests ([dict]): the requests, already pending.
+
+        """
+        if len(requests) == 0:
+            return
+        with self._write_lock:
+            if len(requests) == 1 or not self._batch_supported:
+                for request in requests:
+                    self._send_request(request)
+                return
+
+            try:
+                data = self._encode({"__batch": requests})
+            except (TypeError, ValueError):
+                data = None
+            if data is None or len(data) + 2 > self.MAX_MESSAGE_SIZE:
+                # Split the batch until each part can be sent, or the
+                # requests that cannot be encoded are alone.
+                half = len(requests) // 2
+                self._send_requests(requests[:half])
+                self._send_requests(requests[half:])
+                return
+
+            try:
+                self._write(data)
+            except OSError:
+                for request in requests:
+                    self._fail_request(request, "Write failed.")
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Send the requests issued in a block together.
+
+        All the requests issued in the block by the current greenlet
+        (those of the other greenlets are sent as usual) are sent when
+        it ends, in as few messages as possible if the server supports
+        it, and the server executes them one after the other. This is
+        meant for many short calls, like notifications; their results
+        are available only after the block. Nested blocks are part of
+        the outermost one.
+
+        """
+        if getattr(self._batch, "requests", None) is not None:
+            yield
+            return
+        self._batch.requests = []
+        try:
+            yield
+        finally:
+            requests = [request for request in self._batch.requests
+                        if request["__id"] in self.pending_outgoing_requests]
+            self._batch.requests = None
+            if self.connected:
+                self._send_requests(requests)
+            else:
+                for request in requests:
+                    self._fail_request(request, "Not connected.")
+
     def __getattr__(self, method):
         """Syntactic sugar to enable a transparent proxy.
 
@@ -729,6 +1196,8 @@ class FakeRemoteServiceClient(RemoteServiceClient):
         self.pending_outgoing_requests = dict()
         self.pending_outgoing_requests_results = dict()
         self.auto_retry = auto_retry
+        self._batch_supported = False
+        self._batch = gevent.local.local()
 
     def connect(self):
         """Do nothing, as this is a fake client."""
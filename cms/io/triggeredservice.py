@@ -81,18 +81,20 @@ class Executor(metaclass=ABCMeta):
         """
         return self._operation_queue.get_status()
 
-    def enqueue(self, item, priority=None, timestamp=None):
+    def enqueue(self, item, priority=None, timestamp=None, rank=None):
         """Add an item to the queue.
 
         item (QueueItem): the item to add.
         priority (int|None) the priority, or None to use default.
         timestamp (datetime|None) the timestamp of the first request
             for the operation, or None to use now.
+        rank (object|None) the rank among the items with the same
+            priority, or None to use the timestamp.
 
         return (bool): True if successfully enqueued.
 
         """
-        return self._operation_queue.push(item, priority, timestamp)
+        return self._operation_queue.push(item, priority, timestamp, rank)
 
     def dequeue(self, item):
         """Remove an item from the queue.
@@ -104,6 +106,19 @@ class Executor(metaclass=ABCMeta):
         """
         return self._operation_queue.remove(item)
 
+    def set_priority(self, item, priority):
+        """Change the priority of an item in the queue.
+
+        item (QueueItem): the item.
+        priority (int): the new priority.
+
+        return (int): the previous priority of the item.
+
+        raise (LookupError): if the item is not in the queue.
+
+        """
+        return self._operation_queue.set_priority(item, priority)
+
     def _pop(self, wait=False):
         """Extract (and return) the first element in the queue.
 
@@ -133,7 +148,8 @@ class Executor(metaclass=ABCMeta):
                 max_operations = self.max_operations_per_batch()
                 while not self._operation_queue.empty() and (
                         max_operations == 0 or
-                        len(to_execute) < max_operations):
+                        len(to_execute) < max_operations) \
+                        and not self.batch_is_full(to_execute):
                     to_execute.append(self._pop())
 
             assert len(to_execute) > 0, "Expected at least one element."
@@ -176,6 +192,20 @@ class Executor(metaclass=ABCMeta):
         """
         return 0
 
+    def batch_is_full(self, unused_entries):
+        """Return whether a batch should not grow any further.
+
+        If the service has batch executions, this method is called
+        before adding each operation to a batch, in addition to the
+        limit of max_operations_per_batch.
+
+        unused_entries ([QueueEntry]): the entries in the batch.
+
+        return (bool): True if no more entries should be added.
+
+        """
+        return False
+
     @abstractmethod
     def execute(self, entry):
         """Perform a single operation.
@@ -20,6 +20,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
 
 import collections
 try:
@@ -32,10 +33,12 @@ try:
     import tornado4.wsgi as tornado_wsgi
 except ImportError:
     import tornado.wsgi as tornado_wsgi
-from gevent.pywsgi import WSGIServer
+from gevent.pywsgi import WSGIHandler, WSGIServer
+from gevent.socket import wait_write
 from werkzeug.contrib.fixers import ProxyFix
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.middleware.shared_data import SharedDataMiddleware
+from werkzeug.wsgi import FileWrapper
 
 from cms.db.filecacher import FileCacher
 from cms.server.file_middleware import FileServerMiddleware
@@ -49,6 +52,80 @@ logger = logging.getLogger(__name__)
 SECONDS_IN_A_YEAR = 365 * 24 * 60 * 60
 
 
+class SendfileWrapper(FileWrapper):
+    """The wsgi.file_wrapper of SendfileWSGIHandler.
+
+    It iterates over the file like Werkzeug's, but lets the handler
+    recognize the files it can send directly.
+
+    """
+
+    pass
+
+
+class SendfileWSGIHandler(WSGIHandler):
+    """A WSGI handler sending files with sendfile.
+
+    When the application returns a whole file wrapped by the
+    wsgi.file_wrapper of the environment (as FileServerMiddleware does
+    through Werkzeug's wrap_file), and the file is on the filesystem,
+    the content goes from the file to the socket within the kernel,
+    instead of being read and written in chunks by the handler. In all
+    the other cases (e.g., for partial responses, which wrap the file
+    again) the response is sent as usual.
+
+    """
+
+    # Maximum number of bytes to send with one call, to let the other
+    # greenlets run.
+    SENDFILE_CHUNK_SIZE = 1024 * 1024
+
+    def get_environ(self):
+        """See WSGIHandler.get_environ."""
+        environ = super().get_environ()
+        environ["wsgi.file_wrapper"] = SendfileWrapper
+        return environ
+
+    def process_result(self):
+        """See WSGIHandler.process_result."""
+        if not isinstance(self.result, SendfileWrapper):
+            return super().process_result()
+        try:
+            in_fd = self.result.file.fileno()
+            offset = self.result.file.tell()
+        except (AttributeError, OSError):
+            return super().process_result()
+
+        # Send the headers, deciding whether the body is chunked.
+        self.write(b"")
+        if self.response_use_chunked or self.code in (304, 204) \
+                or self.provided_content_length is None:
+            return super().process_result()
+
+        out_fd = self.socket.fileno()
+        remaining = int(self.provided_content_length)
+        while remaining > 0:
+            try:
+                sent = os.sendfile(
+                    out_fd, in_fd, offset,
+                    min(remaining, self.SENDFILE_CHUNK_SIZE))
+            except BlockingIOError:
+                wait_write(out_fd)
+                continue
+            except OSError as error:
+                self.status = "socket error: %s" % error
+                if self.code > 0:
+                    self.code = -self.code
+                raise
+            if sent == 0:
+                # The file is shorter than announced.
+                self.close_connection = True
+                break
+            offset += sent
+            remaining -= sent
+            self.response_length += sent
+
+
 class WebService(Service):
     """RPC service with Web server capabilities.
 
@@ -106,7 +183,8 @@ class WebService(Service):
         if num_proxies_used > 0:
             self.wsgi_app = ProxyFix(self.wsgi_app, num_proxies_used)
 
-        self.web_server = WSGIServer((listen_address, listen_port), self)
+        self.web_server = WSGIServer((listen_address, listen_port), self,
+                                     handler_class=SendfileWSGIHandler)
 
     def __call__(self, environ, start_response):
         """Execute this instance as a WSGI application.
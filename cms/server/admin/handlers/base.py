@@ -647,7 +647,7 @@ class FileFromDigestHandler(FileHandler):
     def get(self, digest, filename):
         # TODO: Accept a MIME type
         self.sql_session.close()
-        self.fetch(digest, "text/plain", filename)
+        self.fetch(digest, "text/plain", filename, immutable=True)
 
 
 def SimpleHandler(page, authenticated=True, permission_all=False):
@@ -139,6 +139,7 @@ class ContestHandler(SimpleContestHandler("contest.html")):
         if self.try_commit():
             # Update the contest on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(contest.id)
         self.redirect(self.url("contest", contest_id))
 
 
@@ -213,10 +214,12 @@ class RemoveContestHandler(BaseHandler):
     @require_permission(BaseHandler.PERMISSION_ALL)
     def delete(self, contest_id):
         contest = self.safe_get_item(Contest, contest_id)
+        contest_id = contest.id
 
         self.sql_session.delete(contest)
         if self.try_commit():
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(contest_id)
 
         # Maybe they'll want to do this again (for another contest)
         self.write("../../contests")
@@ -108,6 +108,8 @@ class QuestionReplyHandler(BaseHandler):
                         question.participation.user.username,
                         question.participation.contest.name,
                         question_id)
+            self.service.new_communications(self.contest.id,
+                                            [question.participation_id])
 
         self.redirect(ref)
 
@@ -27,12 +27,11 @@
 """
 
 import csv
-import io
 
 from sqlalchemy.orm import joinedload
 
 from cms.db import Contest
-from cms.grading.scoring import task_score
+from cms.grading.scoring import get_all_task_scores
 from .base import BaseHandler, require_permission
 
 
@@ -45,16 +44,20 @@ class RankingHandler(BaseHandler):
         # This validates the contest id.
         self.safe_get_item(Contest, contest_id)
 
-        # This massive joined load gets all the information which we will need
-        # to generating the rankings.
         self.contest = self.sql_session.query(Contest)\
             .filter(Contest.id == contest_id)\
             .options(joinedload('participations'))\
-            .options(joinedload('participations.submissions'))\
-            .options(joinedload('participations.submissions.token'))\
-            .options(joinedload('participations.submissions.results'))\
+            .options(joinedload('participations.user'))\
+            .options(joinedload('participations.team'))\
             .first()
 
+        # The scores are mostly read from the cache; only the ones not
+        # valid are computed, from the few columns of the submissions
+        # and results that are needed.
+        task_scores = get_all_task_scores(
+            self.sql_session, self.contest.participations,
+            self.contest.tasks, rounded=True)
+
         # Preprocess participations: get data about teams, scores
         show_teams = False
         for p in self.contest.participations:
@@ -64,7 +67,7 @@ class RankingHandler(BaseHandler):
             total_score = 0.0
             partial = False
             for task in self.contest.tasks:
-                t_score, t_partial = task_score(p, task, rounded=True)
+                t_score, _, _, t_partial = task_scores[(p.id, task.id)]
                 p.scores.append((t_score, t_partial))
                 total_score += t_score
                 partial = partial or t_partial
@@ -83,8 +86,9 @@ class RankingHandler(BaseHandler):
             self.set_header("Content-Disposition",
                             "attachment; filename=\"ranking.csv\"")
 
-            output = io.StringIO()  # untested
-            writer = csv.writer(output)
+            # The rows are written to the response as they are
+            # produced, rather than collected in a buffer first.
+            writer = csv.writer(self)
 
             include_partial = True
 
@@ -124,8 +128,8 @@ class RankingHandler(BaseHandler):
                 if include_partial:
                     row.append("*" if partial else "")
 
-                writer.writerow(row)  # untested
+                writer.writerow(row)
 
-            self.finish(output.getvalue())
+            self.finish()
         else:
             self.render("ranking.html", **self.r_params)
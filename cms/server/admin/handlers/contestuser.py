@@ -137,6 +137,7 @@ class RemoveParticipationHandler(BaseHandler):
         if self.try_commit():
             # Remove the participation on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(self.contest.id)
 
         # Maybe they'll want to do this again (for another participation)
         self.write("../../users")
@@ -167,6 +168,7 @@ class AddContestUserHandler(BaseHandler):
         if self.try_commit():
             # Create the user on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(self.contest.id)
 
         # Maybe they'll want to do this again (for another user)
         self.redirect(fallback_page)
@@ -245,6 +247,7 @@ class ParticipationHandler(BaseHandler):
         if self.try_commit():
             # Update the user on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(self.contest.id)
         self.redirect(fallback_page)
 
 
@@ -275,5 +278,7 @@ class MessageHandler(BaseHandler):
         if self.try_commit():
             logger.info("Message submitted to user %s in contest %s.",
                         user.username, self.contest.name)
+            self.service.new_communications(self.contest.id,
+                                            [participation.id])
 
         self.redirect(self.url("contest", contest_id, "user", user_id, "edit"))
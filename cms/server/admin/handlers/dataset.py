@@ -46,7 +46,8 @@ except ImportError:
 
 from cms.db import Dataset, Manager, Message, Participation, \
     Session, Submission, Task, Testcase
-from cms.grading.scoring import compute_changes_for_dataset
+from cms.grading.scoring import compute_changes_for_dataset, \
+    update_all_task_scores
 from cmscommon.datetime import make_datetime
 from cmscommon.importers import import_testcases_from_zipfile
 from .base import BaseHandler, require_permission
@@ -171,6 +172,8 @@ class CloneDatasetHandler(BaseHandler):
         # one active.
         if task.active_dataset is None:
             task.active_dataset = dataset
+        # The scores stored for the old dataset are not valid anymore.
+        update_all_task_scores(self.sql_session, task)
 
         if self.try_commit():
             self.redirect(self.url("task", task_id))
@@ -284,6 +287,8 @@ class ActivateDatasetHandler(BaseHandler):
         task = dataset.task
 
         task.active_dataset = dataset
+        # The scores stored for the old dataset are not valid anymore.
+        update_all_task_scores(self.sql_session, task)
 
         if self.try_commit():
             self.service.proxy_service.dataset_updated(
@@ -300,7 +305,7 @@ class ActivateDatasetHandler(BaseHandler):
         datetime = make_datetime()
 
         r = re.compile('notify_([0-9]+)$')
-        count = 0
+        participation_ids = []
         for k in self.request.arguments:
             m = r.match(k)
             if not m:
@@ -311,12 +316,14 @@ class ActivateDatasetHandler(BaseHandler):
                               self.get_argument("message_text", ""),
                               participation=participation)
             self.sql_session.add(message)
-            count += 1
+            participation_ids.append(participation.id)
 
         if self.try_commit():
             self.service.add_notification(
                 make_datetime(),
-                "Messages sent to %d users." % count, "")
+                "Messages sent to %d users." % len(participation_ids), "")
+            self.service.new_communications(task.contest_id,
+                                            participation_ids)
 
         self.redirect(self.url("task", task.id))
 
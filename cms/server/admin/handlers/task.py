@@ -42,6 +42,7 @@ except ImportError:
     import tornado.web as tornado_web
 
 from cms.db import Attachment, Dataset, Session, Statement, Submission, Task
+from cms.grading.scoring import update_all_task_scores
 from cmscommon.datetime import make_datetime
 from .base import BaseHandler, SimpleHandler, require_permission
 
@@ -167,7 +168,10 @@ class TaskHandler(BaseHandler):
 
             self.get_string(attrs, "score_mode")
 
+            self.get_bool(attrs, "reuse_evaluations")
+
             # Update the task.
+            score_mode_changed = attrs["score_mode"] != task.score_mode
             task.set_attrs(attrs)
 
         except Exception as error:
@@ -210,6 +214,10 @@ class TaskHandler(BaseHandler):
                 self.redirect(self.url("task", task_id))
                 return
 
+        if score_mode_changed:
+            # The stored scores were computed with the old score mode.
+            update_all_task_scores(self.sql_session, task)
+
         if self.try_commit():
             # Update the task and score on RWS.
             self.service.proxy_service.dataset_updated(
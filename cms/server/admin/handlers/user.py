@@ -87,6 +87,7 @@ class UserHandler(BaseHandler):
         if self.try_commit():
             # Update the user on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed()
         self.redirect(fallback_page)
 
 
@@ -140,6 +141,7 @@ class RemoveUserHandler(BaseHandler):
         self.sql_session.delete(user)
         if self.try_commit():
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed()
 
         # Maybe they'll want to do this again (for another user)
         self.write("../../users")
@@ -292,6 +294,7 @@ class AddParticipationHandler(BaseHandler):
         if self.try_commit():
             # Create the user on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(self.contest.id)
 
         # Maybe they'll want to do this again (for another contest).
         self.redirect(fallback_page)
@@ -330,6 +333,7 @@ class EditParticipationHandler(BaseHandler):
         if self.try_commit():
             # Create the user on RWS.
             self.service.proxy_service.reinitialize()
+            self.service.authentications_changed(self.contest.id)
 
         # Maybe they'll want to do this again (for another contest).
         self.redirect(fallback_page)
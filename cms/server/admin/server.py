@@ -89,6 +89,11 @@ class AdminWebServer(WebService):
                 ServiceCoord("ResourceService", i)))
         self.logservice = self.connect_to(ServiceCoord("LogService", 0))
 
+        self.contest_web_servers = []
+        for i in range(get_service_shards("ContestWebServer")):
+            self.contest_web_servers.append(self.connect_to(
+                ServiceCoord("ContestWebServer", i)))
+
     def is_rpc_authorized(self, service, shard, method):
         return rpc_authorization_checker(self.auth_handler.admin_id,
                                          service, shard, method)
@@ -104,6 +109,32 @@ class AdminWebServer(WebService):
         """
         self.notifications.append((timestamp, subject, text))
 
+    def new_communications(self, contest_id, participation_ids=None):
+        """Tell the contestants about new communications, through all
+        the contest web servers.
+
+        contest_id (int): the id of the contest.
+        participation_ids ([int]|None): the ids of the participations
+            receiving them, or None for all the participations.
+
+        """
+        for contest_web_server in self.contest_web_servers:
+            contest_web_server.new_communications(
+                contest_id=contest_id, participation_ids=participation_ids)
+
+    def authentications_changed(self, contest_id=None):
+        """Tell the contest web servers to forget the authentications
+        they remember (see AuthenticationCache).
+
+        contest_id (int|None): the id of the contest whose
+            participations, or their credentials, changed; None for
+            all contests.
+
+        """
+        for contest_web_server in self.contest_web_servers:
+            contest_web_server.invalidate_authentications(
+                contest_id=contest_id)
+
     @staticmethod
     @rpc_method
     def submissions_status(contest_id):
@@ -25,9 +25,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import ipaddress
 import json
 import logging
+import time
 from datetime import timedelta
 
 from sqlalchemy.orm import contains_eager, joinedload
@@ -38,12 +40,170 @@ from cmscommon.crypto import validate_password
 from cmscommon.datetime import make_datetime, make_timestamp
 
 
-__all__ = ["validate_login", "authenticate_request"]
+__all__ = ["validate_login", "authenticate_request", "AuthenticationCache"]
 
 
 logger = logging.getLogger(__name__)
 
 
+class AuthenticationCache:
+    """A cache of the successful authentications of a process.
+
+    For a contest and a credential (the username and password in a
+    cookie, or an IP address), it remembers which participation they
+    authenticated, for a limited time. Only the lookup is saved: the
+    participation is still loaded, by id, and the credential checked
+    against it, so changes to the participations and users make the
+    entries useless, not wrong. Admins can still clear the entries
+    (e.g., when assigning the same IP address to two participations).
+
+    """
+
+    # Maximum number of entries; when exceeded, expired entries are
+    # removed, and if that is not enough, all of them.
+    MAX_SIZE = 100_000
+
+    def __init__(self, ttl):
+        """Create an empty cache.
+
+        ttl (float): how long an entry is valid, in seconds.
+
+        """
+        self.ttl = ttl
+        # Map (contest id, credential) to (participation id, expiry).
+        self._entries = dict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @staticmethod
+    def cookie_key(username, password):
+        """Return the key of the credential in a cookie.
+
+        username (str): the username in the cookie.
+        password (str): the (hashed) password in the cookie.
+
+        return (tuple): the key.
+
+        """
+        fingerprint = hashlib.sha256(
+            json.dumps([username, password]).encode("utf-8")).hexdigest()
+        return ("cookie", fingerprint)
+
+    @staticmethod
+    def ip_address_key(ip_address):
+        """Return the key of an IP address.
+
+        ip_address (IPv4Address|IPv6Address): the IP address.
+
+        return (tuple): the key.
+
+        """
+        return ("ip", str(ip_address))
+
+    def get(self, contest_id, key):
+        """Return the participation authenticated by a credential.
+
+        contest_id (int): the id of the contest.
+        key (tuple): the key of the credential.
+
+        return (int|None): the id of the participation, if known.
+
+        """
+        entry = self._entries.get((contest_id, key))
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, contest_id, key, participation_id):
+        """Remember the participation authenticated by a credential.
+
+        contest_id (int): the id of the contest.
+        key (tuple): the key of the credential.
+        participation_id (int): the id of the participation.
+
+        """
+        now = time.monotonic()
+        if len(self._entries) >= self.MAX_SIZE:
+            self._entries = dict(
+                (entry_key, entry)
+                for entry_key, entry in self._entries.items()
+                if entry[1] >= now)
+            if len(self._entries) >= self.MAX_SIZE:
+                self._entries.clear()
+        self._entries[(contest_id, key)] = (participation_id, now + self.ttl)
+
+    def discard(self, contest_id, key):
+        """Forget a credential whose participation failed the checks.
+
+        contest_id (int): the id of the contest.
+        key (tuple): the key of the credential.
+
+        """
+        if self._entries.pop((contest_id, key), None) is not None:
+            self.stale += 1
+
+    def invalidate(self, contest_id=None):
+        """Forget the credentials of a contest, or of all contests.
+
+        contest_id (int|None): the id of the contest, or None for all.
+
+        """
+        if contest_id is None:
+            self._entries.clear()
+        else:
+            self._entries = dict(
+                (entry_key, entry)
+                for entry_key, entry in self._entries.items()
+                if entry_key[0] != contest_id)
+
+    def get_stats(self):
+        """Return statistics on the usage of the cache.
+
+        return ({str: int}): the number of lookups that found an entry
+            (hits) or not (misses), of the entries found that did not
+            pass the checks (stale), and the number of entries.
+
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "size": len(self._entries),
+        }
+
+
+def _get_cached_participation(sql_session, contest, cache, key, is_valid):
+    """Return the participation authenticated by a cached credential.
+
+    sql_session (Session): the SQLAlchemy database session used to
+        execute queries.
+    contest (Contest): the contest the user is trying to access.
+    cache (AuthenticationCache): the cache.
+    key (tuple): the key of the credential.
+    is_valid (function): given the participation, return whether the
+        credential still authenticates it.
+
+    return (Participation|None): the participation, if the credential
+        is in the cache and still valid.
+
+    """
+    participation_id = cache.get(contest.id, key)
+    if participation_id is None:
+        return None
+    participation = sql_session.query(Participation) \
+        .options(joinedload(Participation.user)) \
+        .filter(Participation.id == participation_id) \
+        .filter(Participation.contest == contest) \
+        .first()
+    if participation is None or not is_valid(participation):
+        cache.discard(contest.id, key)
+        return None
+    return participation
+
+
 def get_password(participation):
     """Return the password the participation can log in with.
 
@@ -147,7 +307,7 @@ class AmbiguousIPAddress(Exception):
 
 
 def authenticate_request(
-        sql_session, contest, timestamp, cookie, ip_address):
+        sql_session, contest, timestamp, cookie, ip_address, cache=None):
     """Authenticate a user returning to the site, with a cookie.
 
     Given the information the user's browser provided (the cookie) and
@@ -180,6 +340,8 @@ def authenticate_request(
         request (if any).
     ip_address (IPv4Address|IPv6Address): the IP address the request
         came from.
+    cache (AuthenticationCache|None): where to look up and store the
+        participations authenticated by the cookies and IP addresses.
 
     return ((Participation, bytes|None)|(None, None)): if the user
         couldn't be authenticated then return None, otherwise return
@@ -192,7 +354,7 @@ def authenticate_request(
     if contest.ip_autologin:
         try:
             participation = _authenticate_request_by_ip_address(
-                sql_session, contest, ip_address)
+                sql_session, contest, ip_address, cache)
             # If the login is IP-based, the cookie should be cleared.
             if participation is not None:
                 cookie = None
@@ -202,7 +364,7 @@ def authenticate_request(
     if participation is None \
             and contest.allow_password_authentication:
         participation, cookie = _authenticate_request_from_cookie(
-            sql_session, contest, timestamp, cookie)
+            sql_session, contest, timestamp, cookie, cache)
 
     if participation is None:
         return None, None
@@ -227,7 +389,8 @@ def authenticate_request(
     return participation, cookie
 
 
-def _authenticate_request_by_ip_address(sql_session, contest, ip_address):
+def _authenticate_request_by_ip_address(
+        sql_session, contest, ip_address, cache=None):
     """Return the current participation based on the IP address.
 
     sql_session (Session): the SQLAlchemy database session used to
@@ -235,6 +398,7 @@ def _authenticate_request_by_ip_address(sql_session, contest, ip_address):
     contest (Contest): the contest the user is trying to access.
     ip_address (IPv4Address|IPv6Address): the IP address the request
         came from.
+    cache (AuthenticationCache|None): the cache of the authentications.
 
     return (Participation|None): the only participation that is allowed
         to connect from the given IP address, or None if not found.
@@ -247,6 +411,19 @@ def _authenticate_request_by_ip_address(sql_session, contest, ip_address):
     # since we're comparing it for equality with other networks.
     ip_network = ipaddress.ip_network((ip_address, ip_address.max_prefixlen))
 
+    if cache is not None:
+        key = AuthenticationCache.ip_address_key(ip_address)
+        participation = _get_cached_participation(
+            sql_session, contest, cache, key,
+            lambda p: p.ip is not None and ip_network in p.ip
+            and not (contest.block_hidden_participations and p.hidden))
+        if participation is not None:
+            logger.info(
+                "Successful IP authentication from IP address %s, as user "
+                "%s, on contest %s", ip_address, participation.user.username,
+                contest.name)
+            return participation
+
     participations = sql_session.query(Participation) \
         .options(joinedload(Participation.user)) \
         .filter(Participation.contest == contest) \
@@ -279,10 +456,14 @@ def _authenticate_request_by_ip_address(sql_session, contest, ip_address):
     logger.info(
         "Successful IP authentication from IP address %s, as user %s, on "
         "contest %s", ip_address, participation.user.username, contest.name)
+    if cache is not None:
+        cache.put(contest.id, AuthenticationCache.ip_address_key(ip_address),
+                  participation.id)
     return participation
 
 
-def _authenticate_request_from_cookie(sql_session, contest, timestamp, cookie):
+def _authenticate_request_from_cookie(
+        sql_session, contest, timestamp, cookie, cache=None):
     """Return the current participation based on the cookie.
 
     If a participation can be extracted, the cookie is refreshed.
@@ -293,6 +474,7 @@ def _authenticate_request_from_cookie(sql_session, contest, timestamp, cookie):
     timestamp (datetime): the date and the time of the request.
     cookie (bytes|None): the cookie the user's browser provided in the
         request (if any).
+    cache (AuthenticationCache|None): the cache of the authentications.
 
     return ((Participation, bytes)|(None, None)): the participation
         extracted from the cookie and the cookie to set/refresh, or
@@ -326,24 +508,37 @@ def _authenticate_request_from_cookie(sql_session, contest, timestamp, cookie):
                            config.cookie_duration)
         return None, None
 
-    # Load participation from DB and make sure it exists.
-    participation = sql_session.query(Participation) \
-        .join(Participation.user) \
-        .options(contains_eager(Participation.user)) \
-        .filter(Participation.contest == contest) \
-        .filter(User.username == username) \
-        .first()
+    participation = None
+    if cache is not None:
+        key = AuthenticationCache.cookie_key(username, password)
+        participation = _get_cached_participation(
+            sql_session, contest, cache, key,
+            lambda p: p.user.username == username
+            and get_password(p) == password)
+
     if participation is None:
-        log_failed_attempt("user not registered to contest")
-        return None, None
+        # Load participation from DB and make sure it exists.
+        participation = sql_session.query(Participation) \
+            .join(Participation.user) \
+            .options(contains_eager(Participation.user)) \
+            .filter(Participation.contest == contest) \
+            .filter(User.username == username) \
+            .first()
+        if participation is None:
+            log_failed_attempt("user not registered to contest")
+            return None, None
 
-    correct_password = get_password(participation)
+        # We compare hashed password because it would be too expensive
+        # to re-hash the user-provided plaintext password at every
+        # request.
+        if password != get_password(participation):
+            log_failed_attempt("wrong password")
+            return None, None
 
-    # We compare hashed password because it would be too expensive to
-    # re-hash the user-provided plaintext password at every request.
-    if password != correct_password:
-        log_failed_attempt("wrong password")
-        return None, None
+        if cache is not None:
+            cache.put(contest.id, key, participation.id)
+
+    correct_password = get_password(participation)
 
     logger.info("Successful cookie authentication as user %r, on contest %s, "
                 "returning from %s, at %s", username, contest.name, last_update,
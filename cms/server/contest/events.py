@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Events pushed to the contestants by ContestWebServer.
+
+The events tell the pages of the contestants that something changed
+(e.g., there is a new announcement, or a submission has been scored),
+so that they fetch the new data only when needed, instead of polling
+for it. They are sent as Server-Sent Events.
+
+"""
+
+import logging
+import re
+import time
+
+from gevent import Timeout
+from gevent.queue import Queue
+
+from cmscommon.eventsource import Publisher, Subscriber, format_event
+
+
+logger = logging.getLogger(__name__)
+
+
+def _past_key():
+    """Return a key just before the ones of the events sent from now.
+
+    return (int): the number of microseconds since epoch, as in
+        Publisher, minus one.
+
+    """
+    return int(time.time() * 1_000_000) - 1
+
+
+class ParticipationPublisher(Publisher):
+    """A publisher of the events of a participation.
+
+    Unlike Publisher, when a client might have missed some events, it
+    does not send it a "reinit" event (that has no data, so browsers
+    ignore it), but tells the caller, that can make the client fetch
+    again all its data.
+
+    """
+
+    def __init__(self, size):
+        """See Publisher.__init__."""
+        super().__init__(size)
+        # The clients that received only events older than this might
+        # have missed some events: the ones sent before the publisher
+        # was created, or dropped from the cache.
+        self._oldest_key = _past_key()
+
+    def put(self, event, data):
+        """See Publisher.put."""
+        if len(self._cache) == self._cache.maxlen:
+            self._oldest_key = self._cache[0][0]
+        super().put(event, data)
+
+    def get_subscriber(self, last_event_id=None):
+        """Obtain a new subscriber, if the client missed no events.
+
+        last_event_id (unicode|None): the ID of the last event the
+            client received.
+
+        return (Subscriber|None): a new subscriber, that will receive
+            the events after the given one; None if the client did not
+            give a valid ID, or might have missed some events.
+
+        """
+        if last_event_id is None \
+                or not re.match("^[0-9A-Fa-f]+$", last_event_id):
+            return None
+        last_event_key = int(last_event_id, 16)
+        if last_event_key < self._oldest_key:
+            return None
+        queue = Queue()
+        for key, msg in self._cache:
+            if key > last_event_key:
+                queue.put(msg)
+        self._sub_queues.add(queue)
+        return Subscriber(queue)
+
+
+class ContestEvents:
+    """The events of the participations of the contests.
+
+    Each participation has its own publisher, created the first time
+    it waits for events: the events sent before are not needed, as the
+    client fetches all its data when it first connects.
+
+    """
+
+    # Number of events to keep for each participation, for the clients
+    # that are reconnecting.
+    CACHE_SIZE = 50
+
+    # Event telling the client to fetch all its data again.
+    RESET = "reset"
+
+    def __init__(self):
+        # For each contest, the publisher of each participation.
+        self._publishers = dict()
+
+    def _get_publisher(self, contest_id, participation_id):
+        publishers = self._publishers.setdefault(contest_id, dict())
+        if participation_id not in publishers:
+            publishers[participation_id] = \
+                ParticipationPublisher(self.CACHE_SIZE)
+        return publishers[participation_id]
+
+    def send(self, contest_id, participation_ids, event, data="{}"):
+        """Send an event to some participations.
+
+        contest_id (int): the id of the contest.
+        participation_ids ([int]|None): the ids of the participations,
+            or None for all the participations of the contest.
+        event (unicode): the type of the event.
+        data (unicode): the data of the event, as JSON.
+
+        """
+        publishers = self._publishers.get(contest_id, dict())
+        if participation_ids is None:
+            participation_ids = list(publishers.keys())
+        for participation_id in participation_ids:
+            # The participations that never waited for events do not
+            # need them.
+            if participation_id in publishers:
+                publishers[participation_id].put(event, data)
+
+    def wait(self, contest_id, participation_id, last_event_id, timeout):
+        """Wait for the events of a participation.
+
+        contest_id (int): the id of the contest.
+        participation_id (int): the id of the participation.
+        last_event_id (unicode|None): the ID of the last event the
+            client received, if any.
+        timeout (float): the maximum time to wait, in seconds.
+
+        return (bytes): the events after the given one, formatted for
+            a Server-Sent Events stream, as soon as there is one;
+            instead, a reset event if the client has to fetch all its
+            data again; nothing if no event arrived before the
+            timeout.
+
+        """
+        publisher = self._get_publisher(contest_id, participation_id)
+        subscriber = publisher.get_subscriber(last_event_id)
+        if subscriber is None:
+            # Only this client receives it, but its ID is consistent
+            # with the ones of the publisher.
+            return format_event("%x" % _past_key(), self.RESET, "{}")
+        with Timeout(timeout, False):
+            return b"".join(subscriber.get())
+        return b""
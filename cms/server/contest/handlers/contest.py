@@ -159,7 +159,8 @@ class ContestHandler(BaseHandler):
             return None
 
         participation, cookie = authenticate_request(
-            self.sql_session, self.contest, self.timestamp, cookie, ip_address)
+            self.sql_session, self.contest, self.timestamp, cookie, ip_address,
+            cache=self.service.authentication_cache)
 
         if cookie is None:
             self.clear_cookie(cookie_name)
@@ -314,6 +314,43 @@ class NotificationsHandler(ContestHandler):
         self.write(json.dumps(res))
 
 
+class EventsHandler(ContestHandler):
+    """Send the events of the participation, as Server-Sent Events.
+
+    CWS cannot stream a response, so this is a long poll: it returns
+    as soon as there are events (or after a while without), and the
+    browser connects again, giving the ID of the last event received.
+
+    """
+
+    refresh_cookie = False
+
+    # Seconds to wait for an event, below the usual proxy timeouts.
+    TIMEOUT = 25
+
+    # Milliseconds the browser waits before connecting again.
+    RETRY = 500
+
+    @tornado_web.authenticated
+    @multi_contest
+    def get(self):
+        participation = self.current_user
+        contest_id = self.contest.id
+        participation_id = participation.id
+        last_event_id = self.request.headers.get("Last-Event-ID")
+
+        # Do not hold a database connection while waiting.
+        self.sql_session.rollback()
+
+        events = self.service.events.wait(
+            contest_id, participation_id, last_event_id, self.TIMEOUT)
+
+        self.set_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        self.write(b"retry:%d\n\n" % self.RETRY)
+        self.write(events)
+
+
 class PrintingHandler(ContestHandler):
     """Serve the interface to print and handle submitted print jobs.
 
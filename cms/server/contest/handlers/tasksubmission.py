@@ -48,7 +48,7 @@ from sqlalchemy.orm import joinedload
 from cms import config, FEEDBACK_LEVEL_FULL
 from cms.db import Submission, SubmissionResult
 from cms.grading.languagemanager import get_language
-from cms.grading.scoring import task_score
+from cms.grading.scoring import get_task_scores, update_task_scores
 from cms.server import multi_contest
 from cms.server.contest.submission import get_submission_count, \
     UnacceptableSubmission, accept_submission
@@ -92,6 +92,8 @@ class SubmitHandler(ContestHandler):
                 self.sql_session, self.service.file_cacher, self.current_user,
                 task, self.timestamp, self.request.files,
                 self.get_argument("language", None), official)
+            update_task_scores(self.sql_session,
+                               [(self.current_user.id, task.id)])
             self.sql_session.commit()
         except UnacceptableSubmission as e:
             logger.info("Sent error: `%s' - `%s'", e.subject, e.formatted_text)
@@ -133,12 +135,8 @@ class TaskSubmissionsHandler(ContestHandler):
             .options(joinedload(Submission.results))\
             .all()
 
-        public_score, is_public_score_partial = task_score(
-            participation, task, public=True, rounded=True)
-        tokened_score, is_tokened_score_partial = task_score(
-            participation, task, only_tokened=True, rounded=True)
-        # These two should be the same, anyway.
-        is_score_partial = is_public_score_partial or is_tokened_score_partial
+        task_scores = get_task_scores(
+            self.sql_session, participation, task, rounded=True)
 
         submissions_left_contest = None
         if self.contest.max_submission_number is not None:
@@ -169,9 +167,9 @@ class TaskSubmissionsHandler(ContestHandler):
         download_allowed = self.contest.submissions_download_allowed
         self.render("task_submissions.html",
                     task=task, submissions=submissions,
-                    public_score=public_score,
-                    tokened_score=tokened_score,
-                    is_score_partial=is_score_partial,
+                    public_score=task_scores.public_score,
+                    tokened_score=task_scores.tokened_score,
+                    is_score_partial=task_scores.partial,
                     tokens_task=task.token_mode,
                     tokens_info=tokens_info,
                     submissions_left=submissions_left,
@@ -204,20 +202,11 @@ class SubmissionStatusHandler(ContestHandler):
             "task_is_score_partial" as partial info is the same for both.
 
         """
-        # Just to preload all information required to compute the task score.
-        self.sql_session.query(Submission)\
-            .filter(Submission.participation == participation)\
-            .filter(Submission.task == task)\
-            .options(joinedload(Submission.token))\
-            .options(joinedload(Submission.results))\
-            .all()
-        data["task_public_score"], public_score_is_partial = \
-            task_score(participation, task, public=True, rounded=True)
-        data["task_tokened_score"], tokened_score_is_partial = \
-            task_score(participation, task, only_tokened=True, rounded=True)
-        # These two should be the same, anyway.
-        data["task_score_is_partial"] = \
-            public_score_is_partial or tokened_score_is_partial
+        task_scores = get_task_scores(
+            self.sql_session, participation, task, rounded=True)
+        data["task_public_score"] = task_scores.public_score
+        data["task_tokened_score"] = task_scores.tokened_score
+        data["task_score_is_partial"] = task_scores.partial
 
         score_type = task.active_dataset.score_type_object
         data["task_public_score_message"] = score_type.format_score(
@@ -388,6 +377,8 @@ class UseTokenHandler(ContestHandler):
 
         try:
             accept_token(self.sql_session, submission, self.timestamp)
+            update_task_scores(self.sql_session,
+                               [(self.current_user.id, task.id)])
             self.sql_session.commit()
         except UnacceptableToken as e:
             self.notify_error(e.subject, e.text)
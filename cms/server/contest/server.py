@@ -37,15 +37,18 @@
 
 """
 
+import json
 import logging
 
 from werkzeug.middleware.shared_data import SharedDataMiddleware
 
 from cms import ConfigError, ServiceCoord, config
-from cms.io import WebService
+from cms.io import WebService, rpc_method
 from cms.locale import get_translations
 from cms.server.contest.jinja2_toolbox import CWS_ENVIRONMENT
 from cmscommon.binary import hex_to_bin
+from .authentication import AuthenticationCache
+from .events import ContestEvents
 from .handlers import HANDLERS
 from .handlers.base import ContestListHandler
 from .handlers.main import MainHandler
@@ -113,6 +116,16 @@ class ContestWebServer(WebService):
         # of tuples (timestamp, subject, text).
         self.notifications = {}
 
+        # The events to push to the contestants (see EventsHandler).
+        self.events = ContestEvents()
+
+        # The participations authenticated by the cookies and the IP
+        # addresses, if enabled.
+        self.authentication_cache = None
+        if config.authentication_cache_ttl > 0:
+            self.authentication_cache = AuthenticationCache(
+                config.authentication_cache_ttl)
+
         # Retrieve the available translations.
         self.translations = get_translations()
 
@@ -145,3 +158,55 @@ class ContestWebServer(WebService):
         if username not in self.notifications:
             self.notifications[username] = []
         self.notifications[username].append((timestamp, subject, text, level))
+
+    @rpc_method
+    def new_communications(self, contest_id, participation_ids=None):
+        """Tell the contestants that there are new communications.
+
+        Called when announcements or messages are sent, or questions
+        are answered.
+
+        contest_id (int): the id of the contest.
+        participation_ids ([int]|None): the ids of the participations
+            receiving them, or None for all the participations.
+
+        """
+        self.events.send(contest_id, participation_ids, "communication")
+
+    @rpc_method
+    def submissions_scored(self, submissions):
+        """Tell the contestants that their submissions were scored.
+
+        submissions ([dict]): for each submission, the ids of its
+            contest ("contest_id"), participation ("participation_id")
+            and task ("task_id").
+
+        """
+        for submission in submissions:
+            self.events.send(submission["contest_id"],
+                             [submission["participation_id"]],
+                             "submission",
+                             json.dumps({"task_id": submission["task_id"]}))
+
+    @rpc_method
+    def invalidate_authentications(self, contest_id=None):
+        """Forget the participations authenticated by the cookies and
+        the IP addresses.
+
+        contest_id (int|None): the id of the contest, or None for all.
+
+        """
+        if self.authentication_cache is not None:
+            self.authentication_cache.invalidate(contest_id)
+
+    @rpc_method
+    def authentication_cache_stats(self):
+        """RPC to get the statistics of the cache of authentications.
+
+        return ({str: int}|None): see AuthenticationCache.get_stats;
+            None if the cache is disabled.
+
+        """
+        if self.authentication_cache is None:
+            return None
+        return self.authentication_cache.get_stats()
@@ -88,6 +88,51 @@ CMS.CWSUtils.prototype.update_notifications = function(hush) {
 };
 
 
+/**
+ * Listen to the events of the participation: fetch the notifications
+ * when there are new ones, and tell the page about the scored
+ * submissions (with a "cms:submission_scored" event on the document).
+ * Fall back to polling the notifications if the browser cannot.
+ */
+CMS.CWSUtils.prototype.listen_events = function() {
+    var self = this;
+    var polling = false;
+    var poll = function() {
+        if (polling) {
+            return;
+        }
+        polling = true;
+        self.update_notifications(true);
+        setInterval(function() { self.update_notifications(); }, 30000);
+    };
+    if (!("EventSource" in window)) {
+        poll();
+        return;
+    }
+
+    // The first reset event comes right after connecting; the others
+    // if some events might have been lost.
+    var first = true;
+    var source = new EventSource(this.contest_url("events"));
+    source.addEventListener("reset", function() {
+        self.update_notifications(first);
+        first = false;
+    });
+    source.addEventListener("communication", function() {
+        self.update_notifications();
+    });
+    source.addEventListener("submission", function(event) {
+        $(document).trigger("cms:submission_scored", [JSON.parse(event.data)]);
+    });
+    source.addEventListener("error", function() {
+        // The browser does not connect again after some errors.
+        if (source.readyState == EventSource.CLOSED) {
+            poll();
+        }
+    });
+};
+
+
 CMS.CWSUtils.prototype.display_notification = function(type, timestamp,
                                                        subject, text,
                                                        level, hush) {
@@ -17,7 +17,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+
 from werkzeug.exceptions import HTTPException, NotFound, ServiceUnavailable
+from werkzeug.http import is_resource_modified
 from werkzeug.wrappers import Response, Request
 from werkzeug.wsgi import responder, wrap_file
 
@@ -41,10 +44,20 @@ class FileServerMiddleware:
     streams back the file that was requested, using a proper compliant
     way.
 
+    The digest of the file is its (strong) ETag: as the content of a
+    digest never changes, a client that already has the file is told
+    so without even opening it. If the URL itself identifies the
+    content (e.g., it contains the digest), the handler can also mark
+    the file as immutable, so that clients do not ask for it again.
+
     """
 
     DIGEST_HEADER = "X-CMS-File-Digest"
     FILENAME_HEADER = "X-CMS-File-Filename"
+    IMMUTABLE_HEADER = "X-CMS-File-Immutable"
+
+    # How long clients can keep the immutable files, in seconds.
+    IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
     def __init__(self, file_cacher, app):
         """Create an instance.
@@ -83,28 +96,48 @@ class FileServerMiddleware:
 
         digest = original_response.headers.pop(self.DIGEST_HEADER)
         filename = original_response.headers.pop(self.FILENAME_HEADER, None)
+        immutable = \
+            original_response.headers.pop(self.IMMUTABLE_HEADER, None) \
+            is not None
         mimetype = original_response.mimetype
 
+        response = Response()
+        response.mimetype = mimetype
+        if filename is not None:
+            response.headers.add(
+                "Content-Disposition", "attachment", filename=filename)
+        response.set_etag(digest)
+        if immutable:
+            response.headers["Cache-Control"] = \
+                "private, max-age=%d, immutable" % self.IMMUTABLE_MAX_AGE
+        else:
+            response.cache_control.no_cache = True
+            response.cache_control.private = True
+
+        # The client already has this content: no need to look for it.
+        if environ["REQUEST_METHOD"] in ("GET", "HEAD") \
+                and not is_resource_modified(environ, etag=digest):
+            response.status_code = 304
+            return response
+
         try:
             fobj = self.file_cacher.get_file(digest)
-            size = self.file_cacher.get_size(digest)
         except KeyError:
             return NotFound()
         except TombstoneError:
             return ServiceUnavailable()
 
+        try:
+            size = self._get_size(digest, fobj)
+        except KeyError:
+            fobj.close()
+            return NotFound()
+
         request = Request(environ)
         request.encoding_errors = "strict"
 
-        response = Response()
         response.status_code = 200
-        response.mimetype = mimetype
-        if filename is not None:
-            response.headers.add(
-                "Content-Disposition", "attachment", filename=filename)
-        response.set_etag(digest)
-        response.cache_control.no_cache = True
-        response.cache_control.private = True
+        response.content_length = size
         response.response = \
             wrap_file(environ, fobj, buffer_size=FileCacher.CHUNK_SIZE)
         response.direct_passthrough = True
@@ -114,6 +147,25 @@ class FileServerMiddleware:
             response.make_conditional(
                 request, accept_ranges=True, complete_length=size)
         except HTTPException as exc:
+            fobj.close()
             return exc
 
         return response
+
+    def _get_size(self, digest, fobj):
+        """Return the size of a file being served.
+
+        digest (str): the digest of the file.
+        fobj (fileobj): the file, as returned by the file cacher.
+
+        return (int): the size of the file, in bytes; taken from the
+            file itself when it is on the local filesystem, to avoid
+            asking the backend.
+
+        raise (KeyError): if the backend does not have the file.
+
+        """
+        try:
+            return os.fstat(fobj.fileno()).st_size
+        except (AttributeError, OSError):
+            return self.file_cacher.get_size(digest)
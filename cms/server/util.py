@@ -76,7 +76,7 @@ class FileHandlerMixin(RequestHandler):
 
     """
 
-    def fetch(self, digest, content_type, filename):
+    def fetch(self, digest, content_type, filename, immutable=False):
         """Serve the file with the given digest.
 
         This will just add the headers required to trigger
@@ -85,10 +85,15 @@ class FileHandlerMixin(RequestHandler):
         digest (str): the digest of the file that has to be served.
         content_type (str): the MIME type the file should be served as.
         filename (str): the name the file should be served as.
+        immutable (bool): whether the URL always gives this content
+            (e.g., because it contains the digest), so that clients
+            can cache it without checking again.
 
         """
         self.set_header(FileServerMiddleware.DIGEST_HEADER, digest)
         self.set_header(FileServerMiddleware.FILENAME_HEADER, filename)
+        if immutable:
+            self.set_header(FileServerMiddleware.IMMUTABLE_HEADER, "1")
         self.set_header("Content-Type", content_type)
         self.finish()
 
@@ -30,27 +30,34 @@ the current ranking.
 
 """
 
+import json
 import logging
+import os
+import tempfile
 from collections import defaultdict
 from datetime import timedelta
 from functools import wraps
 
+import gevent
 import gevent.lock
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 
-from cms import ServiceCoord, get_service_shards
-from cmscommon.datetime import make_timestamp
+from cms import ServiceCoord, config, get_service_shards, mkdir
+from cmscommon.datetime import make_datetime, make_timestamp
 from cms.db import SessionGen, Digest, Dataset, Evaluation, Submission, \
     SubmissionResult, Testcase, UserTest, UserTestResult, get_submissions, \
     get_submission_results, get_datasets_to_judge
-from cms.grading.Job import JobGroup
-from cms.io import Executor, TriggeredService, rpc_method
-from .esoperations import ESOperation, get_relevant_operations, \
-    get_submissions_operations, get_user_tests_operations, \
+from cms.grading.Job import EvaluationJob, JobGroup
+from cms.grading.scoring import invalidate_task_scores
+from cms.io import Executor, PriorityQueue, TriggeredService, rpc_method
+from .esoperations import ESOperation, find_reusable_evaluations, \
+    get_relevant_operations, get_submissions_operations, get_user_tests_operations, \
     submission_get_operations, submission_to_evaluate, \
     user_test_get_operations
 from .flushingdict import FlushingDict
+from .schedulingpolicy import DurationEstimator, get_scheduling_policy
 from .workerpool import WorkerPool
 
 
@@ -73,6 +80,15 @@ class EvaluationExecutor(Executor):
         self.evaluation_service = evaluation_service
         self.pool = WorkerPool(self.evaluation_service)
 
+        # The policy ordering the operations with the same priority.
+        self.policy = get_scheduling_policy(
+            config.scheduling_policy,
+            self.evaluation_service.get_participation_id)
+
+        # The estimates of the durations of the operations, to size
+        # the batches.
+        self.durations = DurationEstimator()
+
         # List of QueueItem (ESOperation) we have extracted from the
         # queue, but not yet finished to execute.
         self._currently_executing = []
@@ -80,6 +96,10 @@ class EvaluationExecutor(Executor):
         # Lock used to guard the currently executing operations
         self._current_execution_lock = gevent.lock.RLock()
 
+        # Incremented at each change of the operations to do, to know
+        # when a new snapshot of the queue is needed.
+        self.state_version = 0
+
         # As evaluate operations are split by testcases, there are too
         # many entries in the queue to display, so we just take only one
         # operation of each (type, object_id, dataset_id, priority) tuple.
@@ -109,7 +129,10 @@ class EvaluationExecutor(Executor):
         """Return the maximum number of operations per batch.
 
         We derive the number from the length of the queue divided by
-        the number of workers, with a cap at MAX_OPERATIONS_PER_BATCH.
+        the number of workers, with a cap at MAX_OPERATIONS_PER_BATCH,
+        so that the workers share the operations; if batches are sized
+        by their duration, a batch can also end earlier (see
+        batch_is_full).
 
         """
         # TODO: len(self.pool) is the total number of workers,
@@ -120,6 +143,49 @@ class EvaluationExecutor(Executor):
                     ratio, ret)
         return ret
 
+    def batch_is_full(self, entries):
+        """Return whether a batch should not grow any further.
+
+        If batch_target_time is set, the batch is full when the
+        estimated duration of its operations reaches it, so that
+        short operations share the overhead of a job group, while long
+        ones do not keep a worker busy for long.
+
+        entries ([QueueEntry]): the entries in the batch.
+
+        return (bool): True if no more entries should be added.
+
+        """
+        if config.batch_target_time <= 0:
+            return False
+        return sum(self.durations.estimate(entry.item)
+                   for entry in entries) >= config.batch_target_time
+
+    def jobs_done(self, jobs, busy_time):
+        """Take into account the jobs executed by a worker.
+
+        jobs ([Job]): the jobs of a job group returned by a worker.
+        busy_time (float|None): the seconds the worker took for the
+            whole job group, if known.
+
+        """
+        for job in jobs:
+            self.policy.operation_done(job.operation, job)
+
+        # The jobs whose duration was not reported get an equal share
+        # of the time the worker did not spend on the others.
+        durations = [DurationEstimator.get_duration(job) for job in jobs]
+        unknown = durations.count(None)
+        if unknown > 0 and busy_time is not None:
+            known = sum(duration for duration in durations
+                        if duration is not None)
+            share = max(busy_time - known, 0.0) / unknown
+            durations = [share if duration is None else duration
+                         for duration in durations]
+        for job, duration in zip(jobs, durations):
+            if duration is not None:
+                self.durations.add(job.operation, duration)
+
     def execute(self, entries):
         """Execute a batch of operations in the queue.
 
@@ -150,19 +216,14 @@ class EvaluationExecutor(Executor):
                     self._currently_executing = []
                     break
 
-    def enqueue(self, item, priority, timestamp):
-        success = super().enqueue(item, priority, timestamp)
+    def enqueue(self, item, priority, timestamp, rank=None):
+        if rank is None and item not in self._operation_queue:
+            rank = self.policy.rank(item, priority, timestamp)
+        success = super().enqueue(item, priority, timestamp, rank)
         if success:
-            # Add the item to the cumulative status dictionary.
-            key = item.short_key() + (priority,)
-            if key in self.queue_status_cumulative:
-                self.queue_status_cumulative[key]["item"]["multiplicity"] += 1
-            else:
-                item_entry = item.to_dict()
-                del item_entry["testcase_codename"]
-                item_entry["multiplicity"] = 1
-                entry = {"item": item_entry, "priority": priority, "timestamp": make_timestamp(timestamp)}
-                self.queue_status_cumulative[key] = entry
+            self.state_version += 1
+            self._add_to_cumulative_status(item, priority,
+                                           make_timestamp(timestamp))
         return success
 
     def dequeue(self, operation):
@@ -174,9 +235,11 @@ class EvaluationExecutor(Executor):
         operation (ESOperation)
 
         """
+        self.state_version += 1
         try:
             queue_entry = super().dequeue(operation)
-            self._remove_from_cumulative_status(queue_entry)
+            self._remove_from_cumulative_status(queue_entry.item,
+                                                queue_entry.priority)
         except KeyError:
             with self._current_execution_lock:
                 for i in range(len(self._currently_executing)):
@@ -185,14 +248,71 @@ class EvaluationExecutor(Executor):
                         return
             raise
 
+    def set_priority(self, item, priority):
+        """See Executor.set_priority."""
+        old_priority = super().set_priority(item, priority)
+        self.state_version += 1
+        timestamp = self.queue_status_cumulative[
+            item.short_key() + (old_priority,)]["timestamp"]
+        self._remove_from_cumulative_status(item, old_priority)
+        self._add_to_cumulative_status(item, priority, timestamp)
+        return old_priority
+
     def _pop(self, wait=False):
         queue_entry = super()._pop(wait=wait)
-        self._remove_from_cumulative_status(queue_entry)
+        self.state_version += 1
+        self._remove_from_cumulative_status(queue_entry.item,
+                                            queue_entry.priority)
+        self.policy.operation_extracted(queue_entry)
         return queue_entry
 
-    def _remove_from_cumulative_status(self, queue_entry):
+    def get_operations(self):
+        """Return all the operations to do or being done.
+
+        return ([(ESOperation, int, datetime)]): the operations in the
+            queue, extracted from it but not yet given to a worker,
+            and being executed by a worker, with their priority and
+            timestamp.
+
+        """
+        return [(ESOperation.from_dict(item), priority,
+                 make_datetime(timestamp))
+                for item, priority, timestamp in self.export_operations()]
+
+    def export_operations(self):
+        """Return all the operations to do or being done, exported.
+
+        return ([(dict, int, float)]): the operations (as returned by
+            get_operations) exported to dict, with the timestamps as
+            seconds since the epoch.
+
+        """
+        operations = [(entry["item"], entry["priority"], entry["timestamp"])
+                      for entry in self.get_status()]
+        with self._current_execution_lock:
+            executing = self._currently_executing + self.pool.get_operations()
+        for operation in executing:
+            priority, timestamp = operation.side_data
+            operations.append((operation.to_dict(), priority,
+                               make_timestamp(timestamp)))
+        return operations
+
+    def _add_to_cumulative_status(self, item, priority, timestamp):
+        # Add the item to the cumulative status dictionary.
+        key = item.short_key() + (priority,)
+        if key in self.queue_status_cumulative:
+            self.queue_status_cumulative[key]["item"]["multiplicity"] += 1
+        else:
+            item_entry = item.to_dict()
+            del item_entry["testcase_codename"]
+            item_entry["multiplicity"] = 1
+            entry = {"item": item_entry, "priority": priority,
+                     "timestamp": timestamp}
+            self.queue_status_cumulative[key] = entry
+
+    def _remove_from_cumulative_status(self, item, priority):
         # Remove the item from the cumulative status dictionary.
-        key = queue_entry.item.short_key() + (queue_entry.priority,)
+        key = item.short_key() + (priority,)
         self.queue_status_cumulative[key]["item"]["multiplicity"] -= 1
         if self.queue_status_cumulative[key]["item"]["multiplicity"] == 0:
             del self.queue_status_cumulative[key]
@@ -248,11 +368,19 @@ class EvaluationService(TriggeredService):
     # The maximum time since the last result before processing.
     MAX_FLUSHING_TIME_SECONDS = 2
 
+    # How often we write the snapshot of the queue, if configured.
+    QUEUE_SNAPSHOT_TIME = timedelta(seconds=5)
+
     def __init__(self, shard, contest_id=None):
         super().__init__(shard)
 
         self.contest_id = contest_id
 
+        # The participation of each submission and user test (indexed
+        # by whether it is a submission and by its id), used by the
+        # fair scheduling policies (and not loaded for the others).
+        self._participation_ids = dict()
+
         # Cache holding the results from the worker until they are
         # written to the DB.
         self.result_cache = FlushingDict(
@@ -283,10 +411,33 @@ class EvaluationService(TriggeredService):
         # operations in state 4.
         self.post_finish_lock = gevent.lock.RLock()
 
+        # The watermarks (largest ids of submissions, user tests and
+        # datasets) read in the last two sweeps, used by incremental
+        # sweeps; None until the first (full) sweep.
+        self._sweep_watermarks = None
+        self._full_sweep_requested = True
+        self._sweeps_since_full = 0
+
         self.scoring_service = self.connect_to(
             ServiceCoord("ScoringService", 0))
 
         self.add_executor(EvaluationExecutor(self))
+
+        # The operations restored from the snapshot of the queue, not
+        # yet checked against the database by a full sweep.
+        self._restored_operations = set()
+        self._snapshot_path = os.path.join(
+            config.data_dir, "evaluation-queue-%d.json" % self.shard)
+        self._snapshot_version = None
+        self._snapshot_writer = None
+        if config.persist_queue:
+            mkdir(config.data_dir)
+            self._restore_queue()
+            self.add_timeout(self._snapshot_queue, None,
+                             EvaluationService.QUEUE_SNAPSHOT_TIME
+                             .total_seconds(),
+                             immediately=False)
+
         self.start_sweeper(117.0)
 
         self.add_timeout(self.check_workers_timeout, None,
@@ -306,14 +457,26 @@ class EvaluationService(TriggeredService):
         return (int): the number of actually enqueued operations.
 
         """
+        if self.get_executor().policy.uses_flows:
+            self._participation_ids[(True, submission.id)] = \
+                submission.participation_id
+        datasets_and_operations = [
+            (dataset, list(submission_get_operations(
+                submission.get_result(dataset), submission, dataset)))
+            for dataset in get_datasets_to_judge(submission.task)]
+        reused = self._reuse_evaluations(
+            submission.sa_session,
+            [operation for _, operations in datasets_and_operations
+             for operation, _, _ in operations])
+
         new_operations = 0
-        for dataset in get_datasets_to_judge(submission.task):
+        for dataset, operations in datasets_and_operations:
             submission_result = submission.get_result(dataset)
             number_of_operations = 0
-            for operation, priority, timestamp in submission_get_operations(
-                    submission_result, submission, dataset):
+            for operation, priority, timestamp in operations:
                 number_of_operations += 1
-                if self.enqueue(operation, priority, timestamp):
+                if operation in reused \
+                        or self.enqueue(operation, priority, timestamp):
                     new_operations += 1
 
             # If we got 0 operations, but the submission result is to
@@ -337,6 +500,9 @@ class EvaluationService(TriggeredService):
         return (int): the number of actually enqueued operations.
 
         """
+        if self.get_executor().policy.uses_flows:
+            self._participation_ids[(False, user_test.id)] = \
+                user_test.participation_id
         new_operations = 0
         for dataset in get_datasets_to_judge(user_test.task):
             for operation, priority, timestamp in user_test_get_operations(
@@ -352,22 +518,225 @@ class EvaluationService(TriggeredService):
         evaluated for no good reasons. Put the missing operation in
         the queue.
 
+        A full sweep looks at the whole contest. Since the operations
+        for the existing objects are enqueued as soon as they are
+        needed (new results, invalidations, retries), the other
+        sweeps are incremental: they only look at the submissions,
+        user tests and datasets created since the sweep before the
+        previous one (so that objects committed late, with ids lower
+        than a watermark, are not missed). Full sweeps are done at
+        startup, on request, and every config.full_sweep_every
+        sweeps.
+
         """
+        full = self._sweep_watermarks is None \
+            or self._full_sweep_requested \
+            or self._sweeps_since_full + 1 >= config.full_sweep_every
+        self._full_sweep_requested = False
+
         counter = 0
         with SessionGen() as session:
-
-            for operation, priority, timestamp in \
-                    get_submissions_operations(session, self.contest_id):
-                if self.enqueue(operation, priority, timestamp):
+            # Read the watermark before looking for the operations,
+            # so that the objects created in the meantime are checked
+            # again by the next sweep.
+            watermark = (
+                session.query(func.max(Submission.id)).scalar() or 0,
+                session.query(func.max(UserTest.id)).scalar() or 0,
+                session.query(func.max(Dataset.id)).scalar() or 0)
+            if full:
+                submissions_watermark = user_tests_watermark = None
+            else:
+                old_watermark = self._sweep_watermarks[0]
+                submissions_watermark = (old_watermark[0], old_watermark[2])
+                user_tests_watermark = (old_watermark[1], old_watermark[2])
+
+            operations = get_submissions_operations(
+                session, self.contest_id, watermark=submissions_watermark)
+            operations += get_user_tests_operations(
+                session, self.contest_id, watermark=user_tests_watermark)
+            self._load_participation_ids(
+                session, [operation for operation, _, _ in operations])
+            reused = self._reuse_evaluations(
+                session, [operation for operation, _, _ in operations])
+
+            for operation, priority, timestamp in operations:
+                if operation in reused \
+                        or self.enqueue(operation, priority, timestamp):
                     counter += 1
 
-            for operation, priority, timestamp in \
-                    get_user_tests_operations(session, self.contest_id):
-                if self.enqueue(operation, priority, timestamp):
-                    counter += 1
+        if full and len(self._restored_operations) > 0:
+            self._drop_stale_restored_operations(
+                set(operation for operation, _, _ in operations))
+
+        if full:
+            logger.info("Full sweep done.")
+            self._sweeps_since_full = 0
+            self._sweep_watermarks = (watermark, watermark)
+        else:
+            self._sweeps_since_full += 1
+            self._sweep_watermarks = (self._sweep_watermarks[1], watermark)
 
         return counter
 
+    def _snapshot_queue(self):
+        """Write the operations to do to the snapshot file, if they
+        changed since the last snapshot.
+
+        The file is written in a thread, so that the encoding of a
+        long queue does not block the service; a new snapshot is not
+        started while the previous one is being written.
+
+        return (bool): True, to be called again.
+
+        """
+        executor = self.get_executor()
+        if executor.state_version == self._snapshot_version \
+                or (self._snapshot_writer is not None
+                    and not self._snapshot_writer.ready()):
+            return True
+        self._snapshot_version = executor.state_version
+        data = {
+            "contest_id": self.contest_id,
+            "operations": executor.export_operations(),
+        }
+        self._snapshot_writer = gevent.get_hub().threadpool.spawn(
+            self._write_snapshot, data)
+        return True
+
+    def _write_snapshot(self, data):
+        """Write a snapshot of the queue.
+
+        The file is replaced atomically, so that a crash cannot leave
+        a partial snapshot.
+
+        data (dict): the content of the snapshot.
+
+        """
+        try:
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self._snapshot_path),
+                prefix=".evaluation-queue")
+        except OSError:
+            logger.warning("Cannot write the snapshot of the queue.",
+                           exc_info=True)
+            return
+        try:
+            with open(fd, "wt", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.rename(temp_path, self._snapshot_path)
+        except OSError:
+            logger.warning("Cannot write the snapshot of the queue.",
+                           exc_info=True)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _restore_queue(self):
+        """Enqueue the operations in the snapshot file, if any.
+
+        This includes the operations that were being executed by the
+        workers, whose results were lost. Since the snapshot might be
+        outdated, the operations are checked by the first full sweep,
+        which drops the ones that are not needed anymore.
+
+        """
+        try:
+            with open(self._snapshot_path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logger.warning("Cannot read the snapshot of the queue.",
+                           exc_info=True)
+            return
+        if data["contest_id"] != self.contest_id:
+            logger.info("Ignoring the snapshot of the queue for contest "
+                        "%s.", data["contest_id"])
+            return
+
+        operations = [(ESOperation.from_dict(operation), priority,
+                       make_datetime(timestamp))
+                      for operation, priority, timestamp
+                      in data["operations"]]
+        with SessionGen() as session:
+            self._load_participation_ids(
+                session, [operation for operation, _, _ in operations])
+        # The operations are put directly in the queue, as checking
+        # them (see enqueue) requires the database.
+        for operation, priority, timestamp in operations:
+            if self.get_executor().enqueue(operation, priority, timestamp):
+                self._restored_operations.add(operation)
+        logger.info("Restored %d operations from the snapshot of the "
+                    "queue.", len(self._restored_operations))
+
+    def _drop_stale_restored_operations(self, needed_operations):
+        """Remove from the queue the restored operations that are not
+        needed anymore.
+
+        needed_operations ({ESOperation}): the operations that a full
+        sweep found to be needed.
+
+        """
+        dropped = 0
+        for operation in self._restored_operations - needed_operations:
+            try:
+                self.dequeue(operation)
+            except KeyError:
+                # Already executed.
+                pass
+            else:
+                dropped += 1
+        self._restored_operations = set()
+        logger.info("Dropped %d restored operations not needed anymore.",
+                    dropped)
+
+    def _load_participation_ids(self, session, operations):
+        """Load the participations of the objects of some operations.
+
+        session (Session): the database session to use.
+        operations ([ESOperation]): the operations.
+
+        """
+        if not self.get_executor().policy.uses_flows:
+            return
+        for for_submission, cls in ((True, Submission), (False, UserTest)):
+            ids = set(operation.object_id for operation in operations
+                      if operation.for_submission() == for_submission
+                      and (for_submission, operation.object_id)
+                      not in self._participation_ids)
+            if len(ids) == 0:
+                continue
+            for object_id, participation_id in session.query(cls)\
+                    .filter(cls.id.in_(ids))\
+                    .with_entities(cls.id, cls.participation_id)\
+                    .all():
+                self._participation_ids[(for_submission, object_id)] = \
+                    participation_id
+
+    def get_participation_id(self, operation):
+        """Return the participation of the object of an operation.
+
+        operation (ESOperation): the operation.
+
+        return (int|None): the id of the participation of the
+            submission or user test, or None if it does not exist.
+
+        """
+        key = (operation.for_submission(), operation.object_id)
+        if key not in self._participation_ids:
+            with SessionGen() as session:
+                self._load_participation_ids(session, [operation])
+        return self._participation_ids.get(key)
+
+    @rpc_method
+    def search_operations_not_done(self):
+        """Make the sweeper loop fire a full sweep as soon as possible.
+
+        """
+        self._full_sweep_requested = True
+        super().search_operations_not_done()
+
     @rpc_method
     def workers_status(self):
         """Returns a dictionary (indexed by shard number) whose values
@@ -425,6 +794,53 @@ class EvaluationService(TriggeredService):
         # enqueue() returns the number of successful pushes.
         return super().enqueue(operation, priority, timestamp) > 0
 
+    @with_post_finish_lock
+    def _reuse_evaluations(self, session, operations):
+        """Copy the results of some evaluation operations from existing
+        evaluations, where possible.
+
+        The copied results go through the same path as the results
+        received from the workers. This is done in bulk for all the
+        operations found for a submission or by a sweep, instead of
+        once for each operation.
+
+        session (Session): the database session to use.
+        operations ([ESOperation]): the operations about to be
+            enqueued; only the EVALUATION ones not already being
+            handled are considered.
+
+        return ({ESOperation}): the operations whose result was copied,
+            that must not be executed.
+
+        """
+        operations = [operation for operation in operations
+                      if operation.type_ == ESOperation.EVALUATION
+                      and operation not in self.get_executor()
+                      and operation not in self.result_cache]
+        reused = set()
+        for operation, evaluation in find_reusable_evaluations(
+                session, operations).items():
+            logger.info("Reusing the result of `%s' from dataset %d.",
+                        operation, evaluation.dataset_id)
+            sandboxes = evaluation.evaluation_sandbox.split(":") \
+                if evaluation.evaluation_sandbox else []
+            job = EvaluationJob(
+                operation=operation,
+                shard=evaluation.evaluation_shard,
+                sandboxes=sandboxes,
+                success=True,
+                outcome=evaluation.outcome,
+                text=evaluation.text,
+                plus={
+                    "execution_time": evaluation.execution_time,
+                    "execution_wall_clock_time":
+                        evaluation.execution_wall_clock_time,
+                    "execution_memory": evaluation.execution_memory,
+                })
+            self.result_cache.add(operation, Result(job, True))
+            reused.add(operation)
+        return reused
+
     @with_post_finish_lock
     def action_finished(self, data, shard, error=None):
         """Callback from a worker, to signal that is finished some
@@ -442,7 +858,9 @@ class EvaluationService(TriggeredService):
         # this method and do nothing because in that case we know the
         # operation has returned to the queue and perhaps already been
         # reassigned to another worker.
+        busy_time = self.get_executor().pool.get_busy_time(shard)
         to_ignore = self.get_executor().pool.release_worker(shard)
+        self.get_executor().state_version += 1
         if to_ignore is True:
             logger.info("Ignored result from worker %s as requested.", shard)
             return
@@ -463,6 +881,7 @@ class EvaluationService(TriggeredService):
                 job_group_success = False
 
         if job_group_success:
+            self.get_executor().jobs_done(job_group.jobs, busy_time)
             for job in job_group.jobs:
                 operation = job.operation
                 if job.success:
@@ -501,8 +920,16 @@ class EvaluationService(TriggeredService):
             by_object_and_type[t].append((operation, result))
 
         with SessionGen() as session:
+            written = self.write_evaluations_in_bulk(session, items)
+
             for key, operation_results in by_object_and_type.items():
                 type_, object_id, dataset_id = key
+                operation_results = [
+                    (operation, result)
+                    for operation, result in operation_results
+                    if operation not in written]
+                if len(operation_results) == 0:
+                    continue
 
                 dataset = Dataset.get_from_id(dataset_id, session)
                 if dataset is None:
@@ -532,48 +959,234 @@ class EvaluationService(TriggeredService):
             logger.info("Committing evaluations...")
             session.commit()
 
-            num_testcases_per_dataset = dict()
-            for type_, object_id, dataset_id in by_object_and_type.keys():
-                if type_ == ESOperation.EVALUATION:
-                    if dataset_id not in num_testcases_per_dataset:
-                        num_testcases_per_dataset[dataset_id] = session\
-                            .query(func.count(Testcase.id))\
-                            .filter(Testcase.dataset_id == dataset_id).scalar()
-                    num_evaluations = session\
-                        .query(func.count(Evaluation.id)) \
-                        .filter(Evaluation.dataset_id == dataset_id) \
-                        .filter(Evaluation.submission_id == object_id).scalar()
-                    if num_evaluations == num_testcases_per_dataset[dataset_id]:
-                        submission_result = SubmissionResult.get_from_id(
-                            (object_id, dataset_id), session)
-                        submission_result.set_evaluation_outcome()
+            # Count the testcases and the evaluations of all the
+            # submission results at once; to postpone the irrelevant
+            # evaluations, the outcomes are needed too.
+            evaluated_results = [
+                (object_id, dataset_id)
+                for type_, object_id, dataset_id in by_object_and_type.keys()
+                if type_ == ESOperation.EVALUATION]
+            if len(evaluated_results) > 0:
+                num_testcases_per_dataset = dict(
+                    session.query(Testcase.dataset_id, func.count(Testcase.id))
+                    .filter(Testcase.dataset_id.in_(
+                        set(dataset_id for _, dataset_id in evaluated_results)))
+                    .group_by(Testcase.dataset_id)
+                    .all())
+                if config.postpone_irrelevant_evaluations:
+                    outcomes_per_result = defaultdict(dict)
+                    for submission_id, dataset_id, codename, outcome \
+                            in session.query(
+                                Evaluation.submission_id,
+                                Evaluation.dataset_id,
+                                Testcase.codename, Evaluation.outcome)\
+                            .join(Testcase,
+                                  Evaluation.testcase_id == Testcase.id)\
+                            .filter(tuple_(Evaluation.submission_id,
+                                           Evaluation.dataset_id)
+                                    .in_(evaluated_results))\
+                            .all():
+                        outcomes_per_result[(submission_id, dataset_id)][
+                            codename] = float(outcome)
+                    num_evaluations_per_result = dict(
+                        (key, len(outcomes))
+                        for key, outcomes in outcomes_per_result.items())
+                else:
+                    num_evaluations_per_result = dict(
+                        ((submission_id, dataset_id), count)
+                        for submission_id, dataset_id, count in session.query(
+                            Evaluation.submission_id, Evaluation.dataset_id,
+                            func.count(Evaluation.id))
+                        .filter(tuple_(Evaluation.submission_id,
+                                       Evaluation.dataset_id)
+                                .in_(evaluated_results))
+                        .group_by(Evaluation.submission_id,
+                                  Evaluation.dataset_id)
+                        .all())
+                score_types = dict()
+                for object_id, dataset_id in evaluated_results:
+                    missing = num_testcases_per_dataset.get(dataset_id, 0) \
+                        - num_evaluations_per_result.get(
+                            (object_id, dataset_id), 0)
+                    if missing > 0 \
+                            and not config.postpone_irrelevant_evaluations:
+                        continue
+                    submission_result = SubmissionResult.get_from_id(
+                        (object_id, dataset_id), session)
+                    if submission_result.evaluated():
+                        # These are postponed evaluations, that cannot
+                        # change the score but are needed for the
+                        # feedback: once all done, score it again.
+                        if missing == 0 and submission_result.scored():
+                            submission_result.invalidate_score()
+                        continue
+                    if missing > 0:
+                        if dataset_id not in score_types:
+                            score_types[dataset_id] = self._get_score_type(
+                                submission_result.dataset)
+                        if score_types[dataset_id] is None \
+                                or not self.postpone_irrelevant_evaluations(
+                                    submission_result,
+                                    score_types[dataset_id],
+                                    outcomes_per_result[
+                                        (object_id, dataset_id)],
+                                    missing):
+                            continue
+                    submission_result.set_evaluation_outcome()
 
             logger.info("Committing evaluation outcomes...")
             session.commit()
 
             logger.info("Ending operations for %s objects...",
                         len(by_object_and_type))
-            for type_, object_id, dataset_id in by_object_and_type.keys():
-                if type_ == ESOperation.COMPILATION:
-                    submission_result = SubmissionResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    self.compilation_ended(submission_result)
-                elif type_ == ESOperation.EVALUATION:
-                    submission_result = SubmissionResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    if submission_result.evaluated():
-                        self.evaluation_ended(submission_result)
-                elif type_ == ESOperation.USER_TEST_COMPILATION:
-                    user_test_result = UserTestResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    self.user_test_compilation_ended(user_test_result)
-                elif type_ == ESOperation.USER_TEST_EVALUATION:
-                    user_test_result = UserTestResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    self.user_test_evaluation_ended(user_test_result)
+            # Notify ScoringService of all the results at once.
+            with self.scoring_service.batch():
+                for type_, object_id, dataset_id in by_object_and_type:
+                    if type_ == ESOperation.COMPILATION:
+                        submission_result = SubmissionResult.get_from_id(
+                            (object_id, dataset_id), session)
+                        self.compilation_ended(submission_result)
+                    elif type_ == ESOperation.EVALUATION:
+                        submission_result = SubmissionResult.get_from_id(
+                            (object_id, dataset_id), session)
+                        if submission_result.evaluated():
+                            self.evaluation_ended(submission_result)
+                    elif type_ == ESOperation.USER_TEST_COMPILATION:
+                        user_test_result = UserTestResult.get_from_id(
+                            (object_id, dataset_id), session)
+                        self.user_test_compilation_ended(user_test_result)
+                    elif type_ == ESOperation.USER_TEST_EVALUATION:
+                        user_test_result = UserTestResult.get_from_id(
+                            (object_id, dataset_id), session)
+                        self.user_test_evaluation_ended(user_test_result)
 
         logger.info("Done")
 
+    def write_evaluations_in_bulk(self, session, items):
+        """Insert the successful evaluations with a single statement.
+
+        Evaluations already present in the database are skipped. If
+        the statement fails (e.g., because a submission result does
+        not exist yet), nothing is written and all the results must be
+        written one by one.
+
+        session (Session): the DB session to use.
+        items ([(ESOperation, Result)]): the results received by ES.
+
+        return ({ESOperation}): the operations whose results were
+            written.
+
+        """
+        to_write = [(operation, result) for operation, result in items
+                    if operation.type_ == ESOperation.EVALUATION
+                    and result.job_success]
+        if len(to_write) == 0:
+            return set()
+
+        testcase_ids = dict(
+            ((dataset_id, codename), testcase_id)
+            for testcase_id, dataset_id, codename in session.query(
+                Testcase.id, Testcase.dataset_id, Testcase.codename)
+            .filter(Testcase.dataset_id.in_(
+                set(operation.dataset_id for operation, _ in to_write)))
+            .all())
+
+        rows = []
+        for operation, result in to_write:
+            testcase_id = testcase_ids.get(
+                (operation.dataset_id, operation.testcase_codename))
+            if testcase_id is None:
+                return set()
+            row = result.job.get_evaluation_values()
+            row.update(submission_id=operation.object_id,
+                       dataset_id=operation.dataset_id,
+                       testcase_id=testcase_id)
+            rows.append(row)
+
+        try:
+            with session.begin_nested():
+                inserted = session.execute(
+                    insert(Evaluation.__table__).values(rows)
+                    .on_conflict_do_nothing(index_elements=[
+                        Evaluation.submission_id, Evaluation.dataset_id,
+                        Evaluation.testcase_id]))
+        except Exception:
+            logger.warning("Cannot write the evaluations in bulk, writing "
+                           "them one by one.", exc_info=True)
+            return set()
+
+        logger.info("Wrote %d evaluations in bulk (%d already present).",
+                    inserted.rowcount, len(rows) - inserted.rowcount)
+        return set(operation for operation, _ in to_write)
+
+    @staticmethod
+    def _get_score_type(dataset):
+        """Return the score type of a dataset, logging the errors.
+
+        dataset (Dataset): a dataset.
+
+        return (ScoreType|None): the score type object of the dataset,
+            or None if it cannot be loaded.
+
+        """
+        try:
+            return dataset.score_type_object
+        except Exception:
+            logger.warning("Cannot load score type for dataset %d.",
+                           dataset.id, exc_info=True)
+            return None
+
+    def postpone_irrelevant_evaluations(self, submission_result, score_type,
+                                        outcomes, missing):
+        """Postpone the evaluations of a submission that cannot change
+        its score.
+
+        For example, with GroupMin a testcase of a subtask with an
+        already failed testcase does not matter for the score. These
+        evaluations are moved to the lowest priority: they are still
+        executed, to provide the full feedback, but when all the
+        missing evaluations are of this kind the submission result can
+        be scored already.
+
+        submission_result (SubmissionResult): a submission result
+            being evaluated.
+        score_type (ScoreType): the score type of its dataset.
+        outcomes ({str: float}): the outcomes of the testcases
+            evaluated so far, indexed by codename.
+        missing (int): the number of testcases not evaluated yet.
+
+        return (bool): whether all the missing evaluations cannot
+            change the score.
+
+        """
+        irrelevant = score_type.irrelevant_testcases(outcomes)
+        postponed = 0
+        for codename in irrelevant:
+            operation = ESOperation(ESOperation.EVALUATION,
+                                    submission_result.submission_id,
+                                    submission_result.dataset_id,
+                                    codename)
+            try:
+                old_priority = self.get_executor().set_priority(
+                    operation, PriorityQueue.PRIORITY_EXTRA_LOW)
+            except LookupError:
+                # Not queued, e.g., already being executed.
+                continue
+            if old_priority != PriorityQueue.PRIORITY_EXTRA_LOW:
+                postponed += 1
+        if postponed > 0:
+            logger.info("Postponed %d evaluations of submission %d(%d) "
+                        "that cannot change its score.", postponed,
+                        submission_result.submission_id,
+                        submission_result.dataset_id)
+        if len(irrelevant) == missing:
+            logger.info("Submission %d(%d) can be scored without the "
+                        "evaluations of %d testcases.",
+                        submission_result.submission_id,
+                        submission_result.dataset_id, missing)
+            return True
+        return False
+
     def write_results_one_object_and_type(
             self, session, object_result, operation_results):
         """Write to the DB the results for one object and type.
@@ -959,6 +1572,7 @@ class EvaluationService(TriggeredService):
                 submission_id, dataset_id).all()
             logger.info("Submission results to invalidate %s for: %d.",
                         level, len(submission_results))
+            invalidated = []
             for submission_result in submission_results:
                 # We invalidate the appropriate data and queue the
                 # operations to recompute those data.
@@ -966,6 +1580,12 @@ class EvaluationService(TriggeredService):
                     submission_result.invalidate_compilation()
                 elif level == "evaluation":
                     submission_result.invalidate_evaluation()
+                submission = submission_result.submission
+                if submission_result.dataset_id \
+                        == submission.task.active_dataset_id:
+                    invalidated.append((submission.participation_id,
+                                        submission.task_id))
+            invalidate_task_scores(session, invalidated)
 
             # Finally, we re-enqueue the operations for the
             # submissions.
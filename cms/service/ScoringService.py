@@ -27,89 +27,299 @@
 
 import logging
 
-from cms import ServiceCoord, config
-from cms.db import SessionGen, Submission, Dataset, get_submission_results
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from cms import ServiceCoord, config, get_service_shards
+from cms.db import SessionGen, Submission, Dataset, Evaluation, \
+    SubmissionResult, Testcase, get_submission_results
+from cms.grading.scoretypes import SubmissionResultColumns, \
+    get_score_type_class
+from cms.grading.scoring import update_task_scores, invalidate_task_scores
 from cms.io import Executor, TriggeredService, rpc_method
 from cmscommon.datetime import make_datetime
 from .scoringoperations import ScoringOperation, get_operations
+from .scoringpool import ScoringPool
 
 
 logger = logging.getLogger(__name__)
 
 
 class ScoringExecutor(Executor):
-    def __init__(self, proxy_service):
-        super().__init__()
+
+    # Maximum number of operations scored together.
+    MAX_OPERATIONS_PER_BATCH = 200
+
+    def __init__(self, proxy_service, contest_web_servers):
+        super().__init__(batch_executions=True)
         self.proxy_service = proxy_service
+        self.contest_web_servers = contest_web_servers
+
+        # The processes computing the scores, if any.
+        self.pool = None
+        if config.scoring_processes > 0:
+            self.pool = ScoringPool(config.scoring_processes)
+
+    def max_operations_per_batch(self):
+        """See Executor.max_operations_per_batch."""
+        return ScoringExecutor.MAX_OPERATIONS_PER_BATCH
 
-    def execute(self, entry):
-        """Assign a score to a submission result.
+    def execute(self, entries):
+        """Assign a score to some submission results.
 
-        This is the core of ScoringService: here we retrieve the result
-        from the database, check if it is in the correct status,
-        instantiate its ScoreType, compute its score, store it back in
-        the database and tell ProxyService to update RWS if needed.
+        This is the core of ScoringService: here we retrieve the
+        results from the database, check if they are in the correct
+        status, instantiate their ScoreTypes, compute their scores,
+        store them back in the database and tell ProxyService to
+        update RWS if needed.
 
-        entry (QueueEntry): entry containing the operation to perform.
+        All the results are loaded with a single query, and their
+        evaluations with another one, as columns (see
+        SubmissionResultColumns) rather than ORM objects, for the score
+        types that accept them; the scores are stored with a single
+        commit and computed by the pool of processes, if configured.
+
+        entries ([QueueEntry]): entries containing the operations to
+            perform.
 
         """
-        operation = entry.item
+        operations = [entry.item for entry in entries]
         with SessionGen() as session:
-            # Obtain submission.
-            submission = Submission.get_from_id(operation.submission_id,
-                                                session)
-            if submission is None:
+            submission_results = self._load_submission_results(
+                session, operations)
+
+            to_score = []
+            for operation in operations:
+                submission_result = submission_results.get(
+                    (operation.submission_id, operation.dataset_id))
+                try:
+                    if self._check_submission_result(
+                            session, operation, submission_result):
+                        to_score.append(submission_result)
+                except ValueError as error:
+                    logger.error("Error scoring `%s': %s", operation, error)
+
+            columns = self._load_columns(
+                session, [submission_result for submission_result in to_score
+                          if self._uses_columns(submission_result)])
+            scored = []
+            for submission_result, score in zip(
+                    to_score, self._compute_scores(to_score, columns)):
+                if score is None:
+                    continue
+                submission_result.score, \
+                    submission_result.score_details, \
+                    submission_result.public_score, \
+                    submission_result.public_score_details, \
+                    submission_result.ranking_score_details = score
+                scored.append(submission_result)
+
+            # If dataset is the active one, update the scores of the
+            # participation on the task (in the same transaction), RWS
+            # and tell the contestant.
+            active_submissions = [
+                submission_result.submission
+                for submission_result in scored
+                if submission_result.dataset
+                is submission_result.submission.task.active_dataset]
+            update_task_scores(session, [
+                (submission.participation_id, submission.task_id)
+                for submission in active_submissions])
+
+            # Store them (the commit expires the objects).
+            timestamps = dict((submission.id, submission.timestamp)
+                              for submission in active_submissions)
+            notifications = [{"contest_id": submission.task.contest_id,
+                              "participation_id": submission.participation_id,
+                              "task_id": submission.task_id}
+                             for submission in active_submissions]
+            session.commit()
+
+            with self.proxy_service.batch():
+                for submission_id, timestamp in timestamps.items():
+                    logger.info(
+                        "Submission scored %.1f seconds after submission",
+                        (make_datetime() - timestamp).total_seconds())
+                    self.proxy_service.submission_scored(
+                        submission_id=submission_id)
+            if len(notifications) > 0:
+                for contest_web_server in self.contest_web_servers:
+                    contest_web_server.submissions_scored(
+                        submissions=notifications)
+
+    @staticmethod
+    def _load_submission_results(session, operations):
+        """Load the submission results of some operations.
+
+        session (Session): the database session.
+        operations ([ScoringOperation]): the operations.
+
+        return ({(int, int): SubmissionResult}): the submission
+            results that exist, by submission and dataset id, with
+            their submissions and datasets.
+
+        """
+        keys = set((operation.submission_id, operation.dataset_id)
+                   for operation in operations)
+        submission_results = session.query(SubmissionResult)\
+            .filter(tuple_(SubmissionResult.submission_id,
+                           SubmissionResult.dataset_id).in_(keys))\
+            .options(joinedload(SubmissionResult.submission)
+                     .joinedload(Submission.task))\
+            .options(joinedload(SubmissionResult.dataset))\
+            .all()
+        return dict(((submission_result.submission_id,
+                      submission_result.dataset_id), submission_result)
+                    for submission_result in submission_results)
+
+    @staticmethod
+    def _load_columns(session, submission_results):
+        """Load the evaluations of some submission results.
+
+        session (Session): the database session.
+        submission_results ([SubmissionResult]): the results.
+
+        return ({(int, int): SubmissionResultColumns}): the view of
+            each result, by submission and dataset id.
+
+        """
+        columns = dict(((submission_result.submission_id,
+                         submission_result.dataset_id),
+                        SubmissionResultColumns(
+                            submission_result.submission_id,
+                            submission_result.dataset_id,
+                            submission_result.evaluated()))
+                       for submission_result in submission_results)
+        if len(columns) > 0:
+            rows = session.query(Evaluation.submission_id,
+                                 Evaluation.dataset_id,
+                                 Testcase.codename,
+                                 Evaluation.outcome,
+                                 Evaluation.text,
+                                 Evaluation.execution_time,
+                                 Evaluation.execution_memory)\
+                .join(Evaluation.testcase)\
+                .filter(tuple_(Evaluation.submission_id,
+                               Evaluation.dataset_id)
+                        .in_(list(columns.keys())))
+            for submission_id, dataset_id, *values in rows:
+                columns[(submission_id, dataset_id)].append(*values)
+        return columns
+
+    @staticmethod
+    def _uses_columns(submission_result):
+        """Return whether the score type of a result accepts its view.
+
+        submission_result (SubmissionResult): the result.
+
+        return (bool): whether its score can be computed from a
+            SubmissionResultColumns (see ScoreType.USES_COLUMNS); False
+            also if the score type does not exist (the error is
+            reported when computing the score).
+
+        """
+        try:
+            return get_score_type_class(
+                submission_result.dataset.score_type).USES_COLUMNS
+        except KeyError:
+            return False
+
+    @staticmethod
+    def _check_submission_result(session, operation, submission_result):
+        """Check that a submission result can be scored.
+
+        session (Session): the database session.
+        operation (ScoringOperation): the operation.
+        submission_result (SubmissionResult|None): the result of the
+            operation, if it exists.
+
+        return (bool): True if the result is to be scored, False if
+            it is already scored.
+
+        raise (ValueError): if the result, its submission or its
+            dataset do not exist, or the result cannot be scored.
+
+        """
+        if submission_result is None:
+            # Find out what is missing.
+            if Submission.get_from_id(operation.submission_id,
+                                      session) is None:
                 raise ValueError("Submission %d not found in the database." %
                                  operation.submission_id)
-
-            # Obtain dataset.
-            dataset = Dataset.get_from_id(operation.dataset_id, session)
-            if dataset is None:
+            if Dataset.get_from_id(operation.dataset_id, session) is None:
                 raise ValueError("Dataset %d not found in the database." %
                                  operation.dataset_id)
-
-            # Obtain submission result.
-            submission_result = submission.get_result(dataset)
-
             # It means it was not even compiled (for some reason).
-            if submission_result is None:
-                raise ValueError("Submission result %d(%d) was not found." %
+            raise ValueError("Submission result %d(%d) was not found." %
+                             (operation.submission_id,
+                              operation.dataset_id))
+
+        # Check if it's ready to be scored.
+        if not submission_result.needs_scoring():
+            if submission_result.scored():
+                logger.info("Submission result %d(%d) is already scored.",
+                            operation.submission_id, operation.dataset_id)
+                return False
+            else:
+                raise ValueError("The state of the submission result "
+                                 "%d(%d) doesn't allow scoring." %
                                  (operation.submission_id,
                                   operation.dataset_id))
+        return True
 
-            # Check if it's ready to be scored.
-            if not submission_result.needs_scoring():
-                if submission_result.scored():
-                    logger.info("Submission result %d(%d) is already scored.",
-                                operation.submission_id, operation.dataset_id)
-                    return
-                else:
-                    raise ValueError("The state of the submission result "
-                                     "%d(%d) doesn't allow scoring." %
-                                     (operation.submission_id,
-                                      operation.dataset_id))
-
-            # Instantiate the score type.
-            score_type = dataset.score_type_object
-
-            # Compute score and fill it in the database.
-            submission_result.score, \
-                submission_result.score_details, \
-                submission_result.public_score, \
-                submission_result.public_score_details, \
-                submission_result.ranking_score_details = \
-                score_type.compute_score(submission_result)
-
-            # Store it.
-            session.commit()
+    def _compute_scores(self, submission_results, columns):
+        """Compute the scores of some submission results.
+
+        submission_results ([SubmissionResult]): the results.
+        columns ({(int, int): SubmissionResultColumns}): the views of
+            the results whose score types use them, by submission and
+            dataset id; only these results are scored by the pool of
+            processes, the score types of the others get the
+            SubmissionResult.
 
-            # If dataset is the active one, update RWS.
-            if dataset is submission.task.active_dataset:
-                logger.info(
-                    "Submission scored %.1f seconds after submission",
-                    (make_datetime() - submission.timestamp).total_seconds())
-                self.proxy_service.submission_scored(
-                    submission_id=submission.id)
+        return ([tuple|None]): for each result, the values returned by
+            the compute_score method of its ScoreType, or None if it
+            failed.
+
+        """
+        views = [columns.get((submission_result.submission_id,
+                              submission_result.dataset_id),
+                             submission_result)
+                 for submission_result in submission_results]
+        scores = [None] * len(submission_results)
+        if self.pool is not None:
+            specs = dict()
+            positions = []
+            for i, submission_result in enumerate(submission_results):
+                if views[i] is submission_result:
+                    continue
+                positions.append(i)
+                dataset = submission_result.dataset
+                if dataset.id not in specs:
+                    specs[dataset.id] = (
+                        dataset.score_type, dataset.score_type_parameters,
+                        dict((codename, testcase.public)
+                             for codename, testcase
+                             in dataset.testcases.items()))
+            for i, score in zip(positions, self.pool.compute_scores([
+                    (specs[submission_results[i].dataset_id], views[i])
+                    for i in positions])):
+                scores[i] = score
+
+        # The scores the processes could not (or cannot) compute are
+        # computed here, where the errors are reported.
+        for i, submission_result in enumerate(submission_results):
+            if scores[i] is not None:
+                continue
+            try:
+                scores[i] = submission_result.dataset.score_type_object\
+                    .compute_score(views[i])
+            except Exception:
+                logger.error("Error computing the score of submission "
+                             "result %d(%d).",
+                             submission_result.submission_id,
+                             submission_result.dataset_id, exc_info=True)
+        return scores
 
 
 class ScoringService(TriggeredService):
@@ -137,7 +347,15 @@ class ScoringService(TriggeredService):
             ServiceCoord("ProxyService", 0),
             must_be_present=ranking_enabled)
 
-        self.add_executor(ScoringExecutor(self.proxy_service))
+        # Set up communication with the contest web servers, to
+        # notify the contestants.
+        self.contest_web_servers = []
+        for i in range(get_service_shards("ContestWebServer")):
+            self.contest_web_servers.append(self.connect_to(
+                ServiceCoord("ContestWebServer", i)))
+
+        self.add_executor(ScoringExecutor(self.proxy_service,
+                                          self.contest_web_servers))
         self.start_sweeper(347.0)
 
     def _missing_operations(self):
@@ -209,15 +427,20 @@ class ScoringService(TriggeredService):
                                        participation_id, task_id,
                                        submission_id, dataset_id).all()
 
+            invalidated = []
             for sr in submission_results:
                 if sr.scored():
                     sr.invalidate_score()
+                    if sr.dataset_id == sr.submission.task.active_dataset_id:
+                        invalidated.append((sr.submission.participation_id,
+                                            sr.submission.task_id))
                     # We also save the timestamp of the submission, to
                     # rescore them in order (for fairness, not for a
                     # specific need).
                     temp_queue.append((
                         ScoringOperation(sr.submission_id, sr.dataset_id),
                         sr.submission.timestamp))
+            invalidate_task_scores(session, invalidated)
 
             session.commit()
 
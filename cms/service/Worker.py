@@ -26,14 +26,21 @@
 """
 
 import logging
+import os
 import time
 
+import gevent
 import gevent.lock
+import gevent.pool
 
+from cms import ServiceCoord, config, get_service_address, \
+    get_service_shards
 from cms.db import SessionGen, Contest, enumerate_files
-from cms.db.filecacher import FileCacher, TombstoneError
+from cms.db.filecacher import FileCacher, PeerBackend, TombstoneError
 from cms.grading import JobException
+from cms.grading.compilationcache import CompilationCache
 from cms.grading.Job import CompilationJob, EvaluationJob, JobGroup
+from cms.grading.Sandbox import IsolateSandbox
 from cms.grading.tasktypes import get_task_type
 from cms.io import Service, rpc_method
 
@@ -52,9 +59,23 @@ class Worker(Service):
     JOB_TYPE_COMPILATION = "compile"
     JOB_TYPE_EVALUATION = "evaluate"
 
-    def __init__(self, shard, fake_worker_time=None):
+    def __init__(self, shard, fake_worker_time=None, parallel_jobs=None):
         Service.__init__(self, shard)
         self.file_cacher = FileCacher(self)
+        if config.peer_file_cache:
+            self.file_cacher.backend = PeerBackend(
+                self.file_cacher.backend, self._connect_to_peers())
+
+        # How many jobs of a group we execute at the same time.
+        self._parallel_jobs = parallel_jobs if parallel_jobs is not None \
+            else config.parallel_jobs_per_worker
+        # Isolate has 100 ranges of box ids, the first one is not for
+        # the Workers (see IsolateSandbox).
+        if (shard + 1) * self._parallel_jobs >= 100:
+            raise ValueError("Not enough isolate boxes for shard %d "
+                             "executing %d jobs at the same time."
+                             % (shard, self._parallel_jobs))
+        IsolateSandbox.set_job_slots(self._parallel_jobs)
 
         self.work_lock = gevent.lock.RLock()
         self._last_end_time = None
@@ -64,6 +85,53 @@ class Worker(Service):
 
         self._fake_worker_time = fake_worker_time
 
+        self.compilation_cache = None
+        if config.compilation_cache:
+            self.compilation_cache = CompilationCache(
+                os.path.join(config.cache_dir, "compilation-cache"),
+                config.compilation_cache_max_entries or None)
+
+        if config.sandbox_implementation == "isolate" \
+                and config.sandbox_pool_size > 0:
+            for slot in range(self._parallel_jobs):
+                IsolateSandbox.enable_box_pool(shard, config.sandbox_pool_size,
+                                               slot)
+            gevent.spawn(self._warm_up_box_pools)
+
+    def _connect_to_peers(self):
+        """Connect to the Workers that can provide cached files.
+
+        These are the Workers running on other machines, since the
+        ones on the same machine share the cache with us.
+
+        return ([RemoteServiceClient]): the clients of the Workers.
+
+        """
+        address = get_service_address(ServiceCoord("Worker", self.shard))
+        peers = []
+        for shard in range(get_service_shards("Worker")):
+            coord = ServiceCoord("Worker", shard)
+            if get_service_address(coord).ip != address.ip:
+                peers.append(self.connect_to(coord))
+        return peers
+
+    def _warm_up_box_pools(self):
+        """Initialize all the boxes of the pools before the first job.
+
+        """
+        sandboxes = []
+        try:
+            for slot in range(self._parallel_jobs):
+                IsolateSandbox.set_job_slot(slot)
+                for _ in range(config.sandbox_pool_size):
+                    sandboxes.append(
+                        IsolateSandbox(self.file_cacher, name="warmup"))
+        except Exception:
+            logger.warning("Failed to initialize the pool of sandboxes.",
+                           exc_info=True)
+        for sandbox in sandboxes:
+            sandbox.cleanup(delete=True)
+
     @rpc_method
     def precache_files(self, contest_id):
         """RPC to ask the worker to precache of files in the contest.
@@ -101,10 +169,38 @@ class Worker(Service):
 
             logger.info("Precaching finished.")
 
+    @rpc_method
+    def file_cacher_stats(self):
+        """RPC to get the statistics of the cache of files.
+
+        return ({str: int|None}): see FileCacher.get_stats.
+
+        """
+        return self.file_cacher.get_stats()
+
+    @rpc_method
+    def has_cached_file(self, digest):
+        """RPC to know whether a file is in the cache, for other Workers.
+
+        return (bool): see FileCacher.has_cached_file.
+
+        """
+        return self.file_cacher.has_cached_file(digest)
+
+    @rpc_method
+    def get_cached_file_chunk(self, digest, offset):
+        """RPC to get part of a file in the cache, for other Workers.
+
+        return ({str: str|bool}|None): see
+            FileCacher.get_cached_file_chunk.
+
+        """
+        return self.file_cacher.get_cached_file_chunk(digest, offset)
+
     @rpc_method
     def execute_job_group(self, job_group_dict):
         """Receive a group of jobs in a list format and executes them one by
-        one.
+        one (or some at the same time, if so configured).
 
         job_group_dict ({}): a JobGroup exported to dict.
 
@@ -118,26 +214,12 @@ class Worker(Service):
         if self.work_lock.acquire(False):
             try:
                 logger.info("Starting job group.")
-                for job in job_group.jobs:
-                    logger.info("Starting job.",
-                                extra={"operation": job.info})
-
-                    job.shard = self.shard
-
-                    if self._fake_worker_time is None:
-                        task_type = get_task_type(job.task_type,
-                                                  job.task_type_parameters)
-                        try:
-                            task_type.execute_job(job, self.file_cacher)
-                        except TombstoneError:
-                            job.success = False
-                            job.plus = {"tombstone": True}
-                    else:
-                        self._fake_work(job)
-
-                    logger.info("Finished job.",
-                                extra={"operation": job.info})
-
+                self._cache_executables(job_group.jobs)
+                if self._parallel_jobs > 1:
+                    self._execute_jobs_in_parallel(job_group.jobs)
+                else:
+                    for job in job_group.jobs:
+                        self._execute_job(job)
                 logger.info("Finished job group.")
                 return job_group.export_to_dict()
 
@@ -159,6 +241,88 @@ class Worker(Service):
             self._finalize(start_time)
             raise JobException(err_msg)
 
+    def _cache_executables(self, jobs):
+        """Load in the cache the executables of the evaluation jobs.
+
+        A group usually contains the evaluations of one executable on
+        many testcases; loading it once beforehand avoids jobs running
+        at the same time fetching it each on their own.
+
+        jobs ([Job]): the jobs about to be executed.
+
+        """
+        digests = set(executable.digest
+                      for job in jobs if isinstance(job, EvaluationJob)
+                      for executable in job.executables.values())
+        for digest in digests:
+            try:
+                self.file_cacher.cache_file(digest)
+            except (KeyError, TombstoneError):
+                # The jobs using the executable will fail and report it.
+                pass
+
+    def _execute_job(self, job):
+        """Execute a single job, filling it with the results.
+
+        job (Job): the job to execute.
+
+        """
+        logger.info("Starting job.", extra={"operation": job.info})
+
+        job.shard = self.shard
+
+        if self._fake_worker_time is None:
+            cache = self.compilation_cache \
+                if isinstance(job, CompilationJob) else None
+            if cache is None or not cache.fill_job(job, self.file_cacher):
+                task_type = get_task_type(job.task_type,
+                                          job.task_type_parameters)
+                try:
+                    task_type.execute_job(job, self.file_cacher)
+                except TombstoneError:
+                    job.success = False
+                    job.plus = {"tombstone": True}
+                else:
+                    if cache is not None:
+                        cache.store_job(job)
+        else:
+            self._fake_work(job)
+
+        logger.info("Finished job.", extra={"operation": job.info})
+
+    def _execute_jobs_in_parallel(self, jobs):
+        """Execute the jobs, at most self._parallel_jobs at a time.
+
+        Each job runs in its own greenlet, in a slot that no other
+        running job has (see IsolateSandbox.set_job_slot).
+
+        jobs ([Job]): the jobs to execute.
+
+        raise (Exception): the first exception raised by a job, after
+            all jobs have terminated.
+
+        """
+        free_slots = list(range(self._parallel_jobs))
+        errors = []
+
+        def execute_in_slot(job):
+            slot = free_slots.pop()
+            IsolateSandbox.set_job_slot(slot)
+            try:
+                self._execute_job(job)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                free_slots.append(slot)
+
+        pool = gevent.pool.Pool(self._parallel_jobs)
+        for job in jobs:
+            pool.spawn(execute_in_slot, job)
+        pool.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
     def _fake_work(self, job):
         """Fill the job with fake success data after waiting for some time."""
         time.sleep(self._fake_worker_time)
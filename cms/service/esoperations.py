@@ -27,9 +27,12 @@ compute sets of operations to do.
 """
 
 import logging
+from collections import defaultdict
 
 from sqlalchemy import case, literal
+from sqlalchemy.orm import joinedload
 
+from cms import config
 from cms.db import Dataset, Evaluation, Submission, SubmissionResult, \
     Task, Testcase, UserTest, UserTestResult
 from cms.io import PriorityQueue, QueueItem
@@ -57,6 +60,10 @@ FILTER_SUBMISSION_RESULTS_TO_EVALUATE = (
     (~SubmissionResult.filter_evaluated()) &
     (SubmissionResult.evaluation_tries < MAX_EVALUATION_TRIES)
 )
+FILTER_SUBMISSION_RESULTS_TO_COMPLETE = (
+    SubmissionResult.filter_evaluated() &
+    (SubmissionResult.evaluation_tries < MAX_EVALUATION_TRIES)
+)
 
 
 FILTER_USER_TEST_DATASETS_TO_JUDGE = (
@@ -101,6 +108,25 @@ def submission_to_evaluate(submission_result):
         submission_result.evaluation_tries < MAX_EVALUATION_TRIES
 
 
+def submission_to_complete_evaluation(submission_result):
+    """Return whether ES is interested in the evaluations of the
+    submission that were postponed since they could not change its
+    score (see config.postpone_irrelevant_evaluations).
+
+    submission_result (SubmissionResult): a submission result.
+
+    return (bool): True if ES wants to evaluate the submission on the
+        testcases without an evaluation, even if it was scored.
+
+    """
+    return config.postpone_irrelevant_evaluations and \
+        submission_result is not None and \
+        submission_result.evaluated() and \
+        submission_result.evaluation_tries < MAX_EVALUATION_TRIES and \
+        len(submission_result.evaluations) \
+        < len(submission_result.dataset.testcases)
+
+
 def submission_to_evaluate_on_testcase(submission_result, testcase_codename):
     """Return whether ES is interested in evaluating the submission
     on the given testcase.
@@ -111,7 +137,8 @@ def submission_to_evaluate_on_testcase(submission_result, testcase_codename):
     return (bool): True if ES wants to evaluate the submission.
 
     """
-    if not submission_to_evaluate(submission_result):
+    if not submission_to_evaluate(submission_result) and \
+            not submission_to_complete_evaluation(submission_result):
         return False
 
     for evaluation in submission_result.evaluations:
@@ -176,8 +203,11 @@ def submission_get_operations(submission_result, submission, dataset):
             priority, \
             submission.timestamp
 
-    elif submission_to_evaluate(submission_result):
-        if not dataset.active:
+    elif submission_to_evaluate(submission_result) or \
+            submission_to_complete_evaluation(submission_result):
+        # The evaluations missing from an evaluated result were
+        # postponed, and stay at the lowest priority.
+        if not dataset.active or submission_result.evaluated():
             priority = PriorityQueue.PRIORITY_EXTRA_LOW
         elif submission_result.evaluation_tries == 0:
             priority = PriorityQueue.PRIORITY_MEDIUM
@@ -241,6 +271,131 @@ def user_test_get_operations(user_test, dataset):
             user_test.timestamp
 
 
+def _reuse_signature(dataset, submission_result):
+    """Return what must be the same for an evaluation to be reused.
+
+    dataset (Dataset): the dataset of the evaluation.
+    submission_result (SubmissionResult|None): the result of the
+        submission on the dataset.
+
+    return (tuple): the limits, task type and managers of the dataset,
+        and the executables of the result.
+
+    """
+    executables = None
+    if submission_result is not None:
+        executables = dict((filename, executable.digest)
+                           for filename, executable
+                           in submission_result.executables.items())
+    return (dataset.time_limit, dataset.memory_limit, dataset.task_type,
+            dataset.task_type_parameters,
+            dict((filename, manager.digest)
+                 for filename, manager in dataset.managers.items()),
+            executables)
+
+
+def find_reusable_evaluations(session, operations):
+    """Find the existing evaluations whose results can be reused for
+    some evaluation operations.
+
+    An evaluation of the same submission on another dataset can be
+    reused if it ran the same executables on a testcase with the same
+    input and output, with the same limits, task type and managers;
+    this happens for example for a dataset cloned from another one.
+    Reuse can be disabled on a per-task basis.
+
+    The lookup is done in bulk, with a fixed number of queries, and
+    none at all if no operation is on a task with several datasets
+    and reuse enabled.
+
+    session (Session): the database session to use.
+    operations ([ESOperation]): the operations; the ones that are not
+        EVALUATION operations are ignored.
+
+    return ({ESOperation: Evaluation}): for each operation that can
+        reuse an evaluation, the evaluation whose result can be copied.
+
+    """
+    operations = [operation for operation in operations
+                  if operation.type_ == ESOperation.EVALUATION]
+    if len(operations) == 0:
+        return dict()
+
+    datasets = session.query(Dataset)\
+        .filter(Dataset.id.in_(set(operation.dataset_id
+                                   for operation in operations)))\
+        .options(joinedload(Dataset.task).joinedload(Task.datasets))\
+        .all()
+    datasets = dict((dataset.id, dataset) for dataset in datasets
+                    if dataset.task.reuse_evaluations
+                    and len(dataset.task.datasets) >= 2)
+    operations = [operation for operation in operations
+                  if operation.dataset_id in datasets]
+    if len(operations) == 0:
+        return dict()
+
+    submission_ids = set(operation.object_id for operation in operations)
+    submission_results = dict(
+        ((submission_result.submission_id, submission_result.dataset_id),
+         submission_result)
+        for submission_result in session.query(SubmissionResult)
+        .filter(SubmissionResult.submission_id.in_(submission_ids))
+        .options(joinedload(SubmissionResult.executables))
+        .all())
+    evaluations = defaultdict(list)
+    for evaluation in session.query(Evaluation)\
+            .filter(Evaluation.submission_id.in_(submission_ids))\
+            .options(joinedload(Evaluation.testcase))\
+            .all():
+        evaluations[evaluation.submission_id].append(evaluation)
+
+    signatures = dict()
+
+    def get_signature(submission_id, dataset):
+        key = (submission_id, dataset.id)
+        if key not in signatures:
+            signatures[key] = _reuse_signature(
+                dataset, submission_results.get(key))
+        return signatures[key]
+
+    res = dict()
+    for operation in operations:
+        dataset = datasets[operation.dataset_id]
+        testcase = dataset.testcases.get(operation.testcase_codename)
+        if testcase is None or (operation.object_id, dataset.id) \
+                not in submission_results:
+            continue
+        signature = get_signature(operation.object_id, dataset)
+        other_datasets = dict((other.id, other)
+                              for other in dataset.task.datasets)
+        for evaluation in evaluations[operation.object_id]:
+            other = other_datasets.get(evaluation.dataset_id)
+            if other is None or other is dataset \
+                    or evaluation.testcase.input != testcase.input \
+                    or evaluation.testcase.output != testcase.output:
+                continue
+            if get_signature(operation.object_id, other) == signature:
+                res[operation] = evaluation
+                break
+    return res
+
+
+def find_reusable_evaluation(session, operation):
+    """Find an existing evaluation whose result can be reused for an
+    evaluation operation.
+
+    See find_reusable_evaluations.
+
+    session (Session): the database session to use.
+    operation (ESOperation): an EVALUATION operation.
+
+    return (Evaluation|None): an evaluation whose result can be copied
+        for the operation, or None if there is none.
+
+    """
+    return find_reusable_evaluations(session, [operation]).get(operation)
+
+
 def get_relevant_operations(level, submissions, dataset_id=None):
     """Return all possible operations involving the submissions
 
@@ -283,12 +438,15 @@ def get_relevant_operations(level, submissions, dataset_id=None):
     return operations
 
 
-def get_submissions_operations(session, contest_id=None):
+def get_submissions_operations(session, contest_id=None, watermark=None):
     """Return all the operations to do for submissions in the contest.
 
     session (Session): the database session to use.
     contest_id (int|None): the contest for which we want the operations.
         If none, get operations for any contest.
+    watermark ((int, int)|None): if given, the largest ids of the
+        submissions and of the datasets already checked; only the operations
+        for submissions or datasets with larger ids are returned.
 
     return ([ESOperation, int, float]): a list of operation, priority
         and timestamp.
@@ -301,6 +459,12 @@ def get_submissions_operations(session, contest_id=None):
     else:
         contest_filter = Task.contest_id == contest_id
 
+    if watermark is None:
+        new_filter = literal(True)
+    else:
+        object_id, dataset_id = watermark
+        new_filter = (Submission.id > object_id) | (Dataset.id > dataset_id)
+
     # Retrieve the compilation operations for all submissions without
     # the corresponding result for a dataset to judge. Since we have
     # no SubmissionResult, we cannot join regularly with dataset;
@@ -314,6 +478,7 @@ def get_submissions_operations(session, contest_id=None):
                    (Submission.id == SubmissionResult.submission_id))\
         .filter(
             contest_filter &
+            (new_filter) &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (SubmissionResult.dataset_id.is_(None)))\
         .with_entities(Submission.id, Dataset.id,
@@ -332,6 +497,7 @@ def get_submissions_operations(session, contest_id=None):
         .join(SubmissionResult.dataset)\
         .filter(
             contest_filter &
+            (new_filter) &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (FILTER_SUBMISSION_RESULTS_TO_COMPILE))\
         .with_entities(Submission.id, Dataset.id,
@@ -354,7 +520,12 @@ def get_submissions_operations(session, contest_id=None):
     # judge. Again we need to pick all tuples (submission, dataset,
     # testcase) such that there is no evaluation for them, and to do
     # so we take the cartesian product with the testcases and later
-    # ensure that there is no evaluation associated.
+    # ensure that there is no evaluation associated. This includes
+    # the evaluations postponed for the results already evaluated.
+    results_filter = FILTER_SUBMISSION_RESULTS_TO_EVALUATE
+    if config.postpone_irrelevant_evaluations:
+        results_filter = results_filter \
+            | FILTER_SUBMISSION_RESULTS_TO_COMPLETE
     to_evaluate = session.query(SubmissionResult)\
         .join(SubmissionResult.dataset)\
         .join(SubmissionResult.submission)\
@@ -366,13 +537,16 @@ def get_submissions_operations(session, contest_id=None):
                    (Evaluation.testcase_id == Testcase.id))\
         .filter(
             contest_filter &
+            (new_filter) &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
-            (FILTER_SUBMISSION_RESULTS_TO_EVALUATE) &
+            (results_filter) &
             (Evaluation.id.is_(None)))\
         .with_entities(Submission.id, Dataset.id,
                        case([
                            (Dataset.id != Task.active_dataset_id,
                             literal(PriorityQueue.PRIORITY_EXTRA_LOW)),
+                           (SubmissionResult.filter_evaluated(),
+                            literal(PriorityQueue.PRIORITY_EXTRA_LOW)),
                            (SubmissionResult.evaluation_tries == 0,
                             literal(PriorityQueue.PRIORITY_MEDIUM))
                            ], else_=literal(PriorityQueue.PRIORITY_LOW)),
@@ -390,12 +564,16 @@ def get_submissions_operations(session, contest_id=None):
     return operations
 
 
-def get_user_tests_operations(session, contest_id=None):
+def get_user_tests_operations(session, contest_id=None, watermark=None):
     """Return all the operations to do for user tests in the contest.
 
     session (Session): the database session to use.
     contest_id (int|None): the contest for which we want the operations.
         If none, get operations for any contest.
+    watermark ((int, int)|None): if given, the largest ids of the
+        user tests and of the datasets already checked; only the
+        operations for user tests or datasets with larger ids are
+        returned.
 
     return ([ESOperation, float, int]): a list of operation, timestamp
         and priority.
@@ -408,6 +586,12 @@ def get_user_tests_operations(session, contest_id=None):
     else:
         contest_filter = Task.contest_id == contest_id
 
+    if watermark is None:
+        new_filter = literal(True)
+    else:
+        object_id, dataset_id = watermark
+        new_filter = (UserTest.id > object_id) | (Dataset.id > dataset_id)
+
     # Retrieve the compilation operations for all user tests without
     # the corresponding result for a dataset to judge. Since we have
     # no UserTestResult, we cannot join regularly with dataset;
@@ -421,6 +605,7 @@ def get_user_tests_operations(session, contest_id=None):
                    (UserTest.id == UserTestResult.user_test_id))\
         .filter(
             contest_filter &
+            (new_filter) &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (UserTestResult.dataset_id.is_(None)))\
         .with_entities(UserTest.id, Dataset.id,
@@ -439,6 +624,7 @@ def get_user_tests_operations(session, contest_id=None):
         .join(UserTestResult.dataset)\
         .filter(
             contest_filter &
+            (new_filter) &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (FILTER_USER_TEST_RESULTS_TO_COMPILE))\
         .with_entities(UserTest.id, Dataset.id,
@@ -467,6 +653,7 @@ def get_user_tests_operations(session, contest_id=None):
         .join(UserTestResult.dataset)\
         .filter(
             contest_filter &
+            (new_filter) &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (FILTER_USER_TEST_RESULTS_TO_EVALUATE))\
         .with_entities(UserTest.id, Dataset.id,
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Policies deciding the order in which EvaluationService executes
+the operations with the same priority.
+
+A policy gives a rank to each operation when it is enqueued; among the
+operations with the same priority, the one with the lowest rank is
+executed first.
+
+"""
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulingPolicy:
+    """Execute the operations in the order in which they were first
+    requested.
+
+    """
+
+    # Whether the policy needs the flow of the operations (see
+    # FairSchedulingPolicy).
+    uses_flows = False
+
+    def rank(self, unused_operation, unused_priority, timestamp):
+        """Return the rank of an operation being enqueued.
+
+        unused_operation (ESOperation): the operation.
+        unused_priority (int): the priority of the operation.
+        timestamp (datetime): the time of the first request of the
+            operation.
+
+        return (object): the rank of the operation; all the ranks
+            given by a policy must be comparable.
+
+        """
+        return timestamp
+
+    def operation_extracted(self, unused_entry):
+        """Take into account an operation extracted from the queue to
+        be executed.
+
+        unused_entry (QueueEntry): the entry of the operation.
+
+        """
+        pass
+
+    def operation_done(self, unused_operation, unused_job):
+        """Take into account the result of an operation.
+
+        unused_operation (ESOperation): the operation.
+        unused_job (Job): the job executed by the worker.
+
+        """
+        pass
+
+
+class FairSchedulingPolicy(SchedulingPolicy):
+    """Share the workers fairly among the participations.
+
+    This implements start-time fair queueing, where the operations of
+    a participation form a flow. The rank of an operation is its
+    virtual start time: the latest between the current virtual time
+    and the virtual finish time of the previous operation of the same
+    flow; its virtual finish time is the start time plus its cost. The
+    virtual time is the rank of the last extracted operation. Thus,
+    when some participations have many operations in the queue, the
+    operations of the others are executed after at most one operation
+    of each of them, instead of after all of them.
+
+    Note that this interleaves the operations of a submission with the
+    ones of the other participations, hence they are less likely to be
+    sent to a worker in the same batch (and encoded together, see
+    JobGroup.export_to_dict).
+
+    """
+
+    uses_flows = True
+
+    def __init__(self, get_flow):
+        """Initialize the policy.
+
+        get_flow (function): given an operation, return a hashable
+            identifying its flow (e.g., the participation).
+
+        """
+        self._get_flow = get_flow
+        self._virtual_time = 0.0
+        # Virtual finish time of the last operation of each flow.
+        self._finish_times = dict()
+
+    def cost(self, unused_operation):
+        """Return the cost of an operation.
+
+        unused_operation (ESOperation): the operation.
+
+        return (float): the cost, all operations cost the same.
+
+        """
+        return 1.0
+
+    def rank(self, operation, unused_priority, unused_timestamp):
+        """See SchedulingPolicy.rank."""
+        flow = self._get_flow(operation)
+        start = max(self._virtual_time, self._finish_times.get(flow, 0.0))
+        self._finish_times[flow] = start + self.cost(operation)
+        return start
+
+    def operation_extracted(self, entry):
+        """See SchedulingPolicy.operation_extracted."""
+        self._virtual_time = max(self._virtual_time, entry.rank)
+
+
+class DurationEstimator:
+    """Estimate the duration of the operations from the ones of the
+    previous operations of the same kind.
+
+    The estimate is the moving average of the durations of the
+    operations of the same type, dataset and testcase; failing that,
+    of the same type and dataset; failing that, of all operations.
+
+    """
+
+    # Weight of the last duration in the moving averages.
+    ALPHA = 0.2
+
+    # Minimum duration of an operation, in seconds.
+    MIN_DURATION = 0.01
+
+    def __init__(self):
+        # Moving average of the durations of each kind of operation,
+        # and of all the operations (the estimate for unknown kinds).
+        self._durations = dict()
+        self._default_duration = 1.0
+
+    @staticmethod
+    def _kinds(operation):
+        return [(operation.type_, operation.dataset_id,
+                 operation.testcase_codename),
+                (operation.type_, operation.dataset_id)]
+
+    def estimate(self, operation):
+        """Return the estimated duration of an operation.
+
+        operation (ESOperation): the operation.
+
+        return (float): the estimated duration, in seconds.
+
+        """
+        for kind in self._kinds(operation):
+            if kind in self._durations:
+                return self._durations[kind]
+        return self._default_duration
+
+    def add(self, operation, duration):
+        """Take into account the duration of an operation.
+
+        operation (ESOperation): the operation.
+        duration (float): how long it took, in seconds.
+
+        """
+        duration = max(duration, self.MIN_DURATION)
+        for kind in self._kinds(operation):
+            if kind in self._durations:
+                self._durations[kind] += \
+                    self.ALPHA * (duration - self._durations[kind])
+            else:
+                self._durations[kind] = duration
+        self._default_duration += \
+            self.ALPHA * (duration - self._default_duration)
+
+    @staticmethod
+    def get_duration(job):
+        """Return the duration of an executed job, if known.
+
+        job (Job): the job.
+
+        return (float|None): the wall clock time of the execution, in
+            seconds, or None if the worker did not report it.
+
+        """
+        if job.plus is None:
+            return None
+        return job.plus.get("execution_wall_clock_time")
+
+
+class CostAwareFairSchedulingPolicy(FairSchedulingPolicy):
+    """Share the time of the workers fairly among the participations.
+
+    Like FairSchedulingPolicy, but the cost of an operation is the
+    average of the durations of the previous operations of the same
+    kind (type, dataset and testcase), so that a participation
+    submitting to tasks with slow testcases does not get more time
+    than the others.
+
+    """
+
+    def __init__(self, get_flow):
+        """See FairSchedulingPolicy.__init__."""
+        super().__init__(get_flow)
+        self._durations = DurationEstimator()
+
+    def cost(self, operation):
+        """Return the estimated duration of an operation.
+
+        operation (ESOperation): the operation.
+
+        return (float): the estimated duration, in seconds.
+
+        """
+        return self._durations.estimate(operation)
+
+    def operation_done(self, operation, job):
+        """See SchedulingPolicy.operation_done."""
+        duration = DurationEstimator.get_duration(job)
+        if duration is not None:
+            self._durations.add(operation, duration)
+
+
+SCHEDULING_POLICIES = {
+    "fifo": SchedulingPolicy,
+    "fair": FairSchedulingPolicy,
+    "fair_cost": CostAwareFairSchedulingPolicy,
+}
+
+
+def get_scheduling_policy(name, get_flow):
+    """Return a new scheduling policy.
+
+    name (str): the name of the policy, one of SCHEDULING_POLICIES.
+    get_flow (function): given an operation, return a hashable
+        identifying its flow, for the fair policies.
+
+    return (SchedulingPolicy): the policy.
+
+    raise (ValueError): if the name is not a known policy.
+
+    """
+    if name not in SCHEDULING_POLICIES:
+        raise ValueError("Unknown scheduling policy %s." % name)
+    if name == "fifo":
+        return SchedulingPolicy()
+    return SCHEDULING_POLICIES[name](get_flow)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A pool of processes computing the scores of submission results.
+
+The processes do not access the database: they receive the columnar
+views of the submission results (see SubmissionResultColumns), holding
+just what the score types use, and return the scores.
+
+"""
+
+import logging
+import multiprocessing
+import os
+
+import gevent
+import gevent.queue
+import gevent.socket
+
+
+logger = logging.getLogger(__name__)
+
+
+def _compute_scores(score_types, tasks):
+    """Compute the scores of some submission results.
+
+    score_types ({str: ScoreType}): a cache of the score type
+        objects, by the representation of their specification.
+    tasks ([(tuple, SubmissionResultColumns)]): the specification of
+        the score type (name, parameters and public testcases) and the
+        result to score.
+
+    return ([tuple|None]): the scores, as returned by compute_score,
+        or None for the results whose score could not be computed.
+
+    """
+    # Import late, as this runs in a new process.
+    from cms.grading.scoretypes import get_score_type
+
+    res = []
+    for spec, submission_result in tasks:
+        try:
+            key = repr(spec)
+            if key not in score_types:
+                score_types[key] = get_score_type(*spec)
+            res.append(score_types[key].compute_score(submission_result))
+        except Exception:
+            # The score is computed again, and the error reported, by
+            # the service.
+            res.append(None)
+    return res
+
+
+def _process_main(connection):
+    """Compute the scores received from the connection, until EOF.
+
+    connection (multiprocessing.Connection): the connection with the
+        service.
+
+    """
+    # The pipe might have been created non-blocking by gevent.
+    os.set_blocking(connection.fileno(), True)
+    score_types = dict()
+    while True:
+        try:
+            tasks = connection.recv()
+        except EOFError:
+            break
+        connection.send(_compute_scores(score_types, tasks))
+
+
+class ScoringPool:
+    """A pool of processes computing scores in parallel.
+
+    The processes are started with the "spawn" method, so that they do
+    not inherit the state of the service (like the database
+    connections or the gevent hub). The service waits for their
+    answers without blocking the other greenlets.
+
+    """
+
+    def __init__(self, processes):
+        """Start the processes.
+
+        processes (int): the number of processes.
+
+        """
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = processes
+        # Idle processes, with the connections to talk to them.
+        self._idle = gevent.queue.Queue()
+        for _ in range(processes):
+            self._idle.put(self._start_process())
+
+    def _start_process(self):
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_process_main, args=(child_connection,), daemon=True)
+        process.start()
+        child_connection.close()
+        # We wait for the answers with gevent, and then read them
+        # (and write the requests) in one go.
+        os.set_blocking(connection.fileno(), True)
+        return process, connection
+
+    def _run(self, tasks):
+        """Compute some scores in one of the processes.
+
+        tasks ([(tuple, SubmissionResultColumns)]): see
+            _compute_scores.
+
+        return ([tuple|None]): see _compute_scores; all None if the
+            process failed.
+
+        """
+        process, connection = self._idle.get()
+        try:
+            connection.send(tasks)
+            gevent.socket.wait_read(connection.fileno())
+            return connection.recv()
+        except (OSError, EOFError):
+            logger.error("Scoring process %s failed, restarting it.",
+                         process.pid, exc_info=True)
+            connection.close()
+            process.kill()
+            process, connection = self._start_process()
+            return [None] * len(tasks)
+        finally:
+            self._idle.put((process, connection))
+
+    def compute_scores(self, tasks):
+        """Compute the scores of some submission results.
+
+        tasks ([(tuple, SubmissionResultColumns)]): see
+            _compute_scores.
+
+        return ([tuple|None]): see _compute_scores.
+
+        """
+        if len(tasks) == 0:
+            return []
+        chunk_size = -(-len(tasks) // self._processes)
+        chunks = [tasks[i:i + chunk_size]
+                  for i in range(0, len(tasks), chunk_size)]
+        greenlets = [gevent.spawn(self._run, chunk) for chunk in chunks]
+        gevent.joinall(greenlets)
+        res = []
+        for chunk, greenlet in zip(chunks, greenlets):
+            res.extend(greenlet.value if greenlet.successful()
+                       else [None] * len(chunk))
+        return res
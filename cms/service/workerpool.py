@@ -27,11 +27,15 @@
 
 import logging
 import random
+import time
+from collections import OrderedDict
 from datetime import timedelta
 
+import gevent
 import gevent.lock
 from gevent.event import Event
 
+from cms import config, get_service_address
 from cms.db import SessionGen
 from cms.grading.Job import JobGroup
 from cmscommon.datetime import make_datetime, make_timestamp
@@ -52,6 +56,10 @@ class WorkerPool:
     # Seconds after which we declare a worker stale.
     WORKER_TIMEOUT = timedelta(seconds=600)
 
+    # Number of digests remembered for each machine, to send the
+    # operations to the workers that have their files in cache.
+    AFFINITY_SIZE = 10000
+
     def __init__(self, service):
         """service (Service): the EvaluationService using this
         WorkerPool.
@@ -95,6 +103,20 @@ class WorkerPool:
         # the operations lists.
         self._operation_lock = gevent.lock.RLock()
 
+        # The workers on the same machine share their file cache, so
+        # we remember, for each machine, the digests of the files
+        # recently sent to any of them, the most recent last.
+        # Type: {int: str}
+        self._host = {}
+        # Type: {str: OrderedDict}
+        self._recent_digests = {}
+
+        # The operations waiting for a busy worker that has their
+        # files in cache, the time since when they wait and their job
+        # group, so that it is not built again at each attempt.
+        # Type: ([ESOperation], float, JobGroup)|None
+        self._waiting = None
+
         # Event set when there are workers available to take jobs. It
         # is only guaranteed that if a worker is available, then this
         # event is set. In other words, the fact that this event is
@@ -158,6 +180,8 @@ class WorkerPool:
         self._start_time[shard] = None
         self._schedule_disabling[shard] = False
         self._ignore[shard] = False
+        self._host[shard] = get_service_address(worker_coord).ip
+        self._recent_digests.setdefault(self._host[shard], OrderedDict())
         self._workers_available_event.set()
         logger.debug("Worker %s added.", shard)
 
@@ -188,40 +212,137 @@ class WorkerPool:
         are available then this returns None, otherwise this returns
         the chosen worker.
 
+        Among the available workers, we prefer the ones on the
+        machines with most of the files of the operations in cache;
+        if no available worker has any of them, but a busy one has,
+        we wait for it up to worker_affinity_wait seconds.
+
         operations ([ESOperation]): the operations to assign to a worker.
 
         return (int|None): None if no workers are available, the worker
             assigned to the operation otherwise.
 
         """
-        # We look for an available worker.
-        try:
-            shard = self.find_worker(WorkerPool.WORKER_INACTIVE,
-                                     require_connection=True,
-                                     random_worker=True)
-        except LookupError:
+        # We look for the available workers.
+        pool = [shard for shard, worker_operation in self._operations.items()
+                if worker_operation == WorkerPool.WORKER_INACTIVE
+                and self._worker[shard].connected]
+        if pool == []:
             self._workers_available_event.clear()
             return None
 
+        if self._waiting is not None and self._waiting[0] == operations:
+            job_group = self._waiting[2]
+        else:
+            with SessionGen() as session:
+                job_group = JobGroup.from_operations(operations, session)
+        digests = WorkerPool._get_digests(job_group)
+
+        shard = self._choose_worker(pool, digests)
+        if shard is None:
+            # Wait for a busy worker, but at most until the delay
+            # since the first attempt expires.
+            if self._waiting is None or self._waiting[0] != operations:
+                self._waiting = (list(operations), time.monotonic(),
+                                 job_group)
+            remaining = self._waiting[1] + config.worker_affinity_wait \
+                - time.monotonic()
+            if remaining > 0:
+                self._workers_available_event.clear()
+                gevent.spawn_later(remaining,
+                                   self._workers_available_event.set)
+                return None
+            shard = random.choice(pool)
+        self._waiting = None
+
         # Then we fill the info for future memory.
         self._add_operations(shard, operations)
+        self._add_digests(shard, digests)
 
         logger.debug("Worker %s acquired.", shard)
         self._start_time[shard] = make_datetime()
 
-        with SessionGen() as session:
-            job_group_dict = \
-                JobGroup.from_operations(operations, session).export_to_dict()
-
         logger.info("Asking worker %s to %s.", shard,
                     ", ".join("`%s'" % operation for operation in operations))
 
         self._worker[shard].execute_job_group(
-            job_group_dict=job_group_dict,
+            job_group_dict=job_group.export_to_dict(),
             callback=self._service.action_finished,
             plus=shard)
         return shard
 
+    @staticmethod
+    def _get_digests(job_group):
+        """Return the digests of the files needed by a job group.
+
+        job_group (JobGroup): the job group.
+
+        return ({str}): the digests of the files, managers,
+            executables, inputs and outputs of the jobs.
+
+        """
+        digests = set()
+        for job in job_group.jobs:
+            for files in (job.files, job.managers, job.executables):
+                digests.update(file_.digest for file_ in files.values())
+            for digest in (getattr(job, "input", None),
+                           getattr(job, "output", None)):
+                if digest is not None:
+                    digests.add(digest)
+        return digests
+
+    def _affinity(self, shard, digests):
+        """Return how many of the digests a worker has in cache.
+
+        shard (int): the worker.
+        digests ({str}): the digests.
+
+        return (int): the number of digests recently sent to the
+            machine of the worker.
+
+        """
+        recent = self._recent_digests[self._host[shard]]
+        return sum(1 for digest in digests if digest in recent)
+
+    def _choose_worker(self, pool, digests):
+        """Choose the worker to which to assign some operations.
+
+        pool ([int]): the available workers.
+        digests ({str}): the digests of the files of the operations.
+
+        return (int|None): one of the available workers on the
+            machines with most of the digests in cache, chosen
+            uniformly; None if none of them has any, a busy worker has
+            some, and we should wait for it.
+
+        """
+        affinities = dict((shard, self._affinity(shard, digests))
+                          for shard in pool)
+        best = max(affinities.values())
+        if best == 0 and config.worker_affinity_wait > 0:
+            for shard, worker_operation in self._operations.items():
+                if isinstance(worker_operation, list) \
+                        and not self._schedule_disabling[shard] \
+                        and self._worker[shard].connected \
+                        and self._affinity(shard, digests) > 0:
+                    return None
+        return random.choice([shard for shard in pool
+                              if affinities[shard] == best])
+
+    def _add_digests(self, shard, digests):
+        """Remember that some digests were sent to a worker.
+
+        shard (int): the worker.
+        digests ({str}): the digests.
+
+        """
+        recent = self._recent_digests[self._host[shard]]
+        for digest in digests:
+            recent[digest] = None
+            recent.move_to_end(digest)
+        while len(recent) > WorkerPool.AFFINITY_SIZE:
+            recent.popitem(last=False)
+
     def release_worker(self, shard):
         """To be called by ES when it receives a notification that an
         operation finished.
@@ -266,6 +387,19 @@ class WorkerPool:
         else:
             return ret
 
+    def get_busy_time(self, shard):
+        """Return for how long a worker has been doing its operations.
+
+        shard (int): the worker.
+
+        return (float|None): the seconds since the operations were
+            assigned to the worker, or None if it has none.
+
+        """
+        if self._start_time[shard] is None:
+            return None
+        return (make_datetime() - self._start_time[shard]).total_seconds()
+
     def find_worker(self, operation, require_connection=False,
                     random_worker=False):
         """Return a worker whose assigned operation is operation.
@@ -315,6 +449,16 @@ class WorkerPool:
                          "that cannot be found.", operation)
             raise
 
+    def get_operations(self):
+        """Return the operations currently assigned to the workers.
+
+        return ([ESOperation]): the operations, with the side data
+            given by the EvaluationExecutor.
+
+        """
+        with self._operation_lock:
+            return list(self._operations_reverse.keys())
+
     def get_status(self):
         """Returns a dict with info about the current status of all
         workers.
@@ -23,16 +23,22 @@
 
 """
 
+import base64
 import os
 import random
 import shutil
+import stat
+import tempfile
 import unittest
 from io import BytesIO
+from unittest.mock import patch
+
+import gevent.event
 
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
-from cms.db.filecacher import FileCacher
+from cms.db.filecacher import FileCacher, NullBackend, PeerBackend
 from cmscommon.digest import Digester, bytes_digest
 
 
@@ -317,6 +323,29 @@ class TestFileCacherBase:
 
         self.file_cacher.delete(self.digest)
 
+    def test_link_file_to_path(self):
+        """Put a file into the storage, then make it available at a
+        path without copying it.
+
+        """
+        content = os.urandom(100)
+        digest = self.file_cacher.put_file_content(content, "Test #008")
+        # Make sure it is fetched again from the backend.
+        os.unlink(os.path.join(self.cache_base_path, digest))
+
+        temp_dir = tempfile.mkdtemp(dir=self.cache_base_path)
+        try:
+            dst_path = os.path.join(temp_dir, "linked")
+            self.assertTrue(
+                self.file_cacher.link_file_to_path(digest, dst_path))
+            with open(dst_path, "rb") as f:
+                self.assertEqual(f.read(), content)
+            mode = stat.S_IMODE(os.stat(dst_path).st_mode)
+            self.assertEqual(mode & 0o222, 0)
+            self.assertNotEqual(mode & 0o444, 0)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_file_duplicates(self):
         """Send multiple copies of the a file into FileCacher.
 
@@ -384,5 +413,165 @@ class TestFileCacherFS(TestFileCacherBase, unittest.TestCase):
         shutil.rmtree("fs-storage", ignore_errors=True)
 
 
+class TestFileCacherEviction(unittest.TestCase):
+    """Tests for the size limit of the local cache of FileCacher."""
+
+    def setUp(self):
+        self.file_cacher = FileCacher(path="fs-storage",
+                                      max_cache_size=1000)
+        self.file_dir = self.file_cacher.file_dir
+
+    def tearDown(self):
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def put(self, mtime):
+        digest = self.file_cacher.put_file_content(os.urandom(300))
+        os.utime(os.path.join(self.file_dir, digest), (mtime, mtime))
+        return digest
+
+    def in_cache(self, digest):
+        return os.path.exists(os.path.join(self.file_dir, digest))
+
+    def test_lru(self):
+        first = self.put(100)
+        second = self.put(200)
+        third = self.put(300)
+        # Accessing the first file makes it the most recently used.
+        self.file_cacher.get_file_content(first)
+        fourth = self.put(400)
+
+        # The cache is shrunk to 90% of its maximum size.
+        self.assertTrue(self.in_cache(first))
+        self.assertFalse(self.in_cache(second))
+        self.assertTrue(self.in_cache(third))
+        self.assertTrue(self.in_cache(fourth))
+        stats = self.file_cacher.get_stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["evicted_bytes"], 300)
+        self.assertEqual(stats["size"], 900)
+
+    def test_evicted_file_fetched_again(self):
+        digests = [self.put(i) for i in range(4)]
+        self.assertFalse(self.in_cache(digests[0]))
+
+        self.file_cacher.get_file_content(digests[0])
+        self.file_cacher.get_file_content(digests[3])
+        self.assertTrue(self.in_cache(digests[0]))
+        stats = self.file_cacher.get_stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+    def test_open_file_survives_eviction(self):
+        content = os.urandom(300)
+        digest = self.file_cacher.put_file_content(content)
+        with self.file_cacher.get_file(digest) as f:
+            os.utime(os.path.join(self.file_dir, digest), (0, 0))
+            for i in range(1, 4):
+                self.put(i)
+            self.assertFalse(self.in_cache(digest))
+            self.assertEqual(f.read(), content)
+
+    def test_unbounded(self):
+        file_cacher = FileCacher(path="fs-storage")
+        self.assertIsNone(file_cacher.get_stats()["max_size"])
+        digests = [file_cacher.put_file_content(os.urandom(300))
+                   for _ in range(10)]
+        for digest in digests:
+            self.assertTrue(os.path.exists(
+                os.path.join(file_cacher.file_dir, digest)))
+
+
+class FakePeer:
+    """A peer serving the files in the local cache of a FileCacher."""
+
+    remote_service_coord = "FakePeer"
+
+    def __init__(self, file_cacher, connected=True, corrupt=False):
+        self.file_cacher = file_cacher
+        self.connected = connected
+        self.corrupt = corrupt
+        self.calls = 0
+
+    def has_cached_file(self, digest):
+        result = gevent.event.AsyncResult()
+        result.set(self.file_cacher.has_cached_file(digest))
+        return result
+
+    def get_cached_file_chunk(self, digest, offset):
+        self.calls += 1
+        chunk = self.file_cacher.get_cached_file_chunk(digest, offset)
+        if chunk is not None and self.corrupt:
+            chunk["data"] = base64.b64encode(b"corrupt").decode("ascii")
+        result = gevent.event.AsyncResult()
+        result.set(chunk)
+        return result
+
+
+class TestPeerBackend(unittest.TestCase):
+    """Tests for fetching files from the caches of other services."""
+
+    def setUp(self):
+        self.peer_file_cacher = FileCacher(path="fs-storage")
+        self.content = os.urandom(250)
+        self.digest = self.peer_file_cacher.put_file_content(self.content)
+        self.file_cacher = FileCacher(null=True)
+
+    def tearDown(self):
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def set_peers(self, *peers):
+        self.file_cacher.backend = PeerBackend(NullBackend(), list(peers))
+
+    @patch.object(PeerBackend, "CHUNK_SIZE", 100)
+    def test_fetch_from_peer(self):
+        peer = FakePeer(self.peer_file_cacher)
+        self.set_peers(FakePeer(self.peer_file_cacher, connected=False),
+                       peer)
+        self.assertEqual(self.file_cacher.get_file_content(self.digest),
+                         self.content)
+        self.assertEqual(peer.calls, 3)
+
+    def test_not_in_peer_cache(self):
+        peer = FakePeer(self.peer_file_cacher)
+        self.set_peers(peer)
+        # The peer does not ask its backend, and it is not asked for
+        # the content.
+        os.unlink(os.path.join(self.peer_file_cacher.file_dir,
+                               self.digest))
+        with self.assertRaises(KeyError):
+            self.file_cacher.get_file_content(self.digest)
+        self.assertEqual(peer.calls, 0)
+
+    def test_fallback_to_other_peer(self):
+        corrupt_peer = FakePeer(self.peer_file_cacher, corrupt=True)
+        peer = FakePeer(self.peer_file_cacher)
+        self.set_peers(corrupt_peer, peer)
+        self.assertEqual(self.file_cacher.get_file_content(self.digest),
+                         self.content)
+        self.assertEqual(corrupt_peer.calls, 1)
+        self.assertEqual(peer.calls, 1)
+
+    def test_wrong_digest(self):
+        self.set_peers(FakePeer(self.peer_file_cacher, corrupt=True))
+        with self.assertRaises(KeyError):
+            self.file_cacher.get_file_content(self.digest)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.file_cacher.file_dir, self.digest)))
+
+    def test_invalid_digest(self):
+        self.assertFalse(self.peer_file_cacher.has_cached_file(
+            "../" + self.digest))
+        self.assertIsNone(self.peer_file_cacher.get_cached_file_chunk(
+            "../" + self.digest, 0))
+
+    def test_invalid_offset(self):
+        for offset in [-1, 1.5, "0", None]:
+            with self.assertRaises(ValueError):
+                self.peer_file_cacher.get_cached_file_chunk(
+                    self.digest, offset)
+        self.assertEqual(self.peer_file_cacher.get_cached_file_chunk(
+            self.digest, 1000), {"data": "", "eof": True})
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the jobs."""
+
+import json
+import unittest
+
+from cms.db import Executable, File, Manager
+from cms.grading.Job import CompilationJob, EvaluationJob, JobGroup
+from cms.service.esoperations import ESOperation
+
+
+def evaluation_job(testcase_codename, executable_digest="exe", **kwargs):
+    return EvaluationJob(
+        operation=ESOperation(ESOperation.EVALUATION, 1, 2,
+                              testcase_codename),
+        task_type="Batch",
+        task_type_parameters=["alone", ["", ""], "diff"],
+        language="C11 / gcc",
+        files={"foo.%l": File("foo.%l", "foo")},
+        managers={"checker": Manager("checker", "checker")},
+        executables={"foo": Executable("foo", executable_digest)},
+        input="input %s" % testcase_codename,
+        output="output %s" % testcase_codename,
+        time_limit=1.0,
+        memory_limit=256 * 1024 * 1024,
+        info="evaluate on %s" % testcase_codename,
+        **kwargs)
+
+
+class TestJobGroup(unittest.TestCase):
+
+    @staticmethod
+    def round_trip(job_group):
+        # Go through JSON, as the RPC does.
+        data = json.dumps(job_group.export_to_dict())
+        return json.loads(data), JobGroup.import_from_dict(json.loads(data))
+
+    def assertSameJobs(self, jobs, other_jobs):
+        self.assertEqual([job.export_to_dict() for job in jobs],
+                         [job.export_to_dict() for job in other_jobs])
+
+    def test_multi_testcase(self):
+        jobs = [evaluation_job("%03d" % i) for i in range(10)]
+        jobs[3].success = True
+        jobs[3].outcome = "1.0"
+        data, job_group = self.round_trip(JobGroup(jobs))
+
+        self.assertEqual(len(data["jobs"]), 1)
+        self.assertEqual(data["jobs"][0]["type"], "multi_evaluation")
+        self.assertEqual(len(data["jobs"][0]["testcases"]), 10)
+        self.assertSameJobs(job_group.jobs, jobs)
+
+    def test_different_executables(self):
+        jobs = [evaluation_job("001"), evaluation_job("002"),
+                evaluation_job("003", executable_digest="exe2"),
+                evaluation_job("004", executable_digest="exe2")]
+        data, job_group = self.round_trip(JobGroup(jobs))
+
+        self.assertEqual([len(job["testcases"]) for job in data["jobs"]],
+                         [2, 2])
+        self.assertSameJobs(job_group.jobs, jobs)
+
+    def test_mixed(self):
+        jobs = [CompilationJob(operation=ESOperation(
+                    ESOperation.COMPILATION, 1, 2), language="C11 / gcc"),
+                evaluation_job("001"),
+                evaluation_job("002", get_output=True),
+                evaluation_job("003", get_output=True),
+                evaluation_job("004")]
+        data, job_group = self.round_trip(JobGroup(jobs))
+
+        self.assertEqual([job["type"] for job in data["jobs"]],
+                         ["compilation", "evaluation", "multi_evaluation",
+                          "evaluation"])
+        self.assertSameJobs(job_group.jobs, jobs)
+
+
+if __name__ == "__main__":
+    unittest.main()
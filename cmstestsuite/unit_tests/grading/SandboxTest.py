@@ -20,9 +20,15 @@
 """Tests for general utility functions."""
 
 import io
+import os
+import shutil
+import tempfile
 import unittest
+from unittest.mock import Mock
 
-from cms.grading.Sandbox import Truncator
+import gevent
+
+from cms.grading.Sandbox import IsolateBoxPool, IsolateSandbox, Truncator
 
 
 class TestTruncator(unittest.TestCase):
@@ -62,5 +68,99 @@ class TestTruncator(unittest.TestCase):
         self.perform_truncator_test(100, 40, 7)
 
 
+class TestUnlinkFromCache(unittest.TestCase):
+    """Test that files linked from the cache are unshared."""
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cached = os.path.join(self.temp_dir, "cached")
+        self.linked = os.path.join(self.temp_dir, "linked")
+        with open(self.cached, "wb") as f:
+            f.write(b"content")
+        os.chmod(self.cached, 0o555)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_linked_file(self):
+        os.link(self.cached, self.linked)
+        IsolateSandbox._unlink_from_cache(self.linked)
+        os.chmod(self.linked, 0o722)
+        self.assertEqual(os.stat(self.cached).st_mode & 0o777, 0o555)
+        self.assertEqual(os.stat(self.cached).st_nlink, 1)
+        with open(self.linked, "rb") as f:
+            self.assertEqual(f.read(), b"content")
+
+    def test_private_file(self):
+        ino = os.stat(self.cached).st_ino
+        IsolateSandbox._unlink_from_cache(self.cached)
+        self.assertEqual(os.stat(self.cached).st_ino, ino)
+
+    def test_allow_writing_none(self):
+        # The home of the sandbox is the temporary directory, holding
+        # the cache file and a link to it, plus a private file.
+        os.link(self.cached, self.linked)
+        private = os.path.join(self.temp_dir, "private")
+        open(private, "wb").close()
+        os.chmod(private, 0o777)
+        sandbox = Mock()
+        sandbox._home = self.temp_dir
+        sandbox._is_linked_from_cache = IsolateSandbox._is_linked_from_cache
+        IsolateSandbox.allow_writing_none(sandbox)
+        self.assertEqual(os.stat(self.cached).st_mode & 0o777, 0o555)
+        self.assertEqual(os.stat(private).st_mode & 0o777, 0o755)
+
+
+class TestBoxRanges(unittest.TestCase):
+    """Test the ranges of box ids of the Workers."""
+    def tearDown(self):
+        IsolateSandbox.set_job_slots(1)
+
+    def test_one_slot(self):
+        IsolateSandbox.set_job_slots(1)
+        self.assertEqual(IsolateSandbox._first_box_id(0, 0), 10)
+        self.assertEqual(IsolateSandbox._first_box_id(3, 0), 40)
+
+    def test_disjoint(self):
+        IsolateSandbox.set_job_slots(3)
+        first_ids = [IsolateSandbox._first_box_id(shard, slot)
+                     for shard in range(4) for slot in range(3)]
+        self.assertEqual(first_ids, list(range(10, 130, 10)))
+
+
+class TestIsolateBoxPool(unittest.TestCase):
+    """Test the class IsolateBoxPool."""
+    def setUp(self):
+        self.pool = IsolateBoxPool([10, 11])
+
+    @staticmethod
+    def fake_sandbox(box_id):
+        sandbox = Mock()
+        sandbox.box_id = box_id
+        return sandbox
+
+    def test_acquire_unused(self):
+        self.assertEqual(self.pool.acquire(), (10, False))
+        self.assertEqual(self.pool.acquire(), (11, False))
+        self.assertEqual(self.pool.acquire(), (None, False))
+
+    def test_release(self):
+        box_id, _ = self.pool.acquire()
+        sandbox = self.fake_sandbox(box_id)
+        self.pool.release(sandbox, True)
+        gevent.sleep(0)
+        sandbox._cleanup.assert_called_once_with(delete=True)
+        sandbox.initialize_isolate.assert_called_once_with()
+        self.assertEqual(self.pool.acquire(), (10, True))
+
+    def test_release_failure(self):
+        box_id, _ = self.pool.acquire()
+        sandbox = self.fake_sandbox(box_id)
+        sandbox.initialize_isolate.side_effect = OSError
+        self.pool.release(sandbox, False)
+        gevent.sleep(0)
+        self.assertEqual(self.pool.acquire(), (11, False))
+        self.assertEqual(self.pool.acquire(), (10, False))
+
+
 if __name__ == "__main__":
     unittest.main()
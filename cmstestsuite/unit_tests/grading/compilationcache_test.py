@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the compilation cache."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from cms.db import Executable, File, Manager
+from cms.grading.Job import CompilationJob
+from cms.grading.Sandbox import Sandbox
+from cms.grading.compilationcache import CompilationCache
+
+
+LANGUAGE = "C++17 / g++"
+
+
+def make_job(file_digest="d_foo", grader_digest="d_grader",
+             checker_digest="d_checker", compilation="grader",
+             keep_sandbox=False):
+    return CompilationJob(
+        task_type="Batch",
+        task_type_parameters=[compilation, ["", ""], "comparator"],
+        language=LANGUAGE,
+        keep_sandbox=keep_sandbox,
+        files={"foo.%l": File("foo.%l", file_digest)},
+        managers={"grader.cpp": Manager("grader.cpp", grader_digest),
+                  "checker": Manager("checker", checker_digest)})
+
+
+def execute(job, compilation_success=True,
+            exit_status=Sandbox.EXIT_OK):
+    job.success = True
+    job.compilation_success = compilation_success
+    job.text = ["Compilation succeeded"]
+    job.plus = {"exit_status": exit_status, "execution_time": 1.0}
+    if compilation_success:
+        job.executables["foo"] = Executable("foo", "d_exe")
+
+
+class TestCompilationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = CompilationCache(self.path)
+        self.file_cacher = Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def store(self, job, **kwargs):
+        execute(job, **kwargs)
+        self.cache.store_job(job)
+
+    def assertHit(self, job):
+        self.assertTrue(self.cache.fill_job(job, self.file_cacher))
+
+    def assertMiss(self, job):
+        self.assertFalse(self.cache.fill_job(job, self.file_cacher))
+
+    def test_hit(self):
+        stored = make_job()
+        self.store(stored)
+
+        job = make_job()
+        self.assertHit(job)
+        self.assertTrue(job.success)
+        self.assertTrue(job.compilation_success)
+        self.assertEqual(job.text, stored.text)
+        self.assertEqual(job.plus, stored.plus)
+        self.assertEqual(job.executables.keys(), {"foo"})
+        self.assertEqual(job.executables["foo"].digest, "d_exe")
+        self.file_cacher.get_size.assert_called_once_with("d_exe")
+
+    def test_miss_empty(self):
+        self.assertMiss(make_job())
+
+    def test_miss_different_inputs(self):
+        self.store(make_job())
+        self.assertMiss(make_job(file_digest="d_foo2"))
+        self.assertMiss(make_job(grader_digest="d_grader2"))
+        self.assertMiss(make_job(compilation="alone"))
+
+    def test_hit_different_unused_managers(self):
+        self.store(make_job())
+        # The checker is not used in the compilation.
+        self.assertHit(make_job(checker_digest="d_checker2"))
+
+    def test_compilation_failure(self):
+        self.store(make_job(), compilation_success=False,
+                   exit_status=Sandbox.EXIT_NONZERO_RETURN)
+        job = make_job()
+        self.assertHit(job)
+        self.assertFalse(job.compilation_success)
+        self.assertEqual(job.executables, {})
+
+    def test_timeout_not_stored(self):
+        self.store(make_job(), compilation_success=False,
+                   exit_status=Sandbox.EXIT_TIMEOUT)
+        self.assertMiss(make_job())
+
+    def test_signal_not_stored(self):
+        self.store(make_job(), compilation_success=False,
+                   exit_status=Sandbox.EXIT_SIGNAL)
+        self.assertMiss(make_job())
+
+    def test_miss_different_limits(self):
+        self.store(make_job(), compilation_success=False,
+                   exit_status=Sandbox.EXIT_NONZERO_RETURN)
+        with patch("cms.grading.compilationcache.config."
+                   "compilation_sandbox_max_memory_kib", 1024 * 1024):
+            self.assertMiss(make_job())
+
+    def test_eviction(self):
+        self.cache = CompilationCache(self.path, max_entries=10)
+        for i in range(10):
+            job = make_job(file_digest="d_%d" % i)
+            self.store(job)
+            # Make the entries distinguishable by modification time.
+            os.utime(self.cache._entry_path(self.cache._key(job)), (i, i))
+        self.assertEqual(len(os.listdir(self.path)), 10)
+        # Using the first entry makes it the most recently used one.
+        self.assertHit(make_job(file_digest="d_0"))
+        self.store(make_job(file_digest="d_10"))
+        self.assertEqual(len(os.listdir(self.path)), 9)
+        self.assertHit(make_job(file_digest="d_0"))
+        self.assertHit(make_job(file_digest="d_10"))
+        self.assertMiss(make_job(file_digest="d_1"))
+
+    def test_sandbox_failure_not_stored(self):
+        job = make_job()
+        job.success = False
+        self.cache.store_job(job)
+        self.assertMiss(make_job())
+
+    def test_keep_sandbox(self):
+        self.store(make_job(keep_sandbox=True))
+        self.assertMiss(make_job(keep_sandbox=True))
+        self.assertMiss(make_job())
+
+    def test_executable_deleted(self):
+        self.store(make_job())
+        self.file_cacher.get_size.side_effect = KeyError
+        job = make_job()
+        self.assertMiss(job)
+        self.assertIsNone(job.success)
+        self.assertEqual(job.executables, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -157,6 +157,63 @@ class TestGroupMin(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(gmin.compute_score(sr),
                                 s2 + s3 * 0.1, 0.0, [0, s2, s3 * 0.1])
 
+    def test_compute_score_columns(self):
+        parameters = [[10.5, "1_*"], [30.5, "2_*"], [59, "3_*"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+        sr = self.get_submission_result(self._public_testcases)
+        self.assertSameScoreWithColumns(gmin, sr)
+        self.set_outcome(sr, "3_1", 0.0)
+        self.assertSameScoreWithColumns(gmin, sr)
+        self.set_outcome(sr, "3_0", 0.5)
+        self.assertSameScoreWithColumns(gmin, sr)
+
+    def test_irrelevant_testcases(self):
+        parameters = [[10, "1_*"], [30, "2_*"], [60, "3_*"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+
+        self.assertEqual(gmin.irrelevant_testcases({}), set())
+        # A partial outcome can still be lowered.
+        self.assertEqual(gmin.irrelevant_testcases({"1_0": 0.5}), set())
+        self.assertEqual(
+            gmin.irrelevant_testcases({"1_0": 0.0, "2_0": 1.0}), {"1_1"})
+        self.assertEqual(
+            gmin.irrelevant_testcases({"1_0": 0.0, "3_1": 0.0}),
+            {"1_1", "3_0"})
+
+    def test_compute_score_without_irrelevant_testcases(self):
+        s1, s2, s3 = 10.5, 30.5, 59
+        parameters = [[s1, "1_*"], [s2, "2_*"], [s3, "3_*"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+        sr = self.get_submission_result(self._public_testcases)
+        self.set_outcome(sr, "3_1", 0.0)
+        irrelevant = gmin.irrelevant_testcases(
+            {"3_1": 0.0, "1_0": 1.0, "1_1": 1.0, "2_0": 1.0, "2_1": 1.0})
+        self.assertEqual(irrelevant, {"3_0"})
+        sr.evaluations = [evaluation for evaluation in sr.evaluations
+                          if evaluation.codename not in irrelevant]
+
+        score = gmin.compute_score(sr)
+        self.assertComputeScore(score, s1 + s2, s1, [s1, s2, 0])
+        # The missing testcase has no outcome in the details.
+        self.assertEqual(score[1][2]["testcases"][0], {"idx": "3_0"})
+
+        # Without a failed testcase, the subtask needs all of them.
+        self.set_outcome(sr, "3_1", 1.0)
+        with self.assertRaises(ValueError):
+            gmin.compute_score(sr)
+
+    def test_irrelevant_testcases_overlapping_subtasks(self):
+        parameters = [[10, "1_*"], [90, ".*_1"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+
+        # 1_1 is still relevant for the second subtask; the testcases
+        # not in any subtask never are.
+        self.assertEqual(gmin.irrelevant_testcases({"1_0": 0.0}),
+                         {"2_0", "3_0"})
+        self.assertEqual(
+            gmin.irrelevant_testcases({"1_0": 0.0, "2_1": 0.0}),
+            {"1_1", "2_0", "3_0", "3_1"})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -157,6 +157,23 @@ class TestGroupMul(ScoreTypeTestMixin, unittest.TestCase):
                                 s2 + s3 * 0.5 * 0.1, 0.0,
                                 [0, s2, s3 * 0.5 * 0.1])
 
+    def test_compute_score_columns(self):
+        parameters = [[10.5, "1_*"], [30.5, "2_*"], [59, "3_*"]]
+        gmul = GroupMul(parameters, self._public_testcases)
+        sr = self.get_submission_result(self._public_testcases)
+        self.assertSameScoreWithColumns(gmul, sr)
+        self.set_outcome(sr, "3_1", 0.1)
+        self.assertSameScoreWithColumns(gmul, sr)
+        self.set_outcome(sr, "1_0", 0.0)
+        self.assertSameScoreWithColumns(gmul, sr)
+
+    def test_irrelevant_testcases(self):
+        parameters = [[10, "1_*"], [30, "2_*"], [60, "3_*"]]
+        gmul = GroupMul(parameters, self._public_testcases)
+
+        self.assertEqual(gmul.irrelevant_testcases({"1_0": 0.5}), set())
+        self.assertEqual(gmul.irrelevant_testcases({"1_0": 0.0}), {"1_1"})
+
 
 if __name__ == "__main__":
     unittest.main()
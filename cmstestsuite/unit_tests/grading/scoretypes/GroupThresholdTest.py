@@ -173,6 +173,37 @@ class TestGroupThreshold(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(st.compute_score(sr),
                                 s2, 0.0, [0, s2, 0])
 
+    def test_compute_score_columns(self):
+        parameters = [[10.5, "1_*", 10],
+                      [30.5, "2_*", 20],
+                      [59, "3_*", 30]]
+        st = GroupThreshold(parameters, self._public_testcases)
+        sr = self.get_submission_result(self._public_testcases)
+        self.assertSameScoreWithColumns(st, sr)
+        self.set_outcome(sr, "3_1", 100.5)
+        self.assertSameScoreWithColumns(st, sr)
+        self.set_outcome(sr, "1_0", 0.0)
+        self.assertSameScoreWithColumns(st, sr)
+
+    def test_irrelevant_testcases(self):
+        parameters = [[10, "1_*", 100], [30, "2_*", 100], [60, "3_*", 100]]
+        gthreshold = GroupThreshold(parameters, self._public_testcases)
+
+        self.assertEqual(gthreshold.irrelevant_testcases({"1_0": 50}),
+                         set())
+        # Outcomes out of (0, threshold] fail the subtask.
+        self.assertEqual(gthreshold.irrelevant_testcases({"1_0": 0.0}),
+                         {"1_1"})
+        self.assertEqual(gthreshold.irrelevant_testcases({"2_1": 101}),
+                         {"2_0"})
+
+    def test_irrelevant_testcases_not_in_subtasks(self):
+        parameters = [[10, "1_*", 100], [90, "2_*", 100]]
+        gthreshold = GroupThreshold(parameters, self._public_testcases)
+
+        self.assertEqual(gthreshold.irrelevant_testcases({}),
+                         {"3_0", "3_1"})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -79,5 +79,13 @@ class TestSum(ScoreTypeTestMixin, unittest.TestCase):
                                 testcase_score * 2.2, testcase_score * 0.2, [])
 
 
+    def test_compute_score_columns(self):
+        st = Sum(10.5, self._public_testcases)
+        sr = self.get_submission_result(self._public_testcases)
+        self.assertSameScoreWithColumns(st, sr)
+        self.set_outcome(sr, "1", 0.2)
+        self.assertSameScoreWithColumns(st, sr)
+
+
 if __name__ == "__main__":
     unittest.main()
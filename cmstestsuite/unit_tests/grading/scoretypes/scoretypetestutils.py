@@ -20,6 +20,8 @@
 
 from unittest.mock import Mock
 
+from cms.grading.scoretypes import SubmissionResultColumns
+
 
 class ScoreTypeTestMixin:
     """A test mixin to make it easier to test score types."""
@@ -39,6 +41,23 @@ class ScoreTypeTestMixin:
             for codename in reversed(sorted(testcases.keys()))]
         return sr
 
+    @staticmethod
+    def get_columns(sr):
+        """Return the columnar view of a submission result, with the
+        outcomes as strings, as they are in the database.
+
+        """
+        columns = SubmissionResultColumns(1, 1, sr.evaluated())
+        for evaluation in sr.evaluations:
+            columns.append(evaluation.codename, str(evaluation.outcome),
+                           evaluation.text, evaluation.execution_time,
+                           evaluation.execution_memory)
+        return columns
+
+    def assertSameScoreWithColumns(self, score_type, sr):
+        self.assertEqual(score_type.compute_score(self.get_columns(sr)),
+                         score_type.compute_score(sr))
+
     @staticmethod
     def get_evaluation(codename, outcome):
         evaluation = Mock()
@@ -22,11 +22,15 @@
 
 import unittest
 from datetime import timedelta
+from unittest.mock import patch
 
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
-from cms.grading.scoring import task_score
+from cms.db import ParticipationTaskScore
+from cms.grading.scoring import task_score, get_task_scores, \
+    get_all_task_scores, update_task_scores, update_all_task_scores, \
+    invalidate_task_scores, TaskScores
 from cmscommon.constants import \
     SCORE_MODE_MAX, SCORE_MODE_MAX_SUBTASK, SCORE_MODE_MAX_TOKENED_LAST
 from cmscommon.datetime import make_datetime
@@ -382,5 +386,118 @@ class TestTaskScoreMax(TaskScoreMixin, unittest.TestCase):
         self.assertEqual(self.call(rounded=True), (44.44, False))
 
 
+class TestTaskScoresCache(TaskScoreMixin, unittest.TestCase):
+    """Tests for the cached scores of the participations on the tasks."""
+
+    def setUp(self):
+        super().setUp()
+        self.task.score_mode = SCORE_MODE_MAX_TOKENED_LAST
+        self.add_result(self.at(1), 44.4, tokened=True, public_score=4.4)
+        self.add_result(self.at(2), 66.6, tokened=False, public_score=6.6)
+        self.session.flush()
+        self.key = (self.participation.id, self.task.id)
+
+    def update(self):
+        update_task_scores(self.session, [self.key])
+
+    def get(self, rounded=False):
+        return get_task_scores(self.session, self.participation, self.task,
+                               rounded=rounded)
+
+    def assertCached(self, expected):
+        # The submissions are not looked at.
+        with patch("cms.grading.scoring._load_submission_scores",
+                   side_effect=AssertionError):
+            self.assertEqual(self.get(), expected)
+
+    def test_update(self):
+        self.update()
+        row = self.session.query(ParticipationTaskScore).one()
+        self.assertEqual(row.dataset_id, self.task.active_dataset_id)
+        self.assertEqual(row.score_mode, SCORE_MODE_MAX_TOKENED_LAST)
+        self.assertCached(TaskScores(66.6, 6.6, 44.4, False))
+
+        # And again, after a new submission.
+        self.add_submission(participation=self.participation,
+                            task=self.task, timestamp=self.at(3))
+        self.update()
+        self.assertEqual(self.session.query(ParticipationTaskScore).count(),
+                         1)
+        self.assertCached(TaskScores(44.4, 4.4, 44.4, True))
+
+    def test_not_cached(self):
+        self.assertEqual(self.get(), TaskScores(66.6, 6.6, 44.4, False))
+
+    def test_not_cached_ignored_submissions(self):
+        # The results on other datasets, and the unofficial submissions,
+        # are not considered.
+        submission = self.add_submission(participation=self.participation,
+                                         task=self.task, timestamp=self.at(3))
+        other_dataset = self.add_dataset(task=self.task)
+        self.add_submission_result(submission, other_dataset,
+                                   score=100.0, public_score=100.0,
+                                   score_details=[], public_score_details=[],
+                                   ranking_score_details=[])
+        self.add_submission(participation=self.participation, task=self.task,
+                            timestamp=self.at(4), official=False)
+        self.assertEqual(self.get(), TaskScores(44.4, 4.4, 44.4, True))
+
+    def test_rounded(self):
+        self.update()
+        self.task.score_precision = 0
+        self.assertEqual(self.get(rounded=True),
+                         TaskScores(67.0, 7.0, 44.0, False))
+
+    def test_invalidated(self):
+        self.update()
+        invalidate_task_scores(self.session, [self.key])
+        self.assertIsNone(
+            self.session.query(ParticipationTaskScore).one().dataset_id)
+        self.assertEqual(self.get(), TaskScores(66.6, 6.6, 44.4, False))
+
+    def test_changed_task(self):
+        self.update()
+        # Another score mode...
+        self.task.score_mode = SCORE_MODE_MAX
+        self.add_result(self.at(3), 55.5, tokened=False, public_score=5.5)
+        self.assertEqual(self.get(), TaskScores(66.6, 6.6, 44.4, False))
+        # ...or dataset make the cached scores useless.
+        self.task.score_mode = SCORE_MODE_MAX_TOKENED_LAST
+        self.update()
+        self.assertCached(TaskScores(55.5, 5.5, 44.4, False))
+        self.task.active_dataset = self.add_dataset(task=self.task)
+        self.assertEqual(self.get(), TaskScores(0.0, 0.0, 0.0, True))
+
+    def test_update_all(self):
+        other_participation = self.add_participation(
+            contest=self.participation.contest)
+        self.session.flush()
+        update_task_scores(self.session,
+                           [(other_participation.id, self.task.id)])
+        # After a change of dataset, all the stored scores are
+        # computed again.
+        self.task.active_dataset = self.add_dataset(task=self.task)
+        update_all_task_scores(self.session, self.task)
+        rows = self.session.query(ParticipationTaskScore).all()
+        self.assertCountEqual(
+            [(row.participation_id, row.dataset_id) for row in rows],
+            [(self.participation.id, self.task.active_dataset.id),
+             (other_participation.id, self.task.active_dataset.id)])
+        self.assertCached(TaskScores(0.0, 0.0, 0.0, True))
+
+    def test_all(self):
+        self.update()
+        other_participation = self.add_participation(
+            contest=self.participation.contest)
+        self.session.flush()
+        self.assertEqual(
+            get_all_task_scores(self.session,
+                                [self.participation, other_participation],
+                                [self.task]),
+            {self.key: TaskScores(66.6, 6.6, 44.4, False),
+             (other_participation.id, self.task.id):
+             TaskScores(0.0, 0.0, 0.0, False)})
+
+
 if __name__ == "__main__":
     unittest.main()
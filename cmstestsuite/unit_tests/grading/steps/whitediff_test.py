@@ -18,12 +18,42 @@
 
 """Tests for whitediff.py."""
 
+import logging
+import random
+import time
 import unittest
 from io import BytesIO
+from unittest.mock import patch
 
 from cms.grading.steps import _WHITES, _white_diff
 
 
+logger = logging.getLogger(__name__)
+
+
+def _line_white_diff(output, res):
+    """The original line-based white diff, used as a reference."""
+    def canonicalize(string):
+        for char in _WHITES[1:]:
+            string = string.replace(char, _WHITES[0])
+        return _WHITES[0].join(
+            [x for x in string.split(_WHITES[0]) if len(x) > 0])
+
+    while True:
+        lout = output.readline()
+        lres = res.readline()
+        if len(lres) == 0 and len(lout) == 0:
+            return True
+        elif len(lres) == 0 or len(lout) == 0:
+            lout = lout.strip(b''.join(_WHITES))
+            lres = lres.strip(b''.join(_WHITES))
+            if len(lout) > 0 or len(lres) > 0:
+                return False
+        else:
+            if canonicalize(lout) != canonicalize(lres):
+                return False
+
+
 class TestWhiteDiff(unittest.TestCase):
 
     WHITES_STR = "".join(c.decode('utf-8') for c in _WHITES)
@@ -67,6 +97,93 @@ class TestWhiteDiff(unittest.TestCase):
         self.assertFalse(self._diff("1 2", "1\n2"))
         self.assertFalse(self._diff("1\n\n2", "1\n2"))
 
+    def test_diff_long_line(self):
+        line = " ".join(str(i) for i in range(300000))
+        self.assertTrue(self._diff(line, line.replace(" ", " \t ")))
+        self.assertFalse(self._diff(line, line.replace(" 1 ", " 1\n")))
+
+
+class TestWhiteDiffEquivalence(unittest.TestCase):
+    """Check that the white diff agrees with the line-based one."""
+
+    ALPHABET = [b"a", b"b", b"1"] + _WHITES + [b"\n"] * 3
+
+    def setUp(self):
+        self.random = random.Random(42)
+
+    def _random_output(self, length):
+        return b"".join(self.random.choice(self.ALPHABET)
+                        for _ in range(length))
+
+    def _perturb(self, s):
+        s = bytearray(s)
+        for _ in range(self.random.randint(1, 3)):
+            if len(s) == 0:
+                break
+            pos = self.random.randrange(len(s))
+            if s[pos:pos + 1] in _WHITES:
+                s[pos:pos + 1] = self.random.choice(_WHITES) * \
+                    self.random.randint(0, 2)
+            else:
+                s[pos:pos + 1] = self.random.choice(self.ALPHABET)
+        return bytes(s)
+
+    def _assert_equivalent(self, s1, s2):
+        self.assertEqual(_white_diff(BytesIO(s1), BytesIO(s2)),
+                         _line_white_diff(BytesIO(s1), BytesIO(s2)),
+                         (s1, s2))
+
+    def _check_random(self):
+        for _ in range(2000):
+            s1 = self._random_output(self.random.randint(0, 20))
+            s2 = self._perturb(s1)
+            self._assert_equivalent(s1, s2)
+            self._assert_equivalent(s2, s1)
+
+    def test_equivalence(self):
+        self._check_random()
+
+    def test_equivalence_small_blocks(self):
+        # Make every whitespace run and token cross block boundaries.
+        for block_size in [1, 2, 3, 7]:
+            with patch("cms.grading.steps.whitediff._BLOCK_SIZE",
+                       block_size):
+                self._check_random()
+
+
+class TestWhiteDiffBenchmark(unittest.TestCase):
+    """Compare the white diff with the line-based one on a large
+    output. The timings are only logged for reference, as asserting on
+    them would make the test depend on the load of the machine.
+
+    """
+
+    def _time(self, diff, s1, s2):
+        start = time.perf_counter()
+        result = diff(BytesIO(s1), BytesIO(s2))
+        return result, time.perf_counter() - start
+
+    def test_benchmark(self):
+        rnd = random.Random(42)
+        lines = [b" ".join(b"%d" % rnd.randint(0, 10 ** 9)
+                           for _ in range(rnd.randint(1, 20)))
+                 for _ in range(100000)]
+        s1 = b"\n".join(lines) + b"\n"
+        s2 = b"\n".join(l.replace(b" ", b"  \t") + b" \r"
+                        for l in lines) + b"\n\n"
+
+        result, streaming = self._time(_white_diff, s1, s2)
+        self.assertTrue(result)
+        result, line_based = self._time(_line_white_diff, s1, s2)
+        self.assertTrue(result)
+        logger.info("White diff on %d bytes: %.3fs streaming, %.3fs "
+                    "line-based.", len(s1) + len(s2), streaming, line_based)
+
+        # A difference near the end is found by both.
+        s3 = s2[:-100] + b"x" + s2[-99:]
+        self.assertFalse(_white_diff(BytesIO(s1), BytesIO(s3)))
+        self.assertFalse(_line_white_diff(BytesIO(s1), BytesIO(s3)))
+
 
 if __name__ == "__main__":
     unittest.main()
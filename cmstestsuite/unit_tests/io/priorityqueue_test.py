@@ -73,6 +73,20 @@ class TestPriorityQueue(unittest.TestCase):
         with self.assertRaises(LookupError):
             self.queue.pop()
 
+    def test_rank(self):
+        """Test that the rank is used instead of the timestamp."""
+        self.queue.push(self.item_a, PriorityQueue.PRIORITY_MEDIUM,
+                        timestamp=make_datetime(5), rank=2)
+        self.queue.push(self.item_b, PriorityQueue.PRIORITY_MEDIUM,
+                        timestamp=make_datetime(10), rank=1)
+        self.queue.push(self.item_c, PriorityQueue.PRIORITY_HIGH,
+                        timestamp=make_datetime(15), rank=3)
+        self.assertTrue(self.queue._verify())
+
+        self.assertEqual(self.queue.pop().item, self.item_c)
+        self.assertEqual(self.queue.pop().item, self.item_b)
+        self.assertEqual(self.queue.pop().item, self.item_a)
+
     def test_set_priority(self):
         """Test that priority get changed and item moved."""
         self.queue.push(self.item_a, PriorityQueue.PRIORITY_LOW)
@@ -81,7 +95,9 @@ class TestPriorityQueue(unittest.TestCase):
         self.queue.push(self.item_c, PriorityQueue.PRIORITY_MEDIUM,
                         timestamp=make_datetime(5))
 
-        self.queue.set_priority(self.item_a, PriorityQueue.PRIORITY_HIGH)
+        self.assertEqual(
+            self.queue.set_priority(self.item_a, PriorityQueue.PRIORITY_HIGH),
+            PriorityQueue.PRIORITY_LOW)
         self.assertTrue(self.queue._verify())
         self.assertEqual(self.queue.top().item, self.item_a)
 
@@ -23,7 +23,9 @@
 """
 
 import socket
+import struct
 import unittest
+import zlib
 from unittest.mock import Mock, patch
 
 import gevent
@@ -34,6 +36,7 @@ from gevent.server import StreamServer
 from cms import Address, ServiceCoord
 from cms.io import RPCError, rpc_method, RemoteServiceServer, \
     RemoteServiceClient
+from cms.io.rpc import SERIALIZERS
 
 
 class MockService:
@@ -429,6 +432,140 @@ class TestRPC(unittest.TestCase):
         self.assertFalse(self.servers[0].connected)
         sock.close()
 
+    def test_protocol_upgrade(self):
+        client = self.get_client(ServiceCoord("Foo", 0))
+        result = client.echo(value=[1, "a", None])
+        result.wait()
+        self.assertEqual(result.value, [1, "a", None])
+        self.assertTrue(client._framed)
+        self.assertTrue(self.servers[0]._framed)
+        self.assertEqual(client._compression, "zlib")
+
+    def test_compression(self):
+        client = self.get_client(ServiceCoord("Foo", 0))
+        value = "x" * (10 * RemoteServiceClient.MAX_MESSAGE_SIZE // 11)
+        with patch("cms.io.rpc.zlib.compress",
+                   wraps=zlib.compress) as compress:
+            result = client.echo(value=value)
+            result.wait()
+        self.assertEqual(result.value, value)
+        # Both the request and the response were compressed.
+        self.assertEqual(compress.call_count, 2)
+
+    def test_old_server(self):
+        # A server not knowing the negotiation answers with an error,
+        # and the connection keeps using JSON lines.
+        with patch.object(RemoteServiceServer, "_negotiate",
+                          return_value=False):
+            client = self.get_client(ServiceCoord("Foo", 0))
+            result = client.echo(value=True)
+            result.wait()
+        self.assertIs(result.value, True)
+        self.assertFalse(client._framed)
+        self.assertFalse(self.servers[0]._framed)
+
+    @unittest.skipUnless("msgpack" in SERIALIZERS, "msgpack not installed")
+    def test_msgpack(self):
+        with patch("cms.io.rpc.config.rpc_serializers", ["msgpack", "json"]):
+            client = self.get_client(ServiceCoord("Foo", 0))
+            result = client.echo(value={"a": [1, 2.5, "b"]})
+            result.wait()
+        self.assertEqual(result.value, {"a": [1, 2.5, "b"]})
+        self.assertIs(client._dumps, SERIALIZERS["msgpack"][0])
+
+    def test_batch(self):
+        client = self.get_client(ServiceCoord("Foo", 0))
+        with patch.object(RemoteServiceServer, "process_incoming_batch",
+                          autospec=True,
+                          side_effect=RemoteServiceServer
+                          .process_incoming_batch) as process_batch:
+            with client.batch():
+                results = [client.echo(value=i) for i in range(10)]
+                self.sleep()
+                # Nothing is sent until the end of the batch.
+                self.assertFalse(any(result.ready() for result in results))
+            for result in results:
+                result.wait()
+        self.assertEqual([result.value for result in results],
+                         list(range(10)))
+        process_batch.assert_called_once()
+
+    def test_batch_other_greenlets(self):
+        # The requests of other greenlets are not held by the batch.
+        client = self.get_client(ServiceCoord("Foo", 0))
+        with client.batch():
+            with client.batch():
+                result1 = client.echo(value=1)
+            other = gevent.spawn(lambda: client.echo(value=2).get())
+            self.assertEqual(other.get(timeout=1), 2)
+            self.assertFalse(result1.ready())
+        self.assertEqual(result1.get(timeout=1), 1)
+
+    def test_batch_errors(self):
+        client = self.get_client(ServiceCoord("Foo", 0))
+        with client.batch():
+            result1 = client.echo(value=1)
+            result2 = client.echo(value=RuntimeError())
+            result3 = client.raise_exception()
+            result4 = client.echo(value=4)
+        for result in [result1, result2, result3, result4]:
+            result.wait()
+        self.assertEqual(result1.value, 1)
+        self.assertIsInstance(result2.exception, RPCError)
+        self.assertIsInstance(result3.exception, RPCError)
+        self.assertEqual(result4.value, 4)
+
+    def test_batch_split(self):
+        # Requests too large to fit together are sent in more messages.
+        client = self.get_client(ServiceCoord("Foo", 0))
+        value = "x" * (RemoteServiceClient.MAX_MESSAGE_SIZE // 3)
+        with client.batch():
+            results = [client.echo(value=value) for _ in range(5)]
+        for result in results:
+            result.wait()
+            self.assertEqual(result.value, value)
+
+    def test_batch_old_server(self):
+        with patch.object(RemoteServiceServer, "_negotiate",
+                          return_value=False):
+            client = self.get_client(ServiceCoord("Foo", 0))
+            with client.batch():
+                results = [client.echo(value=i) for i in range(3)]
+            for result in results:
+                result.wait()
+        self.assertEqual([result.value for result in results], [0, 1, 2])
+
+    def test_batch_not_connected(self):
+        client = RemoteServiceClient(ServiceCoord("Foo", 0))
+        with client.batch():
+            result = client.echo(value=True)
+        self.assertIsInstance(result.exception, RPCError)
+
+    def negotiate_raw(self, sock):
+        sock.sendall(b'{"__id": "foo", "__method": "__negotiate_protocol", '
+                     b'"__data": {"serializers": ["json"], '
+                     b'"compressions": ["zlib"]}}\r\n')
+        self.sleep()
+
+    def test_send_frame_too_long(self):
+        sock = gevent.socket.create_connection((self.host, self.port))
+        self.negotiate_raw(sock)
+        sock.sendall(struct.pack(
+            "!IB", RemoteServiceServer.MAX_MESSAGE_SIZE + 1, 0))
+        self.sleep()
+        self.assertFalse(self.servers[0].connected)
+        sock.close()
+
+    def test_send_compressed_frame_too_long(self):
+        sock = gevent.socket.create_connection((self.host, self.port))
+        self.negotiate_raw(sock)
+        data = zlib.compress(
+            b" " * (RemoteServiceServer.MAX_MESSAGE_SIZE + 1))
+        sock.sendall(struct.pack("!IB", len(data), 1) + data)
+        self.sleep()
+        self.assertFalse(self.servers[0].connected)
+        sock.close()
+
 
 if __name__ == "__main__":
     unittest.main()
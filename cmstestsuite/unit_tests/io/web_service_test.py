@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the WSGI handler of the web services.
+
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import gevent.socket
+from gevent.pywsgi import WSGIServer
+from werkzeug.wrappers import Request, Response
+from werkzeug.wsgi import wrap_file
+
+from cms.io.web_service import SendfileWSGIHandler
+
+
+class TestSendfileWSGIHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.content = os.urandom(3 * 1024 * 1024 + 17)
+        fd, self.path = tempfile.mkstemp()
+        with open(fd, "wb") as f:
+            f.write(self.content)
+        # The length announced by the application.
+        self.content_length = len(self.content)
+
+        self.server = WSGIServer(("127.0.0.1", 0), self.app,
+                                 handler_class=SendfileWSGIHandler,
+                                 log=None)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        patcher = patch("cms.io.web_service.os.sendfile",
+                        wraps=os.sendfile)
+        self.sendfile = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def app(self, environ, start_response):
+        """Serve the file, as FileServerMiddleware does."""
+        request = Request(environ)
+        response = Response(
+            wrap_file(environ, open(self.path, "rb")),
+            mimetype="application/octet-stream",
+            direct_passthrough=True)
+        response.content_length = self.content_length
+        response.make_conditional(request, accept_ranges=True,
+                                  complete_length=self.content_length)
+        return response(environ, start_response)
+
+    def request(self, method="GET", headers=None, close=True):
+        """Send a request and read the response, until the server
+        closes the connection.
+
+        method (str): the method of the request.
+        headers ({str: str}|None): additional headers.
+        close (bool): whether to ask the server to close the
+            connection after the response.
+
+        return (int, {str: str}, bytes): the status code, the headers
+            (with lowercase names) and the body of the response.
+
+        """
+        sock = gevent.socket.create_connection(self.server.address)
+        sock.settimeout(5)
+        lines = ["%s / HTTP/1.1" % method, "Host: localhost"]
+        if close:
+            lines.append("Connection: close")
+        for name, value in (headers or {}).items():
+            lines.append("%s: %s" % (name, value))
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("ascii"))
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if chunk == b"":
+                break
+            data += chunk
+        sock.close()
+
+        head, body = data.split(b"\r\n\r\n", 1)
+        status_line, *header_lines = head.decode("ascii").split("\r\n")
+        headers = dict((name.lower(), value)
+                       for name, value in (line.split(": ", 1)
+                                           for line in header_lines))
+        return int(status_line.split(" ")[1]), headers, body
+
+    def test_whole_file(self):
+        code, headers, body = self.request()
+        self.assertEqual(code, 200)
+        self.assertEqual(headers["content-length"], str(len(self.content)))
+        self.assertNotIn("transfer-encoding", headers)
+        self.assertEqual(body, self.content)
+        # The file is sent in chunks, to let the other greenlets run.
+        self.assertGreaterEqual(
+            self.sendfile.call_count,
+            len(self.content) // SendfileWSGIHandler.SENDFILE_CHUNK_SIZE)
+
+    def test_head(self):
+        code, headers, body = self.request("HEAD")
+        self.assertEqual(code, 200)
+        self.assertEqual(headers["content-length"], str(len(self.content)))
+        self.assertEqual(body, b"")
+        self.sendfile.assert_not_called()
+
+    def test_range(self):
+        # Partial responses wrap the file again, and are sent as usual.
+        code, headers, body = self.request(
+            headers={"Range": "bytes=100-199"})
+        self.assertEqual(code, 206)
+        self.assertEqual(headers["content-length"], "100")
+        self.assertEqual(body, self.content[100:200])
+        self.sendfile.assert_not_called()
+
+    def test_file_shorter_than_announced(self):
+        self.content_length = len(self.content) + 1000
+        code, headers, body = self.request(close=False)
+        self.assertEqual(code, 200)
+        self.assertEqual(headers["content-length"],
+                         str(self.content_length))
+        # The server sends what there is and closes the connection,
+        # even if asked to keep it alive.
+        self.assertEqual(body, self.content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,7 +30,7 @@ from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
 from cms import config
 from cms.server.contest.authentication import validate_login, \
-    authenticate_request
+    authenticate_request, AuthenticationCache
 # Prefer build_password (which defaults to a plaintext method) over
 # hash_password (which defaults to bcrypt) as it is a lot faster.
 from cmscommon.crypto import build_password, hash_password
@@ -365,5 +365,71 @@ class TestAuthenticateRequest(DatabaseMixin, unittest.TestCase):
         self.assertSuccessAndCookieRefreshed()
 
 
+class TestAuthenticateRequestWithCache(TestAuthenticateRequest):
+    """Run the same tests, remembering the authentications."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = AuthenticationCache(60)
+
+    def attempt_authentication(self, **kwargs):
+        return authenticate_request(
+            self.session, self.contest,
+            kwargs.get("timestamp", self.timestamp),
+            kwargs.get("cookie", self.cookie),
+            ipaddress.ip_address(kwargs.get("ip_address", "10.0.0.1")),
+            cache=self.cache)
+
+    def test_ip_autologin_with_ambiguous_addresses(self):
+        self.contest.ip_autologin = True
+        self.contest.block_hidden_participations = True
+        self.participation.ip = [ipaddress.ip_network("10.0.0.1/32")]
+        other_participation = self.add_participation(
+            contest=self.contest, user=self.add_user(),
+            ip=[ipaddress.ip_network("10.0.0.1/32")], hidden=True)
+        self.assertSuccessAndCookieCleared()
+
+        # The cache does not know that the address became ambiguous...
+        self.contest.block_hidden_participations = False
+        self.assertSuccessAndCookieCleared()
+
+        # ...until AWS, that changed the contest, invalidates it.
+        self.cache.invalidate(self.contest.id)
+        self.assertFailure()
+
+        # The participations that would not authenticate anymore are
+        # never returned, though.
+        self.contest.block_hidden_participations = True
+        self.assertSuccessAndCookieCleared()
+        other_participation.hidden = False
+        self.participation.hidden = True
+        authenticated_participation, _ = self.attempt_authentication()
+        self.assertIs(authenticated_participation, other_participation)
+        self.assertEqual(self.cache.get_stats()["stale"], 1)
+
+    def test_hits(self):
+        self.contest.ip_autologin = False
+        self.contest.allow_password_authentication = True
+        self.assertSuccessAndCookieRefreshed()
+        self.assertSuccessAndCookieRefreshed()
+        self.assertEqual(self.cache.get_stats()["misses"], 1)
+        self.assertEqual(self.cache.get_stats()["hits"], 1)
+
+        # The cookies with the old password are rejected, and forgotten.
+        self.user.password = build_password("newpass")
+        self.assertFailure()
+        self.assertEqual(self.cache.get_stats()["stale"], 1)
+        self.assertFailure()
+        self.assertEqual(self.cache.get_stats()["misses"], 2)
+
+    def test_stale_entry(self):
+        self.contest.ip_autologin = False
+        self.contest.allow_password_authentication = True
+        self.assertSuccessAndCookieRefreshed()
+        self.session.delete(self.participation)
+        self.assertFailure()
+        self.assertEqual(self.cache.get_stats()["stale"], 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the events pushed to the contestants.
+
+"""
+
+import re
+import unittest
+from unittest.mock import patch
+
+import gevent
+
+from cms.server.contest.events import ContestEvents
+
+
+def parse(data):
+    """Return the ID and type of the events in a stream."""
+    return re.findall(r"id:([0-9a-f]+)\n(?:event:(\w+)\n)?", data.decode())
+
+
+class TestContestEvents(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.events = ContestEvents()
+
+    def connect(self, participation_id=10):
+        """Connect for the first time, returning the last event ID."""
+        ((id_, event),) = parse(self.events.wait(1, participation_id,
+                                                 None, 1))
+        self.assertEqual(event, "reset")
+        return id_
+
+    def test_first_connection(self):
+        id_ = self.connect()
+        # Nothing happened since.
+        self.assertEqual(self.events.wait(1, 10, id_, 0.01), b"")
+
+    def test_events(self):
+        id_ = self.connect()
+        self.events.send(1, [10], "communication")
+        self.events.send(1, [11], "submission")
+        self.events.send(2, [10], "submission")
+        self.events.send(1, None, "submission")
+        events = parse(self.events.wait(1, 10, id_, 1))
+        self.assertEqual([event for _, event in events],
+                         ["communication", "submission"])
+        # The next time, only the new ones.
+        self.assertEqual(self.events.wait(1, 10, events[-1][0], 0.01), b"")
+
+    def test_wait(self):
+        id_ = self.connect()
+        greenlet = gevent.spawn(self.events.wait, 1, 10, id_, 10)
+        gevent.sleep(0.01)
+        self.assertFalse(greenlet.ready())
+        self.events.send(1, None, "communication")
+        events = parse(greenlet.get(timeout=1))
+        self.assertEqual([event for _, event in events], ["communication"])
+
+    def test_unknown_client(self):
+        self.connect()
+        # A client with an ID from before the publisher existed (e.g.,
+        # before a restart) might have missed some events.
+        ((_, event),) = parse(self.events.wait(1, 10, "1", 1))
+        self.assertEqual(event, "reset")
+        ((_, event),) = parse(self.events.wait(1, 10, "invalid", 1))
+        self.assertEqual(event, "reset")
+
+    @patch.object(ContestEvents, "CACHE_SIZE", 2)
+    def test_dropped_events(self):
+        id_ = self.connect()
+        for _ in range(3):
+            self.events.send(1, [10], "communication")
+        ((_, event),) = parse(self.events.wait(1, 10, id_, 1))
+        self.assertEqual(event, "reset")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,7 @@
 
 import io
 import random
+import tempfile
 import unittest
 from unittest.mock import Mock
 
@@ -49,6 +50,7 @@ class TestFileByDigestMiddleware(unittest.TestCase):
 
         self.serve_file = True
         self.provide_filename = True
+        self.immutable = False
 
         self.wsgi_app = \
             FileServerMiddleware(self.file_cacher,self.wrapped_wsgi_app)
@@ -62,6 +64,8 @@ class TestFileByDigestMiddleware(unittest.TestCase):
             headers = {FileServerMiddleware.DIGEST_HEADER: self.digest}
             if self.provide_filename:
                 headers[FileServerMiddleware.FILENAME_HEADER] = self.filename
+            if self.immutable:
+                headers[FileServerMiddleware.IMMUTABLE_HEADER] = "1"
             return Response(headers=headers, mimetype=self.mimetype)
         else:
             return Response(b"some other content", mimetype="text/plain")
@@ -86,10 +90,42 @@ class TestFileByDigestMiddleware(unittest.TestCase):
         # self.assertGreater(response.cache_control.max_age, 0)  # It seems that "max_age" is None
         self.assertTrue(response.cache_control.private)
         self.assertFalse(response.cache_control.public)
+        self.assertTrue(response.cache_control.no_cache)
+        self.assertEqual(response.content_length, len(self.content))
         self.assertEqual(response.get_data(), self.content)
 
         self.file_cacher.get_file.assert_called_once_with(self.digest)
 
+    def test_immutable(self):
+        self.immutable = True
+
+        response = self.request()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(FileServerMiddleware.IMMUTABLE_HEADER,
+                         response.headers)
+        self.assertTrue(response.cache_control.private)
+        self.assertFalse(response.cache_control.no_cache)
+        self.assertEqual(response.cache_control.max_age,
+                         FileServerMiddleware.IMMUTABLE_MAX_AGE)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual(response.get_data(), self.content)
+
+    def test_size_from_file(self):
+        # A file on the filesystem gives its size without asking the
+        # backend.
+        with tempfile.TemporaryFile() as fobj:
+            fobj.write(self.content)
+            fobj.seek(0)
+            self.file_cacher.get_file.side_effect = lambda digest: fobj
+
+            response = self.request()
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content_length, len(self.content))
+            self.assertEqual(response.get_data(), self.content)
+        self.file_cacher.get_size.assert_not_called()
+
     def test_not_a_file(self):
         self.serve_file = False
 
@@ -127,6 +163,15 @@ class TestFileByDigestMiddleware(unittest.TestCase):
         response = self.request(headers=[("If-None-Match", self.digest)])
         self.assertEqual(response.status_code, 304)
         self.assertEqual(len(response.get_data()), 0)
+        self.assertTupleEqual(response.get_etag(), (self.digest, False))
+        # The file is not even looked for.
+        self.file_cacher.get_file.assert_not_called()
+
+    def test_conditional_request_multiple_etags(self):
+        response = self.request(headers=[
+            ("If-None-Match", "\"not the etag\", \"%s\"" % self.digest)])
+        self.assertEqual(response.status_code, 304)
+        self.file_cacher.get_file.assert_not_called()
 
     def test_conditional_request_no_match(self):
         # Test an etag that doesn't match.
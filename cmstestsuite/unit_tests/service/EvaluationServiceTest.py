@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the EvaluationService."""
+
+# We enable monkey patching to make many libraries gevent-friendly
+# (for instance, urllib3, used by requests)
+import gevent.monkey
+gevent.monkey.patch_all()  # noqa
+
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms.db import Evaluation, SubmissionResult
+from cms.grading.Job import EvaluationJob
+from cms.io import PriorityQueue
+from cms.io.priorityqueue import QueueEntry
+from cms.service.EvaluationService import EvaluationService, Result
+from cms.service.esoperations import ESOperation
+from cmscommon.datetime import make_datetime
+
+
+def make_service(contest_id):
+    """Create an ES that does not execute the operations in its queue
+    nor sweeps the database by itself.
+
+    """
+    with patch("cms.io.triggeredservice.gevent.spawn"):
+        return EvaluationService(0, contest_id)
+
+
+class TestQueueSnapshot(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        for name, value in [("persist_queue", True),
+                            ("data_dir", self.data_dir)]:
+            patcher = patch("cms.service.EvaluationService.config." + name,
+                            value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.contest = self.add_contest()
+        task = self.add_task(contest=self.contest)
+        dataset = self.add_dataset(task=task)
+        submission = self.add_submission(task=task)
+        self.session.commit()
+        self.operations = [
+            ESOperation(ESOperation.EVALUATION, submission.id, dataset.id,
+                        codename)
+            for codename in ["1", "2", "3"]]
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+        super().tearDown()
+
+    def queued_operations(self, service):
+        return set(operation for operation, _, _
+                   in service.get_executor().get_operations())
+
+    def test_restore(self):
+        service = make_service(self.contest.id)
+        timestamp = make_datetime(1000)
+        for operation in self.operations:
+            service.get_executor().enqueue(
+                operation, PriorityQueue.PRIORITY_LOW, timestamp)
+        service.get_executor().dequeue(self.operations[2])
+        service._snapshot_queue()
+        service._snapshot_writer.get()
+
+        restored = make_service(self.contest.id)
+        entries = restored.get_executor().get_operations()
+        self.assertEqual(
+            entries,
+            [(operation, PriorityQueue.PRIORITY_LOW, timestamp)
+             for operation in self.operations[:2]])
+
+        # A full sweep drops the operations that are not needed.
+        restored._drop_stale_restored_operations({self.operations[0]})
+        self.assertEqual(self.queued_operations(restored),
+                         {self.operations[0]})
+
+    def test_other_contest(self):
+        service = make_service(self.contest.id)
+        service.get_executor().enqueue(
+            self.operations[0], PriorityQueue.PRIORITY_LOW, make_datetime())
+        service._snapshot_queue()
+        service._snapshot_writer.get()
+
+        restored = make_service(None)
+        self.assertEqual(self.queued_operations(restored), set())
+
+
+class TestParticipationIds(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.contest = self.add_contest()
+        self.participation = self.add_participation(contest=self.contest)
+        task = self.add_task(contest=self.contest)
+        dataset = self.add_dataset(task=task)
+        submission = self.add_submission(
+            task=task, participation=self.participation)
+        self.session.commit()
+        self.operation = ESOperation(ESOperation.EVALUATION, submission.id,
+                                     dataset.id, "1")
+
+    def test_fifo(self):
+        service = make_service(self.contest.id)
+        service._load_participation_ids(self.session, [self.operation])
+        self.assertEqual(service._participation_ids, {})
+
+    @patch("cms.service.EvaluationService.config.scheduling_policy", "fair")
+    def test_fair(self):
+        service = make_service(self.contest.id)
+        service._load_participation_ids(self.session, [self.operation])
+        self.assertEqual(service.get_participation_id(self.operation),
+                         self.participation.id)
+
+
+class TestWriteResults(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.contest = self.add_contest()
+        task = self.add_task(contest=self.contest)
+        self.dataset = self.add_dataset(task=task)
+        self.testcases = [self.add_testcase(self.dataset) for _ in range(3)]
+        self.submission = self.add_submission(task=task)
+        self.session.commit()
+        self.service = make_service(self.contest.id)
+
+    def result(self, testcase, success=True):
+        operation = ESOperation(ESOperation.EVALUATION, self.submission.id,
+                                self.dataset.id, testcase.codename)
+        job = EvaluationJob(
+            operation=operation, shard=1, sandboxes=["/tmp/box"],
+            success=success, outcome="1.0", text=["Output is correct"],
+            plus={"execution_time": 0.5, "execution_wall_clock_time": 0.6,
+                  "execution_memory": 1024})
+        return operation, Result(job, success)
+
+    def evaluations(self):
+        self.session.expire_all()
+        return self.session.query(Evaluation)\
+            .filter(Evaluation.submission_id == self.submission.id)\
+            .all()
+
+    def submission_result(self):
+        self.session.expire_all()
+        return SubmissionResult.get_from_id(
+            (self.submission.id, self.dataset.id), self.session)
+
+    def test_bulk(self):
+        self.add_submission_result(self.submission, self.dataset,
+                                   compilation_outcome="ok")
+        self.session.commit()
+
+        self.service.write_results(
+            [self.result(testcase) for testcase in self.testcases[:2]])
+        evaluations = self.evaluations()
+        self.assertEqual(len(evaluations), 2)
+        self.assertEqual(evaluations[0].outcome, "1.0")
+        self.assertEqual(evaluations[0].text, ["Output is correct"])
+        self.assertEqual(evaluations[0].execution_memory, 1024)
+        self.assertEqual(evaluations[0].evaluation_sandbox, "/tmp/box")
+        self.assertFalse(self.submission_result().evaluated())
+
+        # Results already written are ignored.
+        self.service.write_results(
+            [self.result(testcase) for testcase in self.testcases])
+        self.assertEqual(len(self.evaluations()), 3)
+        self.assertTrue(self.submission_result().evaluated())
+
+    def test_failures(self):
+        self.add_submission_result(self.submission, self.dataset,
+                                   compilation_outcome="ok")
+        self.session.commit()
+
+        self.service.write_results(
+            [self.result(self.testcases[0]),
+             self.result(self.testcases[1], success=False)])
+        self.assertEqual(len(self.evaluations()), 1)
+        self.assertEqual(self.submission_result().evaluation_tries, 1)
+
+    def test_fallback(self):
+        # Without a submission result the bulk insertion fails, and the
+        # results are written one by one, creating it.
+        self.service.write_results(
+            [self.result(testcase) for testcase in self.testcases])
+        self.assertEqual(len(self.evaluations()), 3)
+        self.assertIsNotNone(self.submission_result())
+
+
+class TestPostponeIrrelevantEvaluations(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("cms.service.EvaluationService.config."
+                        "postpone_irrelevant_evaluations", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.contest = self.add_contest()
+        task = self.add_task(contest=self.contest)
+        # Testcase 2 cannot change the score once testcase 1 failed.
+        self.dataset = self.add_dataset(
+            task=task, score_type="GroupMin",
+            score_type_parameters=[[50, 2], [50, 1]])
+        task.active_dataset = self.dataset
+        self.testcases = [self.add_testcase(self.dataset, codename=codename)
+                          for codename in ["1", "2", "3"]]
+        self.submission = self.add_submission(task=task)
+        self.add_submission_result(self.submission, self.dataset,
+                                   compilation_outcome="ok")
+        self.session.commit()
+        self.service = make_service(self.contest.id)
+        self.executor = self.service.get_executor()
+        self.operations = [
+            ESOperation(ESOperation.EVALUATION, self.submission.id,
+                        self.dataset.id, testcase.codename)
+            for testcase in self.testcases]
+
+    def result(self, operation, outcome):
+        job = EvaluationJob(
+            operation=operation, shard=1, sandboxes=["/tmp/box"],
+            success=True, outcome=outcome, text=["Output"],
+            plus={"execution_time": 0.5, "execution_wall_clock_time": 0.6,
+                  "execution_memory": 1024})
+        return operation, Result(job, True)
+
+    def submission_result(self):
+        self.session.expire_all()
+        return SubmissionResult.get_from_id(
+            (self.submission.id, self.dataset.id), self.session)
+
+    def priorities(self):
+        return dict((operation, priority) for operation, priority, _
+                    in self.executor.get_operations())
+
+    def test_score_without_irrelevant_evaluations(self):
+        for operation in self.operations[1:]:
+            self.executor.enqueue(operation, PriorityQueue.PRIORITY_MEDIUM,
+                                  make_datetime())
+
+        self.service.write_results(
+            [self.result(self.operations[0], "0.0")])
+        self.assertEqual(
+            self.priorities(),
+            {self.operations[1]: PriorityQueue.PRIORITY_EXTRA_LOW,
+             self.operations[2]: PriorityQueue.PRIORITY_MEDIUM})
+        self.assertFalse(self.submission_result().evaluated())
+
+        # The cumulative status follows the change of priority.
+        self.assertEqual(
+            sorted(entry["priority"]
+                   for entry
+                   in self.executor.queue_status_cumulative.values()),
+            [PriorityQueue.PRIORITY_MEDIUM,
+             PriorityQueue.PRIORITY_EXTRA_LOW])
+        self.assertEqual(self.executor._pop().item, self.operations[2])
+
+        # Only the postponed evaluation is missing: it can be scored.
+        self.service.write_results(
+            [self.result(self.operations[2], "1.0")])
+        submission_result = self.submission_result()
+        self.assertTrue(submission_result.evaluated())
+        submission_result.score = 50.0
+        submission_result.public_score = 50.0
+        submission_result.score_details = []
+        submission_result.public_score_details = []
+        submission_result.ranking_score_details = ["50"]
+        self.session.commit()
+
+        # The postponed evaluation completes the feedback, and the
+        # submission result is scored again.
+        self.service.write_results(
+            [self.result(self.operations[1], "1.0")])
+        submission_result = self.submission_result()
+        self.assertEqual(len(submission_result.evaluations), 3)
+        self.assertFalse(submission_result.scored())
+
+    def evaluate_relevant(self):
+        """Write the results of the testcases changing the score, so
+        that only the evaluation of testcase 2 is postponed.
+
+        """
+        self.service.write_results(
+            [self.result(self.operations[0], "0.0"),
+             self.result(self.operations[2], "1.0")])
+        self.assertTrue(self.submission_result().evaluated())
+
+    def test_postponed_after_restart(self):
+        self.evaluate_relevant()
+
+        # A new ES finds the postponed evaluation, and keeps it if it
+        # was restored from the snapshot of the queue.
+        service = make_service(self.contest.id)
+        service._restored_operations = {self.operations[1]}
+        service.get_executor().enqueue(
+            self.operations[1], PriorityQueue.PRIORITY_MEDIUM,
+            make_datetime())
+        service._missing_operations()
+        self.assertEqual(
+            [(operation, priority) for operation, priority, _
+             in service.get_executor().get_operations()],
+            [(self.operations[1], PriorityQueue.PRIORITY_MEDIUM)])
+
+        service = make_service(self.contest.id)
+        service._missing_operations()
+        self.assertEqual(
+            [(operation, priority) for operation, priority, _
+             in service.get_executor().get_operations()],
+            [(self.operations[1], PriorityQueue.PRIORITY_EXTRA_LOW)])
+
+    def test_postponed_failure(self):
+        self.evaluate_relevant()
+        self.assertEqual(self.executor._pop().item, self.operations[1])
+
+        # A failed postponed evaluation is tried again.
+        self.service.write_results(
+            [(self.operations[1],
+              Result(EvaluationJob(operation=self.operations[1]), False))])
+        self.assertEqual(self.submission_result().evaluation_tries, 1)
+        self.assertEqual(
+            self.priorities(),
+            {self.operations[1]: PriorityQueue.PRIORITY_EXTRA_LOW})
+
+        # Up to the maximum number of tries.
+        self.executor._pop()
+        submission_result = self.submission_result()
+        submission_result.evaluation_tries = \
+            EvaluationService.MAX_EVALUATION_TRIES - 1
+        self.session.commit()
+        self.service.write_results(
+            [(self.operations[1],
+              Result(EvaluationJob(operation=self.operations[1]), False))])
+        self.assertEqual(self.priorities(), {})
+
+    @patch("cms.service.EvaluationService.config."
+           "postpone_irrelevant_evaluations", False)
+    def test_disabled(self):
+        self.service.write_results(
+            [self.result(operation, "0.0")
+             for operation in self.operations[::2]])
+        self.assertFalse(self.submission_result().evaluated())
+
+
+class TestBatchSizing(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch(
+            "cms.service.EvaluationService.config.batch_target_time", 2.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = make_service(None).get_executor()
+
+    @staticmethod
+    def operation(codename, dataset_id=1):
+        return ESOperation(ESOperation.EVALUATION, 1, dataset_id, codename)
+
+    def entries(self, operations):
+        return [QueueEntry(operation, PriorityQueue.PRIORITY_MEDIUM,
+                           make_datetime(), index)
+                for index, operation in enumerate(operations)]
+
+    def job(self, operation, duration):
+        return EvaluationJob(
+            operation=operation,
+            plus={"execution_wall_clock_time": duration}
+            if duration is not None else None)
+
+    def test_short_operations(self):
+        self.executor.jobs_done(
+            [self.job(self.operation("1"), 0.25)], busy_time=0.5)
+        # Other testcases of the same dataset are estimated to be as
+        # short.
+        entries = self.entries(
+            [self.operation("%d" % i) for i in range(7)])
+        self.assertFalse(self.executor.batch_is_full(entries))
+        entries = self.entries(
+            [self.operation("%d" % i) for i in range(8)])
+        self.assertTrue(self.executor.batch_is_full(entries))
+
+    def test_max_operations(self):
+        # The operations are still shared among the workers.
+        workers = len(self.executor.pool)
+        for i in range(2 * workers):
+            self.executor.enqueue(self.operation("%d" % i),
+                                  PriorityQueue.PRIORITY_MEDIUM,
+                                  make_datetime())
+        self.assertEqual(self.executor.max_operations_per_batch(), 3)
+        for i in range(2 * workers, 100 * workers):
+            self.executor.enqueue(self.operation("%d" % i),
+                                  PriorityQueue.PRIORITY_MEDIUM,
+                                  make_datetime())
+        self.assertEqual(self.executor.max_operations_per_batch(),
+                         self.executor.MAX_OPERATIONS_PER_BATCH)
+
+    def test_long_operations(self):
+        self.executor.jobs_done(
+            [self.job(self.operation("1", dataset_id=2), 3.0)],
+            busy_time=3.5)
+        self.assertTrue(self.executor.batch_is_full(
+            self.entries([self.operation("1", dataset_id=2)])))
+        # Unknown kinds of operations get the default estimate.
+        self.assertFalse(self.executor.batch_is_full(
+            self.entries([self.operation("1", dataset_id=3)])))
+
+    def test_busy_time(self):
+        # The job without a duration gets what remains of the time
+        # the worker was busy.
+        self.executor.jobs_done(
+            [self.job(self.operation("1"), 0.5),
+             self.job(self.operation("2"), None)], busy_time=2.5)
+        self.assertAlmostEqual(
+            self.executor.durations.estimate(self.operation("2")), 2.0)
+
+    @patch("cms.service.EvaluationService.config.batch_target_time", 0.0)
+    def test_disabled(self):
+        self.assertFalse(self.executor.batch_is_full(
+            self.entries([self.operation("%d" % i) for i in range(100)])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -34,7 +34,11 @@ import gevent
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
+from cms.db import ParticipationTaskScore, SubmissionResult
+from cms.grading.scoretypes import ScoreTypeGroup, \
+    SubmissionResultColumns
 from cms.service.ScoringService import ScoringService
+from cms.service.scoringpool import ScoringPool
 from cmstestsuite.unit_tests.testidgenerator import unique_long_id, \
     unique_unicode_id
 
@@ -53,12 +57,14 @@ class TestScoringService(DatabaseMixin, unittest.TestCase):
         self.score_type = patcher.start().return_value
         self.addCleanup(patcher.stop)
         self.call_args = list()
+        self.call_types = list()
         self.score_type.compute_score.side_effect = self.compute_score
 
         self.contest = self.add_contest()
 
     def compute_score(self, sr):
         self.call_args.append((sr.submission_id, sr.dataset_id))
+        self.call_types.append(type(sr))
         return self.score_info
 
     def new_sr_to_score(self):
@@ -121,6 +127,28 @@ class TestScoringService(DatabaseMixin, unittest.TestCase):
                               [(sr_a.submission_id, sr_a.dataset_id),
                                (sr_b.submission_id, sr_b.dataset_id)])
 
+    def test_new_evaluation_active_dataset(self):
+        """The score of the participation on the task is updated.
+
+        """
+        sr = self.new_sr_to_score()
+        sr.submission.task.active_dataset = sr.dataset
+        self.session.commit()
+
+        service = ScoringService(0)
+        service.new_evaluation(sr.submission_id, sr.dataset_id)
+
+        gevent.sleep(0.1)  # Needed to trigger the score loop.
+
+        task_score = self.session.query(ParticipationTaskScore).one()
+        self.assertEqual((task_score.participation_id, task_score.task_id,
+                          task_score.dataset_id),
+                         (sr.submission.participation_id,
+                          sr.submission.task_id, sr.dataset_id))
+        self.assertEqual((task_score.score, task_score.public_score,
+                          task_score.partial),
+                         (self.score_info[0], self.score_info[2], False))
+
     def test_new_evaluation_already_scored(self):
         """One submission is not re-scored if already scored.
 
@@ -136,6 +164,113 @@ class TestScoringService(DatabaseMixin, unittest.TestCase):
         # Asserts that compute_score was called.
         self.score_type.compute_score.assert_not_called()
 
+    def test_new_evaluation_views(self):
+        """Only the score types using them get the columnar views.
+
+        """
+        sr_a = self.new_sr_to_score()
+        sr_b = self.new_sr_to_score()
+        sr_b.dataset.score_type = "Sum"
+        self.session.commit()
+
+        service = ScoringService(0)
+        service.new_evaluation(sr_a.submission_id, sr_a.dataset_id)
+        gevent.sleep(0.1)  # Needed to trigger the score loop.
+        service.new_evaluation(sr_b.submission_id, sr_b.dataset_id)
+        gevent.sleep(0.1)
+
+        self.assertEqual(self.call_types,
+                         [SubmissionResult, SubmissionResultColumns])
+
+    def test_new_evaluation_views_subclass(self):
+        """Subclasses of the abstract score types do not get the
+        columnar views unless they ask for them.
+
+        """
+        class CustomGroup(ScoreTypeGroup):
+            pass
+
+        sr = self.new_sr_to_score()
+        self.session.commit()
+
+        with patch("cms.service.ScoringService.get_score_type_class",
+                   return_value=CustomGroup):
+            service = ScoringService(0)
+            service.new_evaluation(sr.submission_id, sr.dataset_id)
+            gevent.sleep(0.1)  # Needed to trigger the score loop.
+
+        self.assertEqual(self.call_types, [SubmissionResult])
+
+    def test_new_evaluation_many(self):
+        """Many submissions are scored together, despite errors.
+
+        """
+        srs = [self.new_sr_to_score() for _ in range(5)]
+        self.session.commit()
+
+        service = ScoringService(0)
+        # A result that does not exist.
+        service.new_evaluation(srs[0].submission_id, srs[1].dataset_id)
+        for sr in srs:
+            service.new_evaluation(sr.submission_id, sr.dataset_id)
+
+        gevent.sleep(0.1)  # Needed to trigger the score loop.
+
+        self.assertCountEqual(self.call_args,
+                              [(sr.submission_id, sr.dataset_id)
+                               for sr in srs])
+        for sr in srs:
+            self.session.expire(sr)
+            self.assertEqual(sr.score, self.score_info[0])
+
+
+class TestScoringProcesses(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch(
+            "cms.service.ScoringService.config.scoring_processes", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        task = self.add_task(contest=self.add_contest())
+        dataset = self.add_dataset(task=task, score_type="Sum",
+                                   score_type_parameters=10)
+        task.active_dataset = dataset
+        testcases = [self.add_testcase(dataset, codename="%d" % i)
+                     for i in range(2)]
+        self.srs = []
+        for i in range(3):
+            sr = self.add_submission_result(
+                self.add_submission(task=task), dataset,
+                compilation_outcome="ok", evaluation_outcome="ok")
+            for j, testcase in enumerate(testcases):
+                self.add_evaluation(sr, testcase,
+                                    outcome="1.0" if j <= i else "0.0")
+            self.srs.append(sr)
+        self.session.commit()
+
+    def test_scores(self):
+        service = ScoringService(0)
+        # The scores are not computed in the service.
+        with patch("cms.db.Dataset.score_type_object",
+                   new_callable=PropertyMock, side_effect=AssertionError), \
+                patch.object(ScoringPool, "compute_scores", autospec=True,
+                             side_effect=ScoringPool.compute_scores) \
+                as compute:
+            for sr in self.srs:
+                service.new_evaluation(sr.submission_id, sr.dataset_id)
+            # Give time to the processes to start.
+            for _ in range(300):
+                gevent.sleep(0.1)
+                self.session.expire_all()
+                if all(sr.score is not None for sr in self.srs):
+                    break
+
+        compute.assert_called()
+        self.assertEqual([sr.score for sr in self.srs], [10.0, 20.0, 20.0])
+        self.assertEqual(self.srs[0].ranking_score_details, [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -249,6 +249,49 @@ class TestWorker(unittest.TestCase):
             JobGroup.import_from_dict(
                 self.service.execute_job_group(job_groups[0].export_to_dict()))
 
+    def test_execute_job_group_parallel(self):
+        """Executes a job group running two jobs at a time.
+
+        """
+        service = Worker(0, parallel_jobs=2)
+        n_jobs = 5
+        job_groups, calls = TestWorker.new_job_groups([n_jobs])
+        task_type = FakeTaskType([0.01] * n_jobs)
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        result = JobGroup.import_from_dict(
+            service.execute_job_group(job_groups[0].export_to_dict()))
+
+        for job in result.jobs:
+            self.assertTrue(job.success)
+        cms.service.Worker.get_task_type.assert_has_calls(calls)
+        self.assertEqual(task_type.call_count, n_jobs)
+        self.assertEqual(task_type.max_running, 2)
+
+    def test_execute_job_group_parallel_exceptions(self):
+        """Executes a job group running two jobs at a time, with some
+        exceptions.
+
+        """
+        service = Worker(0, parallel_jobs=2)
+        n_jobs = 4
+        job_groups, unused_calls = TestWorker.new_job_groups([n_jobs])
+        task_type = FakeTaskType([0.01, Exception(), 0.01, True])
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        with self.assertRaises(JobException):
+            JobGroup.import_from_dict(
+                service.execute_job_group(job_groups[0].export_to_dict()))
+        # All jobs are executed anyway.
+        self.assertEqual(task_type.call_count, n_jobs)
+
+    def test_too_many_slots(self):
+        """Refuses to use box ids beyond the ones isolate has.
+
+        """
+        with self.assertRaises(ValueError):
+            Worker(0, parallel_jobs=100)
+
     @staticmethod
     def new_jobs(number_of_jobs, prefix=None):
         prefix = prefix if prefix is not None else ""
@@ -288,6 +331,8 @@ class FakeTaskType:
         self.execute_results = execute_results
         self.index = 0
         self.call_count = 0
+        self.running = 0
+        self.max_running = 0
 
     def execute_job(self, job, file_cacher):
         self.call_count += 1
@@ -302,7 +347,10 @@ class FakeTaskType:
         else:
             # Float: wait the number of seconds.
             job.success = True
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
             gevent.sleep(result)
+            self.running -= 1
 
     def set_results(self, results):
         self.execute_results = results
@@ -22,13 +22,16 @@ functions to compute them).
 """
 
 import unittest
+from unittest.mock import patch
 
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
 from cms.io.priorityqueue import PriorityQueue
-from cms.service.esoperations import ESOperation, get_submissions_operations, \
-    get_user_tests_operations
+from cms.service.esoperations import ESOperation, \
+    find_reusable_evaluation, find_reusable_evaluations, \
+    get_submissions_operations, get_user_tests_operations
+from cmstestsuite.unit_tests.testidgenerator import unique_digest
 
 
 class TestESOperations(DatabaseMixin, unittest.TestCase):
@@ -201,6 +204,64 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             set(get_submissions_operations(self.session, self.contest.id)),
             expected_operations)
 
+    def add_postponed_evaluations(self):
+        """Add a submission evaluated without one of its testcases, as
+        done when postponing the irrelevant evaluations.
+
+        """
+        submission, results = self.add_submission_with_results(
+            self.tasks[0], self.participation, True)
+        postponed_codenames = dict()
+        for result in results:
+            codenames = sorted(result.dataset.testcases.keys())
+            for codename in codenames[1:]:
+                self.add_evaluation(
+                    result, result.dataset.testcases[codename])
+            result.set_evaluation_outcome()
+            postponed_codenames[result] = codenames[0]
+        self.session.flush()
+        return postponed_codenames
+
+    @patch("cms.service.esoperations.config."
+           "postpone_irrelevant_evaluations", True)
+    def test_get_submissions_operations_postponed(self):
+        """Test for an evaluated submission with postponed evaluations,
+        that are done last.
+
+        """
+        postponed_codenames = self.add_postponed_evaluations()
+
+        expected_operations = set(
+            (ESOperation(ESOperation.EVALUATION, result.submission.id,
+                         result.dataset.id, codename),
+             PriorityQueue.PRIORITY_EXTRA_LOW, result.submission.timestamp)
+            for result, codename in postponed_codenames.items()
+            if self.to_judge(result.dataset))
+
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id)),
+            expected_operations)
+
+        # Up to the maximum number of tries.
+        for result in postponed_codenames:
+            result.evaluation_tries = 25
+        self.session.flush()
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id)),
+            set())
+
+    @patch("cms.service.esoperations.config."
+           "postpone_irrelevant_evaluations", False)
+    def test_get_submissions_operations_postponed_disabled(self):
+        """Test for an evaluated submission with missing evaluations,
+        when they are not postponed.
+
+        """
+        self.add_postponed_evaluations()
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id)),
+            set())
+
     def test_get_submissions_operations_mixed(self):
         """Test with many different submission statuses."""
         expected_operations = set()
@@ -240,6 +301,36 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             set(get_submissions_operations(self.session, self.contest.id)),
             expected_operations)
 
+    def test_get_submissions_operations_watermark(self):
+        """Test that only new submissions and datasets are checked."""
+        old_submission = self.add_submission(
+            self.tasks[0], self.participation)
+        self.session.flush()
+        watermark = (old_submission.id,
+                     max(dataset.id for dataset in self.datasets))
+
+        new_submission = self.add_submission(
+            self.tasks[0], self.participation)
+        self.session.flush()
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id,
+                                           watermark=watermark)),
+            set(self.submission_compilation_operation(new_submission, dataset)
+                for dataset in self.tasks[0].datasets
+                if self.to_judge(dataset)))
+
+        # A new dataset to judge needs all the submissions.
+        new_dataset = self.add_dataset(task=self.tasks[0], autojudge=True)
+        self.session.flush()
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id,
+                                           watermark=watermark)),
+            set(self.submission_compilation_operation(new_submission, dataset)
+                for dataset in self.tasks[0].datasets
+                if self.to_judge(dataset))
+            | {self.submission_compilation_operation(old_submission,
+                                                     new_dataset)})
+
     def submission_compilation_operation(
             self, submission, dataset, result=None):
         active_priority = PriorityQueue.PRIORITY_HIGH \
@@ -421,5 +512,96 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             dataset.task.active_dataset_id == dataset.id)
 
 
+class TestFindReusableEvaluation(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.task = self.add_task(contest=self.add_contest())
+        self.participation = self.add_participation(contest=self.task.contest)
+        self.old_dataset = self.add_dataset(
+            task=self.task, time_limit=1.0, memory_limit=256 * 1024 * 1024)
+        self.new_dataset = self.add_dataset(
+            task=self.task, time_limit=1.0, memory_limit=256 * 1024 * 1024)
+        checker_digest = unique_digest()
+        for dataset in [self.old_dataset, self.new_dataset]:
+            self.add_manager(dataset, filename="checker",
+                             digest=checker_digest)
+        input_digest, output_digest = unique_digest(), unique_digest()
+        self.old_testcase = self.add_testcase(
+            self.old_dataset, input=input_digest, output=output_digest)
+        self.new_testcase = self.add_testcase(
+            self.new_dataset, input=input_digest, output=output_digest)
+
+        self.submission = self.add_submission(self.task, self.participation)
+        self.old_result = self.add_submission_result(
+            self.submission, self.old_dataset)
+        self.new_result = self.add_submission_result(
+            self.submission, self.new_dataset)
+        executable_digest = unique_digest()
+        for result in [self.old_result, self.new_result]:
+            self.add_executable(result, filename="foo",
+                                digest=executable_digest)
+        self.evaluation = self.add_evaluation(
+            self.old_result, self.old_testcase, outcome="1.0")
+        self.session.flush()
+
+        self.operation = ESOperation(
+            ESOperation.EVALUATION, self.submission.id, self.new_dataset.id,
+            self.new_testcase.codename)
+
+    def tearDown(self):
+        self.session.close()
+        super().tearDown()
+
+    def find(self):
+        self.session.flush()
+        return find_reusable_evaluation(self.session, self.operation)
+
+    def test_found(self):
+        self.assertIs(self.find(), self.evaluation)
+
+    def test_disabled(self):
+        self.task.reuse_evaluations = False
+        self.assertIsNone(self.find())
+
+    def test_different_testcase(self):
+        self.new_testcase.output = unique_digest()
+        self.assertIsNone(self.find())
+
+    def test_different_limits(self):
+        self.new_dataset.time_limit = 2.0
+        self.assertIsNone(self.find())
+
+    def test_different_managers(self):
+        self.new_dataset.managers["checker"].digest = unique_digest()
+        self.assertIsNone(self.find())
+
+    def test_different_executables(self):
+        self.new_result.executables["foo"].digest = unique_digest()
+        self.assertIsNone(self.find())
+
+    def test_no_evaluation(self):
+        self.session.delete(self.evaluation)
+        self.assertIsNone(self.find())
+
+    def test_bulk(self):
+        other_testcase = self.add_testcase(self.new_dataset)
+        other_operation = ESOperation(
+            ESOperation.EVALUATION, self.submission.id, self.new_dataset.id,
+            other_testcase.codename)
+        compilation = ESOperation(
+            ESOperation.COMPILATION, self.submission.id, self.new_dataset.id)
+        self.session.flush()
+        self.assertEqual(
+            find_reusable_evaluations(
+                self.session,
+                [self.operation, other_operation, compilation]),
+            {self.operation: self.evaluation})
+
+    def test_single_dataset(self):
+        self.session.delete(self.old_dataset)
+        self.assertIsNone(self.find())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the scheduling policies of EvaluationService."""
+
+import unittest
+from unittest.mock import Mock
+
+from cms.io import PriorityQueue
+from cms.service.esoperations import ESOperation
+from cms.service.schedulingpolicy import DurationEstimator, \
+    get_scheduling_policy
+from cmscommon.datetime import make_datetime
+
+
+# The participation of each submission.
+PARTICIPATIONS = {1: "p1", 2: "p1", 3: "p2", 4: "p3"}
+
+
+def get_flow(operation):
+    return PARTICIPATIONS[operation.object_id]
+
+
+def evaluation(submission_id, codename, dataset_id=1):
+    return ESOperation(ESOperation.EVALUATION, submission_id, dataset_id,
+                       codename)
+
+
+class SchedulingPolicyMixin:
+
+    def setUp(self):
+        super().setUp()
+        self.queue = PriorityQueue()
+        self.time = 0
+
+    def push(self, operation, priority=PriorityQueue.PRIORITY_MEDIUM):
+        self.time += 1
+        timestamp = make_datetime(self.time)
+        self.queue.push(operation, priority, timestamp,
+                        self.policy.rank(operation, priority, timestamp))
+
+    def pop(self):
+        entry = self.queue.pop()
+        self.policy.operation_extracted(entry)
+        return entry.item
+
+    def pop_all(self):
+        res = []
+        while not self.queue.empty():
+            res.append(self.pop())
+        return res
+
+
+class TestFifo(SchedulingPolicyMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.policy = get_scheduling_policy("fifo", get_flow)
+
+    def test_order(self):
+        operations = [evaluation(1, "%d" % i) for i in range(3)] \
+            + [evaluation(3, "0")]
+        for operation in operations:
+            self.push(operation)
+        self.assertEqual(self.pop_all(), operations)
+
+
+class TestFair(SchedulingPolicyMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.policy = get_scheduling_policy("fair", get_flow)
+
+    def test_round_robin(self):
+        for submission_id in [1, 2]:
+            for i in range(3):
+                self.push(evaluation(submission_id, "%d" % i))
+        self.push(evaluation(3, "0"))
+        self.push(evaluation(3, "1"))
+        self.push(evaluation(4, "0"))
+
+        self.assertEqual(self.pop_all(), [
+            evaluation(1, "0"), evaluation(3, "0"), evaluation(4, "0"),
+            evaluation(1, "1"), evaluation(3, "1"),
+            evaluation(1, "2"), evaluation(2, "0"), evaluation(2, "1"),
+            evaluation(2, "2")])
+
+    def test_late_flow(self):
+        # A participation enqueuing after many operations of another
+        # one were executed does not get a burst of operations.
+        for i in range(6):
+            self.push(evaluation(1, "%d" % i))
+        for _ in range(3):
+            self.pop()
+        self.push(evaluation(3, "0"))
+        self.push(evaluation(3, "1"))
+
+        self.assertEqual(self.pop_all(), [
+            evaluation(3, "0"), evaluation(1, "3"), evaluation(3, "1"),
+            evaluation(1, "4"), evaluation(1, "5")])
+
+    def test_priority_first(self):
+        for i in range(3):
+            self.push(evaluation(1, "%d" % i))
+        self.push(evaluation(3, "0"), PriorityQueue.PRIORITY_LOW)
+        self.assertEqual(self.pop_all()[-1], evaluation(3, "0"))
+
+
+class TestFairCost(SchedulingPolicyMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.policy = get_scheduling_policy("fair_cost", get_flow)
+
+    def done(self, operation, duration):
+        self.policy.operation_done(
+            operation, Mock(plus={"execution_wall_clock_time": duration}))
+
+    def test_slow_testcases(self):
+        # Testcases of dataset 1 take 3 seconds, of dataset 2 one.
+        for i in range(2):
+            self.done(evaluation(1, "%d" % i, dataset_id=1), 3.0)
+            self.done(evaluation(3, "%d" % i, dataset_id=2), 1.0)
+
+        for i in range(2):
+            self.push(evaluation(1, "%d" % i, dataset_id=1))
+        for i in range(2):
+            self.push(evaluation(3, "%d" % i, dataset_id=2))
+
+        self.assertEqual(self.pop_all(), [
+            evaluation(1, "0", dataset_id=1),
+            evaluation(3, "0", dataset_id=2),
+            evaluation(3, "1", dataset_id=2),
+            evaluation(1, "1", dataset_id=1)])
+
+    def test_no_stats(self):
+        self.policy.operation_done(evaluation(1, "0"), Mock(plus=None))
+        self.assertEqual(self.policy.cost(evaluation(1, "0")), 1.0)
+
+
+class TestDurationEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.durations = DurationEstimator()
+
+    def test_kinds(self):
+        self.durations.add(evaluation(1, "0", dataset_id=1), 3.0)
+        # Same testcase, other testcase of the dataset, other dataset.
+        self.assertEqual(
+            self.durations.estimate(evaluation(2, "0", dataset_id=1)), 3.0)
+        self.assertEqual(
+            self.durations.estimate(evaluation(2, "1", dataset_id=1)), 3.0)
+        self.assertAlmostEqual(
+            self.durations.estimate(evaluation(2, "0", dataset_id=2)),
+            1.0 + DurationEstimator.ALPHA * 2.0)
+
+    def test_moving_average(self):
+        self.durations.add(evaluation(1, "0"), 1.0)
+        self.durations.add(evaluation(1, "0"), 2.0)
+        self.assertAlmostEqual(self.durations.estimate(evaluation(1, "0")),
+                               1.0 + DurationEstimator.ALPHA)
+
+    def test_min_duration(self):
+        self.durations.add(evaluation(1, "0"), 0.0)
+        self.assertEqual(self.durations.estimate(evaluation(1, "0")),
+                         DurationEstimator.MIN_DURATION)
+
+
+class TestGetSchedulingPolicy(unittest.TestCase):
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_scheduling_policy("lifo", get_flow)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the worker pool of EvaluationService."""
+
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+from cms import Address, ServiceCoord
+from cms.db import Executable
+from cms.grading.Job import EvaluationJob, JobGroup
+from cms.service.esoperations import ESOperation
+from cms.service.workerpool import WorkerPool
+
+
+# The machine of each worker.
+HOSTS = {0: "10.0.0.1", 1: "10.0.0.1", 2: "10.0.0.2", 3: "10.0.0.3"}
+
+
+def evaluation(submission_id, codename):
+    return ESOperation(ESOperation.EVALUATION, submission_id, 1, codename)
+
+
+def from_operations(operations, unused_session):
+    return JobGroup([
+        EvaluationJob(operation=operation,
+                      executables={"foo": Executable(
+                          "foo", "exe%d" % operation.object_id)},
+                      input="input%s" % operation.testcase_codename)
+        for operation in operations])
+
+
+class TestWorkerAffinity(unittest.TestCase):
+
+    def setUp(self):
+        self.service = Mock()
+        self.service.connect_to.side_effect = \
+            lambda coord, on_connect: Mock(connected=True)
+        for target, value in [
+                ("get_service_address",
+                 lambda coord: Address(HOSTS[coord.shard], 26000)),
+                ("SessionGen", MagicMock()),
+                ("JobGroup.from_operations", from_operations),
+                ("config.worker_affinity_wait", 0.0)]:
+            patcher = patch("cms.service.workerpool." + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.pool = WorkerPool(self.service)
+        for shard in HOSTS:
+            self.pool.add_worker(ServiceCoord("Worker", shard))
+
+    def acquire(self, operations):
+        return self.pool.acquire_worker(operations)
+
+    def test_prefers_machine_with_files(self):
+        shard = self.acquire([evaluation(1, "001")])
+        self.pool.release_worker(shard)
+        # Same executable, different input: any worker on the same
+        # machine is fine.
+        self.assertEqual(HOSTS[self.acquire([evaluation(1, "002")])],
+                         HOSTS[shard])
+
+    def test_best_overlap(self):
+        shard = self.acquire([evaluation(1, "001")])
+        other_shard = next(
+            s for s in HOSTS if HOSTS[s] != HOSTS[shard])
+        self.pool.release_worker(shard)
+        # Make all the workers on the first machine busy, so that the
+        # next operation goes elsewhere.
+        busy = [s for s in HOSTS if HOSTS[s] == HOSTS[shard]]
+        for s in busy:
+            self.pool._add_operations(s, [evaluation(10 + s, "001")])
+        self.pool._add_digests(other_shard, {"exe2"})
+        self.assertEqual(HOSTS[self.acquire([evaluation(2, "001")])],
+                         HOSTS[other_shard])
+
+    @patch("cms.service.workerpool.config.worker_affinity_wait", 60.0)
+    @patch("cms.service.workerpool.gevent.spawn_later")
+    def test_wait_for_busy_worker(self, spawn_later):
+        operations = [evaluation(1, "001")]
+        shard = self.acquire(operations)
+        # Another submission, with nothing in common, goes anywhere.
+        self.assertIsNotNone(self.acquire([evaluation(2, "009")]))
+        # Make the rest of the machine busy, too.
+        for s in HOSTS:
+            if HOSTS[s] == HOSTS[shard] and s != shard \
+                    and self.pool._operations[s] is None:
+                self.pool._add_operations(s, [evaluation(10 + s, "001")])
+
+        # The only worker with the executable is busy: wait for it.
+        self.assertIsNone(self.acquire([evaluation(1, "002")]))
+        spawn_later.assert_called_once()
+        self.pool.release_worker(shard)
+        self.assertEqual(self.acquire([evaluation(1, "002")]), shard)
+
+    @patch("cms.service.workerpool.config.worker_affinity_wait", 60.0)
+    @patch("cms.service.workerpool.gevent.spawn_later")
+    @patch("cms.service.workerpool.time.monotonic")
+    def test_wait_expires(self, monotonic, unused_spawn_later):
+        monotonic.return_value = 0.0
+        shard = self.acquire([evaluation(1, "001")])
+        for s in HOSTS:
+            if HOSTS[s] == HOSTS[shard] and s != shard:
+                self.pool._add_operations(s, [evaluation(10 + s, "001")])
+
+        self.assertIsNone(self.acquire([evaluation(1, "002")]))
+        monotonic.return_value = 61.0
+        other_shard = self.acquire([evaluation(1, "002")])
+        self.assertIsNotNone(other_shard)
+        self.assertNotEqual(HOSTS[other_shard], HOSTS[shard])
+
+    def test_bounded_memory(self):
+        with patch.object(WorkerPool, "AFFINITY_SIZE", 3):
+            self.pool._add_digests(0, {"a", "b"})
+            self.pool._add_digests(0, {"c", "d"})
+            self.assertEqual(len(self.pool._recent_digests[HOSTS[0]]), 3)
+            self.assertIn("c", self.pool._recent_digests[HOSTS[0]])
+
+
+if __name__ == "__main__":
+    unittest.main()